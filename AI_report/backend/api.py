@@ -1,8 +1,30 @@
-from fastapi import FastAPI, Query, HTTPException
+import asyncio
+import gzip
+import hashlib
+import json
+
+from fastapi import FastAPI, Query, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+import planner
+import schedule
+import storage
+from storage import retrieve_data, retrieve_data_async
+
+try:
+    import brotli
+except ImportError:  # 沒有安裝 brotli 時只提供 gzip
+    brotli = None
 
-from storage import retrieve_data
-from storage import _cache
+# /api/tick 沒有指定 names 時回傳的角色 (角色名冊中的所有角色)
+AGENT_NAMES = [agent.name for agent in schedule.agents.values()]
+# /api/tick 最多等待的秒數
+MAX_TICK_WAIT = 10
+# /api/events 沒有新資料時送出 keep-alive 的間隔秒數
+EVENT_KEEPALIVE = 15
+# 已產生完成的整天行程 (壓縮後) 最多保留幾份
+DAY_PAYLOAD_CACHE_SIZE = 64
 
 app = FastAPI()
 
@@ -20,10 +42,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],           # GET, POST, PUT, DELETE…
     allow_headers=["*"],           # 所有 request headers
+    expose_headers=["ETag"],
 )
 
+@app.get('/api/agents')
+async def get_agents():
+    """
+    名冊中的所有角色 (依名冊順序)，前端以此決定要查詢與顯示哪些角色
+    """
+    return {"agents": [{"id": agent_id, "name": agent.name}
+                       for agent_id, agent in schedule.agents.items()]}
+
+
 @app.get('/api/status')
-def get_status(time: str = Query(None), name: str = Query(None)):
+async def get_status(time: str = Query(None), name: str = Query(None)):
     if not time or not name:
         raise HTTPException(status_code=400, detail="缺少必要的參數 (time 或 name)")
 
@@ -33,11 +65,13 @@ def get_status(time: str = Query(None), name: str = Query(None)):
         "status": f"{name} 在 {time} 時的狀態"
     }
     print("接收到請求", "正在查詢", f"{name} 在 {time} 時的狀態")
-    response = retrieve_data(
+    # lazy planning 模式下，還沒產生的時段會立即排入產生，並預先產生接下來的時段
+    planner.demand(name, time)
+    # 等待期間不佔用 thread pool，大量請求同時等待尚未產生的時段也不會塞住其他請求
+    response = await retrieve_data_async(
         f"sch_{name}_15_minute_{time}",
         2
     )
-    print(_cache.keys())
     print(f"sch_{name}_15_minute_{time}")
     # print(_cache[f"sch_{name}_15_minute_{time}"])
 
@@ -45,10 +79,244 @@ def get_status(time: str = Query(None), name: str = Query(None)):
 
 
 @app.get('/api/check_poem')
-def check_poem(time: str = Query(None), name: str = Query(None)):
+async def check_poem(time: str = Query(None), name: str = Query(None)):
     if not time or not name:
         raise HTTPException(status_code=400, detail="缺少必要的參數 (time 或 name)")
     key = f"trigger_{name}_{time}"
-    response = retrieve_data(key, 2)
+    response = await retrieve_data_async(key, 2)
     
     return response
+
+
+async def _tick_poem(name: str, time: str, timeout: float):
+    # 每個時段判斷完成後都會寫入 trigger_ (沒有觸發時為 False)，通常等 trigger 出現即可；
+    # 該角色整天的完成標記只是後備，時段不在行程中 (例如 time 格式不符) 時不必等到逾時
+    key = f"trigger_{name}_{time}"
+    if retrieve_data(f"sch_{name}_done", 0):
+        return retrieve_data(key, 0)
+    waits = [asyncio.ensure_future(retrieve_data_async(key, timeout)),
+             asyncio.ensure_future(
+                 retrieve_data_async(f"sch_{name}_done", timeout))]
+    await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+    for task in waits:
+        task.cancel()
+    return retrieve_data(key, 0)
+
+
+@app.get('/api/tick')
+async def tick(time: str = Query(None), names: list[str] = Query(None),
+               wait: float = Query(2)):
+    """
+    一次取得所有角色在 time 的狀態與詩詞，取代每個角色各打一次 /api/status 與 /api/check_poem
+
+    :param time: 時間，例如 '08:15'
+    :param names: 角色名稱，可重複或以逗號分隔，不指定則為全部角色
+    :param wait: 所有資料共用的等待秒數上限
+    """
+    if not time:
+        raise HTTPException(status_code=400, detail="缺少必要的參數 (time)")
+    if names:
+        names = [n for item in names for n in item.split(',') if n]
+    else:
+        names = AGENT_NAMES
+    timeout = max(0, min(wait, MAX_TICK_WAIT))
+    for name in names:
+        planner.demand(name, time)
+
+    # 所有等待同時開始，整個請求最多等 timeout 秒
+    results = await asyncio.gather(
+        *(retrieve_data_async(f"sch_{name}_15_minute_{time}", timeout)
+          for name in names),
+        *(_tick_poem(name, time, timeout) for name in names)
+    )
+    return {
+        "time": time,
+        "agents": {
+            name: {"status": results[i], "poem": results[len(names) + i]}
+            for i, name in enumerate(names)
+        }
+    }
+
+
+# (命名空間, 角色們) -> (etag, {編碼: body})，只存放已完成、內容不會再變的行程
+_day_payloads = {}
+
+
+def _day_data(names: list[str], namespace):
+    # 只列一次命名空間中的 key，依角色分組 (trigger_<name>_<hh:mm>)
+    triggers = {name: {} for name in names}
+    for key in storage.keys(namespace):
+        if not key.startswith('trigger_'):
+            continue
+        name, _, time = key[len('trigger_'):].rpartition('_')
+        if name in triggers:
+            triggers[name][time] = retrieve_data(key, 0, namespace)
+    days = {}
+    complete = True
+    for name in names:
+        days[name] = {
+            "slots": retrieve_data(f"sch_{name}_15_minute", 0, namespace),
+            "triggers": dict(sorted(triggers[name].items())),
+        }
+        complete = complete and bool(
+            retrieve_data(f"sch_{name}_done", 0, namespace))
+    return days, complete
+
+
+def _build_day(names: list[str], namespace):
+    # 在 thread pool 中執行：走訪 storage 與 json.dumps 不佔用 event loop
+    days, complete = _day_data(names, namespace)
+    body = json.dumps({"day": namespace, "complete": complete,
+                       "agents": days},
+                      ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return etag, {'identity': body}, complete
+
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _pick_encoding(accept_encoding: str) -> str:
+    accepted = {item.split(';')[0].strip() for item in accept_encoding.split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+@app.get('/api/day')
+async def get_day(request: Request, names: list[str] = Query(None),
+                  day: str = Query(None)):
+    """
+    一次取得角色一整天的行程與詩詞，讓前端下載一次後在本地逐格播放
+
+    :param names: 角色名稱，可重複或以逗號分隔，不指定則為全部角色
+    :param day: storage 的命名空間 (例如日期)，不指定則為目前這一天
+
+    產生完成的行程內容不會再改變：回傳以內容計算的 ETag，
+    之後帶 If-None-Match 重新驗證只會得到 304。
+    """
+    if names:
+        names = [n for item in names for n in item.split(',') if n]
+    else:
+        names = AGENT_NAMES
+    namespace = day or storage.current_namespace()
+    cache_key = (namespace, tuple(names))
+
+    cached = _day_payloads.get(cache_key)
+    if cached is None:
+        cached = await asyncio.to_thread(_build_day, names, namespace)
+        if cached[2]:
+            if len(_day_payloads) >= DAY_PAYLOAD_CACHE_SIZE:
+                _day_payloads.pop(next(iter(_day_payloads)))
+            _day_payloads[cache_key] = cached
+    etag, bodies, complete = cached
+
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if not complete:
+        # 還在產生中：內容會變，不讓瀏覽器或中間的 proxy 快取
+        headers["Cache-Control"] = "no-store"
+    elif day:
+        # 指定了哪一天，內容永遠不變
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        # 「今天」換日後會變成另一天，每次都要重新驗證 (只需要 304)
+        headers["Cache-Control"] = "public, no-cache"
+
+    if complete and _etag_matches(request.headers.get('if-none-match', ''),
+                                  etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = _pick_encoding(request.headers.get('accept-encoding', ''))
+    if encoding not in bodies:
+        # 壓縮也在 thread pool 中進行
+        bodies[encoding] = await asyncio.to_thread(
+            _encode, bodies['identity'], encoding)
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return Response(content=bodies[encoding], headers=headers,
+                    media_type="application/json")
+
+
+def _event_filter(names, prefixes, namespace):
+    owners = tuple(p for name in names
+                   for p in (f"sch_{name}_", f"trigger_{name}_"))
+    prefixes = tuple(prefixes)
+
+    def match(event):
+        _, event_namespace, key, _ = event
+        return (event_namespace == namespace and
+                (not owners or key.startswith(owners)) and
+                (not prefixes or key.startswith(prefixes)))
+    return match
+
+
+def _sse(event) -> str:
+    seq, namespace, key, data = event
+    payload = json.dumps({"key": key, "day": namespace, "data": data},
+                         ensure_ascii=False, default=str)
+    return f"id: {seq}\nevent: data\ndata: {payload}\n\n"
+
+
+@app.get('/api/events')
+async def events(request: Request, names: list[str] = Query(None),
+                 prefixes: list[str] = Query(None), since: int = Query(None),
+                 day: str = Query(None)):
+    """
+    以 Server-Sent Events 推播 add_data 寫入的資料，取代反覆輪詢 /api/status
+
+    :param names: 只推播這些角色的 key (sch_<name>_*、trigger_<name>_*)，不指定則全部
+    :param prefixes: 只推播以這些字串開頭的 key，例如 sch_、trigger_
+    :param since: 從這個序號之後開始推播；斷線重連時瀏覽器會自動帶 Last-Event-ID
+    :param day: storage 的命名空間，不指定則為目前這一天 (換日後改推播新的一天，並先送出 reset 事件)
+
+    無法接續 (紀錄已被擠掉，或伺服器重新啟動後序號重新計算) 時先送出 reset 事件，前端應改用 /api/day 重新取得整天資料。
+    """
+    names = [n for item in names or () for n in item.split(',') if n]
+    prefixes = [p for item in prefixes or () for p in item.split(',') if p]
+    last_id = request.headers.get('last-event-id')
+    if last_id and last_id.isdigit():
+        since = int(last_id)
+    namespace = day or storage.current_namespace()
+    match = _event_filter(names, prefixes, namespace)
+
+    async def stream():
+        nonlocal namespace, match
+        seq = storage.last_seq() if since is None else since
+        while True:
+            found, truncated = await storage.wait_events_async(
+                seq, EVENT_KEEPALIVE)
+            if await request.is_disconnected():
+                return
+            if not day and storage.current_namespace() != namespace:
+                # 換日了：改推播新的一天，前端收到 reset 後以 /api/day 重新取得整天資料
+                namespace = storage.current_namespace()
+                match = _event_filter(names, prefixes, namespace)
+                truncated = True
+            if truncated:
+                yield f"id: {storage.last_seq()}\nevent: reset\ndata: {{}}\n\n"
+                seq = storage.last_seq()
+                continue
+            if not found:
+                yield ": keep-alive\n\n"
+                continue
+            seq = found[-1][0]
+            chunk = ''.join(_sse(event) for event in found if match(event))
+            if chunk:
+                yield chunk
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
@@ -2,10 +2,12 @@
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request as flask_request
 from flask_cors import CORS
+import bisect
 import datetime
 import os
 import json
-from collections import deque
+from concurrent.futures import Future
+import threading
 import random
 import google.generativeai as genai
 import traceback
@@ -13,6 +15,10 @@ import requests  # <--- 新增導入 requests
 
 # --- 導入自訂設定 ---
 import config
+import llm
+from location_index import LocationIndex
+import roster
+from memory_stream import MemoryStream
 
 # --- API 金鑰設定 ---
 load_dotenv()
@@ -35,42 +41,85 @@ if not deepseek_api_key:
     print("警告：未找到 DEEPSEEK_API_KEY 環境變數。詩歌生成功能將無法使用。")
 
 
+def _llm_available():
+    # 設定 llm_provider (例如 mock) 時不需要 Gemini 金鑰
+    return bool(gemini_api_key) or bool(llm.PROVIDER_OVERRIDE)
+
+
+class _TextResponse:
+    # 把 llm.get_llm_response 的文字包成與 Gemini 回應相同的介面
+    candidates = []
+
+    def __init__(self, text):
+        self.text = text
+
+
+# --- 時辰/刻 <-> 序號 對照表 ---
+# 一天依 SHICHEN × TIME_UNITS 編成連續的整數序號，「子時初刻」與「子初刻」兩種寫法都查得到；
+# 日程比較時間只需比較整數，不必每次拆字串再 list.index。
+TIME_SLOTS = [f"{s}時{u}" for s in config.SHICHEN for u in config.TIME_UNITS]
+TIME_ORDER = {slot: order for order, slot in enumerate(TIME_SLOTS)}
+TIME_ORDER.update({slot.replace("時", "", 1): order
+                   for order, slot in enumerate(TIME_SLOTS)})
+# 無法解析的時間在舊的比較方式下與任何時間「相等」，索引中以此值表示
+_UNPARSED_ORDER = -1
+
+
 # --- Agent 類別定義 (與之前相同) ---
 class Agent:
-    def __init__(self, agent_id, name, persona_summary, initial_location="河川"):
+    def __init__(self, agent_id, name, persona_summary, initial_location="河川",
+                 location_index=None):
         self.agent_id = agent_id
         self.name = name
         self.persona_summary = persona_summary
+        # 所在地點的索引 (LocationIndex)，地點改變時自動更新；None 表示不登記
+        self._location_index = location_index
+        self._current_location = None
         self.current_location = initial_location
         self.current_action = "準備開始一天的生活"
         self.current_thought = "（新的一天，充滿未知。）"
         self.current_dialogue = ""
-        self.memory_stream = deque(maxlen=config.MAX_MEMORY_STREAM_LENGTH)
+        self.memory_stream = MemoryStream(config.MAX_MEMORY_STREAM_LENGTH)
         self.daily_schedule = []
         self.current_schedule_index = 0
         self.original_action_at_meeting_time = ""
+        # daily_schedule 的時間索引：有效事件的位置，與到該事件為止的最大時間序號 (非遞減，可 bisect)
+        self._schedule_index_of = None
+        self._schedule_positions = []
+        self._schedule_max_orders = []
+        self._next_day_plan = None  # 背景產生中的明天日程 (Future)
 
         self.safety_settings = config.LLM_SAFETY_SETTINGS
         self.generation_config = genai.types.GenerationConfig(
             **config.LLM_GENERATION_CONFIG)
 
+    @property
+    def current_location(self):
+        return self._current_location
+
+    @current_location.setter
+    def current_location(self, location):
+        old_location = self._current_location
+        self._current_location = location
+        if self._location_index is not None and location != old_location:
+            self._location_index.move(self, old_location, location)
+
     def add_memory(self, game_time_str, memory_type, description, importance,
                    related_agent_ids=None):
-        if related_agent_ids is None:
-            related_agent_ids = []
-        new_memory = {
-            "timestamp": game_time_str, "type": memory_type,
-            "description": description,
-            "importance": importance, "related_agents": related_agent_ids
-        }
-        self.memory_stream.append(new_memory)
+        self.memory_stream.append(game_time_str, memory_type, description,
+                                  importance, related_agent_ids or ())
 
     def observe_environment(self, game_time_str, all_agents_map):
-        agents_in_same_location = []
-        for other_agent_id, other_agent_obj in all_agents_map.items():
-            if other_agent_id != self.agent_id and \
-                    other_agent_obj.current_location == self.current_location:
-                agents_in_same_location.append(other_agent_obj)
+        if self._location_index is not None:
+            # 只看同一地點的角色，不必走訪所有角色
+            agents_here = self._location_index.at(self.current_location)
+        else:
+            agents_here = all_agents_map
+        agents_in_same_location = [
+            other_agent_obj
+            for other_agent_id, other_agent_obj in agents_here.items()
+            if other_agent_id != self.agent_id
+            and other_agent_obj.current_location == self.current_location]
         if agents_in_same_location:
             observed_names = ", ".join(
                 [a.name for a in agents_in_same_location])
@@ -80,49 +129,82 @@ class Agent:
                             3,
                             [a.agent_id for a in agents_in_same_location])
 
-    def _parse_time_to_indices(self, time_str_input):
-        if not isinstance(time_str_input, str):
-            return None, None
-        if '時' in time_str_input:
-            try:
-                s_str, u_str = time_str_input.split('時', 1)
-                s_idx = config.SHICHEN.index(s_str)
-                u_idx = config.TIME_UNITS.index(u_str)
-                return s_idx, u_idx
-            except (ValueError, IndexError):
-                pass
-        for s_len in range(len(config.SHICHEN[0]), 0, -1):
-            if len(time_str_input) > 1:
-                s_str_candidate = time_str_input[0]
-                u_str_candidate = time_str_input[1:]
-                try:
-                    s_idx = config.SHICHEN.index(s_str_candidate)
-                    u_idx = config.TIME_UNITS.index(u_str_candidate)
-                    return s_idx, u_idx
-                except (ValueError, IndexError):
-                    pass
-        return None, None
-
     def _compare_time_strings(self, time_str1, time_str2):
-        s1_idx, u1_idx = self._parse_time_to_indices(time_str1)
-        s2_idx, u2_idx = self._parse_time_to_indices(time_str2)
-        if s1_idx is None or s2_idx is None or\
-                u1_idx is None or u2_idx is None:
+        order1 = TIME_ORDER.get(time_str1) if isinstance(
+            time_str1, str) else None
+        order2 = TIME_ORDER.get(time_str2) if isinstance(
+            time_str2, str) else None
+        if order1 is None or order2 is None:
             return 0
-        if s1_idx < s2_idx:
-            return -1
-        if s1_idx > s2_idx:
-            return 1
-        if u1_idx < u2_idx:
-            return -1
-        if u1_idx > u2_idx:
-            return 1
-        return 0
+        return (order1 > order2) - (order1 < order2)
+
+    def _rebuild_schedule_index(self):
+        '''
+        將 daily_schedule 轉成可二分搜尋的索引，每份日程只做一次
+
+        update_action_for_time 原本逐一比較，遇到第一個晚於現在的事件就停；
+        以「到該事件為止的最大序號」建索引，bisect 找到的位置與逐一比較的結果相同。
+        '''
+        self._schedule_index_of = self.daily_schedule
+        self._schedule_positions = []
+        self._schedule_max_orders = []
+        if not isinstance(self.daily_schedule, list):
+            return
+        running_max = _UNPARSED_ORDER
+        for i, event in enumerate(self.daily_schedule):
+            if (
+                not isinstance(event, dict)
+                or not all(k in event
+                           for k in ["time_str", "location", "action"])
+            ):
+                continue
+            order = TIME_ORDER.get(event["time_str"], _UNPARSED_ORDER) \
+                if isinstance(event["time_str"], str) else _UNPARSED_ORDER
+            running_max = max(running_max, order)
+            self._schedule_positions.append(i)
+            self._schedule_max_orders.append(running_max)
+
+    def _ensure_schedule_index(self):
+        # daily_schedule 被整份換掉時重建
+        if self._schedule_index_of is not self.daily_schedule:
+            self._rebuild_schedule_index()
+
+    def _insert_schedule_event(self, event):
+        '''
+        依時間將事件插入 daily_schedule，並就地更新索引 (不重建)
+
+        :param event: 含 time_str、location、action 的事件，time_str 必須是可解析的時間
+        '''
+        self._ensure_schedule_index()
+        order = TIME_ORDER[event["time_str"]]
+        j = bisect.bisect_right(self._schedule_max_orders, order)
+        position = self._schedule_positions[j] \
+            if j < len(self._schedule_positions) else len(self.daily_schedule)
+        self.daily_schedule.insert(position, event)
+        # 插入點之前的最大序號都 <= order，之後的都 > order，因此只有新事件本身需要填入
+        self._schedule_positions[j:] = [position] + [
+            p + 1 for p in self._schedule_positions[j:]]
+        self._schedule_max_orders.insert(j, order)
+
+    def _latest_schedule_position(self, game_time_str):
+        '''
+        :param game_time_str: 遊戲時間，例如 '辰時三刻'
+        :return(int): 現在適用的事件在 daily_schedule 中的位置，尚未有事件開始時為 None
+        '''
+        self._ensure_schedule_index()
+        order = TIME_ORDER.get(game_time_str) if isinstance(
+            game_time_str, str) else None
+        if order is None:
+            # 無法解析的時間與所有事件「相等」，沿用最後一個事件
+            j = len(self._schedule_positions)
+        else:
+            j = bisect.bisect_right(self._schedule_max_orders, order)
+        return self._schedule_positions[j - 1] if j else None
 
     def _get_llm_response(self, prompt_text, purpose="", model_to_use=None):
         actual_model_name = model_to_use if model_to_use\
             else config.GEMINI_MODEL_NAME
-        if not gemini_api_key:
+        if not _llm_available():
             error_message = "錯誤：Gemini API 金鑰未設定或設定失敗。無法呼叫 LLM。"
             # print(error_message) # 減少控制台輸出
             if purpose == "daily_plan":
@@ -141,12 +223,17 @@ class Agent:
                 }
             return f"（{error_message}）"
         try:
-            model = genai.GenerativeModel(
-                model_name=actual_model_name,
-                safety_settings=self.safety_settings,
-                generation_config=self.generation_config
-            )
-            response = model.generate_content(prompt_text)
+            if llm.PROVIDER_OVERRIDE:
+                # 離線壓力測試：改走 llm.get_llm_response (例如 mock provider)
+                response = _TextResponse(llm.get_llm_response(
+                    prompt_text, 'gemini', actual_model_name))
+            else:
+                model = genai.GenerativeModel(
+                    model_name=actual_model_name,
+                    safety_settings=self.safety_settings,
+                    generation_config=self.generation_config
+                )
+                response = model.generate_content(prompt_text)
             generated_text = ""
             if response.candidates and hasattr(
                 response.candidates[0], 'content') and \
@@ -277,16 +364,15 @@ class Agent:
                 }
             return f"（Gemini API 呼叫錯誤 ({actual_model_name}): {str(e)[:100]}）"
 
-    def generate_daily_plan(self, current_date_str):
+    def _request_daily_plan(self, current_date_str):
         last_reflection = "昨日無特別反思。"
         if self.memory_stream:
             recent_memories = [
-                m["description"]
-                for m in list(
-                    self.memory_stream
-                )[-config.RECENT_MEMORIES_TO_RETURN:]
-                if m["type"] != "action_taken"
-                and "生成了新的日程計劃" not in m["description"]]
+                m.description
+                for m in self.memory_stream.latest(
+                    config.RECENT_MEMORIES_TO_RETURN)
+                if m.type != "action_taken"
+                and "生成了新的日程計劃" not in m.description]
             if recent_memories:
                 last_reflection = "最近的觀察和想法：" + "；".join(recent_memories)
 
@@ -295,8 +381,34 @@ class Agent:
             current_date_str=current_date_str, last_reflection=last_reflection,
             locations_list_str=", ".join(config.AVAILABLE_LOCATIONS)
         )
-        self.daily_schedule = self._get_llm_response(
-            prompt, purpose="daily_plan")
+        return self._get_llm_response(prompt, purpose="daily_plan")
+
+    def prepare_next_day_plan(self, current_date_str):
+        """在背景先產生明天的日程 (以目前為止的記憶為反思)，換日時直接套用"""
+        if self._next_day_plan is not None:
+            return
+        future = self._next_day_plan = Future()
+
+        def run():
+            try:
+                future.set_result(self._request_daily_plan(current_date_str))
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _take_next_day_plan(self):
+        # 背景產生已完成才使用，否則回傳 None 改為當場產生
+        future, self._next_day_plan = self._next_day_plan, None
+        if future is None or not future.done() or future.exception():
+            return None
+        return future.result()
+
+    def generate_daily_plan(self, current_date_str, use_prepared=False):
+        prepared = self._take_next_day_plan() if use_prepared else None
+        if prepared is not None:
+            self.daily_schedule = prepared
+        else:
+            self.daily_schedule = self._request_daily_plan(current_date_str)
         self.current_schedule_index = 0
 
         if (
@@ -333,17 +445,7 @@ class Agent:
                     "thought": f"（應該是約在這個時候在 {config.MEETING_LOCATION} 見面。）",
                     "dialogue": ""
                 }
-                inserted = False
-                for i, existing_event in enumerate(self.daily_schedule):
-                    if self._compare_time_strings(
-                        config.MEETING_TIME,
-                        existing_event.get("time_str", "")
-                    ) < 0:
-                        self.daily_schedule.insert(i, new_meeting_event)
-                        inserted = True
-                        break
-                if not inserted:
-                    self.daily_schedule.append(new_meeting_event)
+                self._insert_schedule_event(new_meeting_event)
 
         if (
             isinstance(self.daily_schedule, list)
@@ -393,21 +495,10 @@ class Agent:
 
         latest_applicable_event = None
         next_event_index_to_set = 0
-        for i, event in enumerate(self.daily_schedule):
-            if (
-                not isinstance(event, dict)
-                or not all(k in event
-                           for k in ["time_str", "location", "action"])
-            ):
-                continue
-            event_time_from_llm = event["time_str"]
-            comparison = self._compare_time_strings(
-                event_time_from_llm, game_time_str)
-            if comparison <= 0:
-                latest_applicable_event = event
-                next_event_index_to_set = i + 1
-            else:
-                break
+        position = self._latest_schedule_position(game_time_str)
+        if position is not None:
+            latest_applicable_event = self.daily_schedule[position]
+            next_event_index_to_set = position + 1
         self.current_schedule_index = next_event_index_to_set
 
         if latest_applicable_event:
@@ -481,6 +572,10 @@ class Agent:
 
 # --- 全域函式 ---
 
+# 會面對話參考的記憶類型 (各取最近的幾筆)
+MEETING_MEMORY_TYPES = ("observation_เห็น_คนอื่น", "action_taken",
+                        "dialogue_heard")
+
 
 def generate_meeting_dialogue(
     agent1: Agent,
@@ -493,17 +588,11 @@ def generate_meeting_dialogue(
     random.shuffle(speakers)
     first_speaker, second_speaker = speakers[0], speakers[1]
     agent1_mem = "; ".join(
-        [
-            m['description'] for m in list(agent1.memory_stream)[-3:]
-            if m['type'] in ["observation_เห็น_คนอื่น",
-                             "action_taken", "dialogue_heard"]]
-    )
+        m.description
+        for m in agent1.memory_stream.latest(3, MEETING_MEMORY_TYPES))
     agent2_mem = "; ".join(
-        [
-            m['description'] for m in list(agent2.memory_stream)[-3:]
-            if m['type'] in ["observation_เห็น_คนอื่น",
-                             "action_taken", "dialogue_heard"]]
-    )
+        m.description
+        for m in agent2.memory_stream.latest(3, MEETING_MEMORY_TYPES))
     prompt = config.MEETING_DIALOGUE_PROMPT_TEMPLATE.format(
         location=location,
         time_str=time_str,
@@ -553,6 +642,11 @@ def generate_meeting_dialogue(
 
 def get_deepseek_poem():
     """使用 DeepSeek API 生成一首詩"""
+    if llm.PROVIDER_OVERRIDE:
+        prompt_content = config.POEM_GENERATION_PROMPT_TEMPLATE.format(
+            theme=config.DEEPSEEK_POEM_PROMPT_THEME)
+        return llm.get_llm_response(
+            prompt_content, 'deepseek', use_cache=False).strip()
     if not deepseek_api_key:
         return "DeepSeek API 金鑰未設定，無法生成詩詞。"
     if not config.DEEPSEEK_API_URL or not config.DEEPSEEK_MODEL_NAME:
@@ -615,16 +709,22 @@ app = Flask(__name__)
 CORS(app)
 
 agents_data = {}
-if (
-    hasattr(config, 'AGENTS_INITIAL_SETUP')
-    and isinstance(config.AGENTS_INITIAL_SETUP, dict)
-):
-    for agent_id, setup in config.AGENTS_INITIAL_SETUP.items():
+# 地點 -> 在該地點的角色，觀察環境與會面檢查都由此查詢
+agent_locations = LocationIndex()
+agents_setup = getattr(config, 'AGENTS_INITIAL_SETUP', None)
+if getattr(config, 'AGENTS_ROSTER_FILE', None):
+    agents_setup = {
+        row["id"]: {**row, "agent_id": row["id"],
+                    "persona_summary": roster.persona_summary(row)}
+        for row in roster.load_roster(config.AGENTS_ROSTER_FILE)}
+if isinstance(agents_setup, dict):
+    for agent_id, setup in agents_setup.items():
         agents_data[agent_id] = Agent(
             agent_id=setup["agent_id"], name=setup["name"],
             persona_summary=setup["persona_summary"],
-            initial_location=setup.get(
-                "initial_location", config.AVAILABLE_LOCATIONS[0])
+            initial_location=setup.get("initial_location")
+            or config.AVAILABLE_LOCATIONS[0],
+            location_index=agent_locations
         )
     # print(f"已從 config 初始化 {len(agents_data)} 位代理人。") # 減少控制台輸出
 else:
@@ -657,7 +757,7 @@ def get_game_state():
         }), 500
 
     for agent_id, agent_obj in agents_data.items():
-        if not gemini_api_key:
+        if not _llm_available():
             agent_obj.current_action = "API金鑰未設定"
             agent_obj.current_thought = "（無法連接至大型語言模型。）"
         else:
@@ -675,17 +775,23 @@ def get_game_state():
             )
             if is_new_day or is_schedule_invalid:
                 today_game_date = datetime.date.today().strftime("%Y年%m月%d日")
+                # 換日時優先使用背景預先產生好的日程，不必等 LLM
                 agent_obj.generate_daily_plan(
-                    f"{today_game_date} ({current_game_time_str})")
+                    f"{today_game_date} ({current_game_time_str})",
+                    use_prepared=is_new_day)
+            elif current_game_time_str == config.NEXT_DAY_PREFETCH_TIME:
+                next_game_date = (datetime.date.today() +
+                                  datetime.timedelta(days=1)).strftime("%Y年%m月%d日")
+                agent_obj.prepare_next_day_plan(
+                    f"{next_game_date} ({config.SHICHEN[3]}{config.TIME_UNITS[0]})")
         agent_obj.update_action_for_time(current_game_time_str)
 
     if current_game_time_str == config.MEETING_TIME:
+        agents_at_location = agent_locations.at(config.MEETING_LOCATION)
         agents_at_meeting_spot = [
-            agent for agent_id, agent in agents_data.items()
-            if (
-                agent_id in config.AGENTS_TO_MEET_IDS
-                and agent.current_location == config.MEETING_LOCATION
-            )
+            agents_at_location[agent_id]
+            for agent_id in config.AGENTS_TO_MEET_IDS
+            if agent_id in agents_at_location
         ]
         if len(agents_at_meeting_spot) == len(config.AGENTS_TO_MEET_IDS) and\
                 len(config.AGENTS_TO_MEET_IDS) >= 2:
@@ -751,7 +857,7 @@ def get_game_state():
                     )
 
     for agent_id, agent_obj in agents_data.items():
-        if gemini_api_key:
+        if _llm_available():
             agent_obj.observe_environment(current_game_time_str, agents_data)
 
     for agent_id, agent_obj in agents_data.items():
@@ -771,8 +877,9 @@ def get_game_state():
             "thought": agent_obj.current_thought,
             "dialogue": agent_obj.current_dialogue,
             "schedule_today": current_schedule,
-            "recent_memories": list(agent_obj.memory_stream)[
-                -config.RECENT_MEMORIES_TO_RETURN:
+            "recent_memories": [
+                m.to_dict() for m in agent_obj.memory_stream.latest(
+                    config.RECENT_MEMORIES_TO_RETURN)
             ]
         }
     return jsonify({
@@ -0,0 +1,604 @@
+# 效能量測腳本
+# 用法：python benchmark.py <項目> [參數]，結果以 JSON 輸出
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import queue as queue_module
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+
+from config import config
+
+
+# bench_day 產生期間同時查詢 /api/status 的 client 數與每個 client 兩次查詢的間隔秒數
+PROBE_CLIENTS = 16
+PROBE_INTERVAL = 0.01
+
+
+def _timeit(func, n: int) -> dict:
+    '''執行 func n 次，回傳每次耗時統計 (毫秒)'''
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'n': n,
+        'mean_ms': statistics.fmean(samples),
+        'median_ms': statistics.median(samples),
+        'max_ms': max(samples),
+    }
+
+
+def bench_clients(n: int = 200, url: str | None = None) -> dict:
+    '''
+    比較每次重新建立 client 與共用 client 的額外開銷
+
+    不需要網路：只量測 client 建立本身的成本。
+    指定 url 時，另外比較 requests.post 與共用 Session 對同一個網址的延遲
+    (包含 TCP/TLS 握手是否被省下)。
+    '''
+    import google.generativeai as genai
+    import requests
+    from openai import OpenAI
+
+    import clients
+
+    gemini = config['gemini']
+    api_key = 'benchmark-key'
+
+    def fresh_gemini():
+        genai.configure(api_key=api_key)
+        genai.GenerativeModel(
+            model_name='gemini-1.5-flash-latest',
+            safety_settings=gemini['safety_settings'],
+            generation_config=gemini['generation_config'],
+        )
+
+    def shared_gemini():
+        clients.get_gemini_model(
+            api_key, 'gemini-1.5-flash-latest',
+            gemini['safety_settings'], gemini['generation_config'])
+
+    def fresh_openai():
+        OpenAI(api_key=api_key, base_url="https://api.deepseek.com").close()
+
+    def shared_openai():
+        clients.get_openai_client(api_key, "https://api.deepseek.com")
+
+    result = {
+        'gemini_fresh': _timeit(fresh_gemini, n),
+        'gemini_shared': _timeit(shared_gemini, n),
+        'deepseek_fresh': _timeit(fresh_openai, n),
+        'deepseek_shared': _timeit(shared_openai, n),
+    }
+
+    if url:
+        session = clients.get_http_session('benchmark')
+        session.head(url, timeout=10)  # 先建立連線
+        result['http_fresh'] = _timeit(
+            lambda: requests.head(url, timeout=10), min(n, 20))
+        result['http_shared'] = _timeit(
+            lambda: session.head(url, timeout=10), min(n, 20))
+
+    clients.reset()
+    return result
+
+
+def _percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def _stage(prompt_text: str) -> str:
+    '''依 prompt 判斷是規劃流程的哪一個階段'''
+    if '逐一判斷' in prompt_text:
+        return 'trigger_batch'
+    if '特殊事件的條件' in prompt_text:
+        return 'trigger_single'
+    if '"think"' in prompt_text:
+        return 'plan_15_minute'
+    if '每小時一格' in prompt_text:
+        return 'plan_hour'
+    if '"簡"' in prompt_text:
+        return 'poem'
+    return 'other'
+
+
+def _roster_rows(n: int) -> list[dict]:
+    '''複製預設名冊到 n 個角色，複製出的角色以 rules 欄位沿用原角色的特殊事件規則'''
+    import event_rules
+    import roster
+
+    base = roster.load_roster(roster.ROSTER_FILE)
+    rows = []
+    for i in range(n):
+        src = base[i % len(base)]
+        if i < len(base):
+            rows.append(src)
+            continue
+        rows.append({**src, 'id': f"{src['id']}_{i}",
+                     'name': f"{src['name']}_{i}",
+                     'rules': src.get('rules') or event_rules.AGENT_ALIASES.get(
+                         src['name'], src['name'])})
+    return rows
+
+
+def _make_agents(n: int) -> dict:
+    '''以 n 個角色的名冊建立角色'''
+    from schedule import build_agents
+
+    return build_agents(_roster_rows(n))
+
+
+def bench_roster(n: int = 1000) -> dict:
+    '''
+    從 n 個角色的名冊 (JSON) 載入角色，量測載入時間與每個角色佔用的記憶體
+
+    :param n: 角色數
+    '''
+    import os
+    import tempfile
+    import tracemalloc
+
+    import roster
+    from schedule import build_agents
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'agents.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(_roster_rows(n), f, ensure_ascii=False)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        rows = roster.load_roster(path)
+        loaded = time.perf_counter()
+        before = tracemalloc.take_snapshot()
+        agents = build_agents(rows)
+        after = tracemalloc.take_snapshot()
+        built = time.perf_counter()
+        tracemalloc.stop()
+
+    # 名冊的列 (rows) 在建立角色後即可丟棄，只計算角色本身新增的記憶體
+    agent_bytes = sum(stat.size_diff for stat in
+                      after.compare_to(before, 'filename'))
+    return {
+        'agents': len(agents),
+        'load_ms': round((loaded - start) * 1000, 3),
+        'build_ms': round((built - loaded) * 1000, 3),
+        'bytes_per_agent': round(agent_bytes / len(agents), 1),
+    }
+
+
+def bench_day(agents: int = 4, concurrency: int = 64, latency: float = 0.0,
+              jitter: float = 0.0, cassette_path: str | None = None,
+              honor_timing: bool = False, stream: bool = True,
+              window: int = 6, workers: int = 32) -> dict:
+    '''
+    在目前的 process 跑一次完整的一天規劃
+    (plan_hour → plan_15_minute → split_plan_to_each_15_minute → 特殊事件)
+
+    :param agents: 角色數
+    :param concurrency: 同時進行的 LLM 請求上限 (llm.ASYNC_MAX_CONCURRENCY)
+    :param latency: mock provider 的平均延遲秒數
+    :param jitter: mock provider 的延遲抖動
+    :param cassette_path: 指定時改用 cassette 重播而非 mock
+    :param honor_timing: 重播時是否照錄製時的耗時等待
+    :param stream: 15 分鐘規劃是否使用串流 (schedule.STREAM_15_MINUTE)
+    :param window: 15 分鐘規劃分段的小時數，0 表示整天一次 (schedule.WINDOW_HOURS)
+    :param workers: 同時規劃的角色數 (schedule.PLAN_WORKERS)
+    :return(dict): 耗時、各階段呼叫數、peak RSS、第一個時段完成的時間、
+                   產生期間 /api/status 的延遲、每個角色的 storage 用量
+    '''
+    import cassette
+    import llm
+    import schedule
+    import storage
+
+    if cassette_path:
+        cassette.replay(cassette_path, honor_timing=honor_timing)
+    else:
+        llm.configure_mock(latency=latency, jitter=jitter, override=True)
+    llm.ASYNC_MAX_CONCURRENCY = concurrency
+    schedule.STREAM_15_MINUTE = stream
+    schedule.WINDOW_HOURS = window
+
+    # 計算實際送出的請求數 (快取與合併之後)
+    calls = {}
+    calls_lock = threading.Lock()
+    call_provider_async = llm._call_provider_async
+    call_provider = llm._call_provider
+    call_provider_stream = llm._call_provider_stream_async
+
+    def count(prompt_text):
+        stage = _stage(prompt_text)
+        with calls_lock:
+            calls[stage] = calls.get(stage, 0) + 1
+
+    async def counted_async(prompt_text, *args):
+        count(prompt_text)
+        return await call_provider_async(prompt_text, *args)
+
+    def counted(prompt_text, *args):
+        count(prompt_text)
+        return call_provider(prompt_text, *args)
+
+    async def counted_stream(prompt_text, *args):
+        count(prompt_text)
+        async for chunk in call_provider_stream(prompt_text, *args):
+            yield chunk
+
+    llm._call_provider_async = counted_async
+    llm._call_provider = counted
+    llm._call_provider_stream_async = counted_stream
+
+    # 記錄第一個 15 分鐘時段寫入的時間
+    start = time.perf_counter()
+    first_slot = []
+    published = []
+    add_data = schedule.add_data
+
+    def timed_add_data(key, data):
+        add_data(key, data)
+        if key.startswith('sch_') and '_15_minute_' in key:
+            if not first_slot:
+                first_slot.append(time.perf_counter() - start)
+            published.append(key)
+
+    schedule.add_data = timed_add_data
+
+    roster = _make_agents(agents)
+    names = [agent.name for agent in roster.values()]
+    slot_times = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(0, 60, 15)]
+
+    # 產生期間在另一個 event loop 上直接呼叫 api.get_status，模擬前端的查詢；
+    # 隨機的時段可能還沒產生，這時會等到寫入 (最多 2 秒)，量到的是前端實際感受到的延遲
+    probe_latencies = []
+    probe_pending = []
+    done = threading.Event()
+
+    def probe():
+        import api
+
+        async def client(rng):
+            while not done.is_set():
+                name, slot = rng.choice(names), rng.choice(slot_times)
+                if storage.retrieve_data(f"sch_{name}_15_minute_{slot}",
+                                         0) is None:
+                    probe_pending.append(slot)
+                t = time.perf_counter()
+                await api.get_status(time=slot, name=name)
+                probe_latencies.append((time.perf_counter() - t) * 1000)
+                await asyncio.sleep(PROBE_INTERVAL)
+
+        async def clients():
+            await asyncio.gather(*(client(random.Random(i))
+                                   for i in range(PROBE_CLIENTS)))
+
+        asyncio.run(clients())
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+
+    failed = len(asyncio.run(schedule.plan_agents_async(roster, workers)))
+    wall = time.perf_counter() - start
+    done.set()
+    prober.join()
+
+    schedule.add_data = add_data
+    llm._call_provider_async = call_provider_async
+    llm._call_provider = call_provider
+    llm._call_provider_stream_async = call_provider_stream
+    cassette.stop()
+
+    # Linux 的 ru_maxrss 單位是 KB，macOS 是 bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = rss / (1024 * 1024) if sys.platform == 'darwin' \
+        else rss / 1024
+
+    return {
+        'agents': agents,
+        'concurrency': concurrency,
+        'provider': 'cassette' if cassette_path else 'mock',
+        'stream': stream,
+        'window_hours': window,
+        'mock_latency': latency,
+        'plan_workers': workers,
+        'failed_agents': failed,
+        'wall_s': round(wall, 4),
+        'first_slot_s': round(first_slot[0], 4) if first_slot else None,
+        'slots_published': len(published),
+        'llm_calls': dict(sorted(calls.items())),
+        'llm_calls_total': sum(calls.values()),
+        'peak_rss_mb': round(peak_rss_mb, 2),
+        'storage_bytes_per_agent': round(
+            storage.stats()['bytes'] / agents, 1),
+        'probe_ms_p50': round(_percentile(probe_latencies, 0.5), 4),
+        'probe_ms_p99': round(_percentile(probe_latencies, 0.99), 4),
+        'probe_count': len(probe_latencies),
+        'probe_pending': len(probe_pending),
+    }
+
+
+def _bench_day_worker(kwargs, queue):
+    queue.put(bench_day(**kwargs))
+
+
+def _wait_result(proc, queue, poll: float = 1.0):
+    '''
+    等待子 process 的結果；子 process 沒有回傳結果就結束 (例如當掉) 時不會永遠卡住
+
+    :return(dict | None): bench_day 的結果，子 process 異常結束時為 None
+    '''
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except queue_module.Empty:
+            if proc.exitcode is None:
+                continue
+        # 子 process 已結束：結果可能剛好在結束前送出，再取一次
+        try:
+            return queue.get(timeout=poll)
+        except queue_module.Empty:
+            return None
+
+
+def bench_day_sweep(agent_counts: list[int], concurrencies: list[int],
+                    **kwargs) -> list[dict]:
+    '''
+    對每組 (角色數, 並行數) 各開一個新的 process 跑 bench_day，
+    讓每次量測的 storage 與 peak RSS 互不影響
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for n in agent_counts:
+        for c in concurrencies:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_bench_day_worker, args=(
+                dict(agents=n, concurrency=c, **kwargs), queue))
+            proc.start()
+            result = _wait_result(proc, queue)
+            proc.join()
+            if result is None:
+                result = {'agents': n, 'concurrency': c,
+                          'error': f"worker 異常結束 (exitcode={proc.exitcode})"}
+                print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+class _ConditionStore:
+    '''舊版 storage 的寫法：全域 Condition，每次寫入 notify_all，作為比較基準'''
+
+    def __init__(self):
+        self._cache = {}
+        self._cond = threading.Condition()
+
+    def add_data(self, key, data):
+        with self._cond:
+            self._cache[key] = data
+            self._cond.notify_all()
+
+    def retrieve_data(self, key, timeout=None):
+        with self._cond:
+            if key not in self._cache:
+                self._cond.wait_for(lambda: key in self._cache,
+                                    timeout=timeout)
+            return self._cache.get(key)
+
+
+def _contention(add_data, retrieve_data, waiters: int, prefix: str) -> dict:
+    '''
+    waiters 個執行緒各自等一個不同的 key，再逐一寫入，量測寫入耗時
+    與從寫入到等待者醒來的延遲
+    '''
+    ready = threading.Barrier(waiters + 1)
+    written = {}
+    wake_ms = []
+    write_ms = []
+
+    def wait(i):
+        key = f"{prefix}_{i}"
+        ready.wait()
+        retrieve_data(key, 30)
+        wake_ms.append((time.perf_counter() - written[key]) * 1000)
+
+    threads = [threading.Thread(target=wait, args=(i,), daemon=True)
+               for i in range(waiters)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    time.sleep(0.2)  # 讓所有等待者都進入阻塞
+
+    start = time.perf_counter()
+    for i in range(waiters):
+        key = f"{prefix}_{i}"
+        written[key] = time.perf_counter()
+        add_data(key, i)
+        write_ms.append((time.perf_counter() - written[key]) * 1000)
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+
+    # 全部寫入後，已存在 key 的讀取成本
+    read = _timeit(lambda: retrieve_data(f"{prefix}_0", 2), 10000)
+
+    return {
+        'total_s': round(total, 4),
+        'write_ms_p50': round(_percentile(write_ms, 0.5), 4),
+        'write_ms_p99': round(_percentile(write_ms, 0.99), 4),
+        'wake_ms_p50': round(_percentile(wake_ms, 0.5), 4),
+        'wake_ms_p99': round(_percentile(wake_ms, 0.99), 4),
+        'read_existing_us': round(read['mean_ms'] * 1000, 3),
+    }
+
+
+def bench_storage(waiters: int = 1000) -> dict:
+    '''比較全域 Condition 與每個 key 各自通知兩種 storage 在大量等待者下的表現'''
+    import storage
+
+    legacy = _ConditionStore()
+    return {
+        'waiters': waiters,
+        'global_condition': _contention(
+            legacy.add_data, legacy.retrieve_data, waiters, 'bench_cond'),
+        'per_key': _contention(
+            storage.add_data, storage.retrieve_data, waiters, 'bench_key'),
+    }
+
+
+def _legacy_parse(time_str, shichen, units):
+    '''舊版 backend_app 的時辰解析：每次比較都拆字串並以 list.index 查詢，作為比較基準'''
+    if not isinstance(time_str, str):
+        return None, None
+    if '時' in time_str:
+        try:
+            s_str, u_str = time_str.split('時', 1)
+            return shichen.index(s_str), units.index(u_str)
+        except (ValueError, IndexError):
+            pass
+    if len(time_str) > 1:
+        try:
+            return shichen.index(time_str[0]), units.index(time_str[1:])
+        except (ValueError, IndexError):
+            pass
+    return None, None
+
+
+def _legacy_latest(schedule: list, game_time: str, shichen, units):
+    '''舊版 update_action_for_time 的線性掃描，回傳現在適用的事件位置'''
+    latest = None
+    g = _legacy_parse(game_time, shichen, units)
+    for i, event in enumerate(schedule):
+        e = _legacy_parse(event["time_str"], shichen, units)
+        if None in e or None in g or e <= g:
+            latest = i
+        else:
+            break
+    return latest
+
+
+def bench_schedule(events: int = 24, agents: int = 100) -> dict:
+    '''
+    比較 backend_app 角色每個遊戲時間查詢目前行程的成本：
+    舊版逐一比較時辰字串 vs 整數序號索引 + bisect
+
+    :param events: 每個角色日程的事件數 (最多為一天的時刻數)
+    :param agents: 角色數
+    '''
+    import backend_app
+    shichen, units = backend_app.config.SHICHEN, backend_app.config.TIME_UNITS
+    slots = backend_app.TIME_SLOTS
+    events = min(events, len(slots))
+
+    rng = random.Random(0)
+    population = []
+    for i in range(agents):
+        agent = backend_app.Agent(f"bench_{i}", f"bench_{i}", "")
+        agent.daily_schedule = [
+            {"time_str": slots[k], "location": "酒館", "action": str(k)}
+            for k in sorted(rng.sample(range(len(slots)), events))]
+        population.append(agent)
+
+    def legacy_tick():
+        for t in slots:
+            for agent in population:
+                _legacy_latest(agent.daily_schedule, t, shichen, units)
+
+    def indexed_tick():
+        for t in slots:
+            for agent in population:
+                agent._latest_schedule_position(t)
+
+    mismatches = sum(
+        _legacy_latest(agent.daily_schedule, t, shichen, units) !=
+        agent._latest_schedule_position(t)
+        for t in slots for agent in population)
+
+    # 插入會面事件：索引就地更新，之後的查詢不需重建
+    insert_agent = population[0]
+    insert = _timeit(lambda: insert_agent._insert_schedule_event(
+        {"time_str": backend_app.config.MEETING_TIME, "location": "酒館",
+         "action": "會面"}), 1000)
+
+    lookups = len(slots) * agents
+    legacy = _timeit(legacy_tick, 5)
+    indexed = _timeit(indexed_tick, 5)
+    return {
+        'agents': agents,
+        'events_per_agent': events,
+        'mismatches': mismatches,
+        'legacy_us_per_lookup': round(legacy['mean_ms'] * 1000 / lookups, 3),
+        'indexed_us_per_lookup': round(indexed['mean_ms'] * 1000 / lookups, 3),
+        'speedup': round(legacy['mean_ms'] / indexed['mean_ms'], 1),
+        'insert_us': round(insert['mean_ms'] * 1000, 3),
+    }
+
+
+def _int_list(text: str) -> list[int]:
+    return [int(x) for x in text.split(',') if x.strip()]
+
+
+# 名稱 -> 以命令列參數執行該項量測的函式
+BENCHMARKS = {
+    'clients': lambda args: bench_clients(args.n, args.url),
+    'storage': lambda args: bench_storage(args.n),
+    'roster': lambda args: bench_roster(_int_list(args.agents)[0]),
+    'schedule': lambda args: bench_schedule(args.events,
+                                            _int_list(args.agents)[0]),
+    'day': lambda args: bench_day_sweep(
+        _int_list(args.agents), _int_list(args.concurrency),
+        latency=args.latency, jitter=args.jitter,
+        cassette_path=args.cassette, honor_timing=args.honor_timing,
+        stream=not args.no_stream, window=args.window,
+        workers=args.workers),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='後端效能量測')
+    parser.add_argument('name', choices=BENCHMARKS.keys())
+    parser.add_argument('-n', type=int, default=200, help='重複次數')
+    parser.add_argument('--url', default=None,
+                        help='clients: 比較 HTTP 連線重用時要請求的網址')
+    parser.add_argument('--agents', default='4',
+                        help='day: 角色數，多個以逗號分隔；roster、schedule: 角色數')
+    parser.add_argument('--events', type=int, default=24,
+                        help='schedule: 每個角色日程的事件數')
+    parser.add_argument('--concurrency', default='64',
+                        help='day: 同時 LLM 請求上限，多個以逗號分隔')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='day: mock provider 平均延遲 (秒)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='day: mock provider 延遲抖動 (秒)')
+    parser.add_argument('--cassette', default=None,
+                        help='day: 改用 cassette 重播')
+    parser.add_argument('--honor-timing', action='store_true',
+                        help='day: 重播時照錄製的耗時等待')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='day: 15 分鐘規劃不使用串流')
+    parser.add_argument('--window', type=int, default=6,
+                        help='day: 15 分鐘規劃每段的小時數，0 為整天一次')
+    parser.add_argument('--workers', type=int, default=32,
+                        help='day: 同時規劃的角色數')
+    parser.add_argument('-o', '--output', default=None, help='輸出 JSON 檔案')
+    args = parser.parse_args()
+
+    result = BENCHMARKS[args.name](args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# LLM 與語音合成 (TTS) 流量的錄製與重播
+# 錄製：把每次請求的 key、回應與實際耗時寫入 gzip 壓縮的 JSON Lines 檔 (cassette)
+# 重播：依 key 回傳錄下的回應，可選擇照原本的耗時等待，整天的流程可以離線、確定地重跑
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Optional
+
+
+class ReplayedError(Exception):
+    '''錄製時發生的錯誤，重播時原樣拋出'''
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CassetteMiss(LookupError):
+    '''重播時找不到對應的錄製內容'''
+
+
+class Cassette:
+    '''
+    :param path: cassette 檔案路徑 (.jsonl.gz)
+    :param mode: 'record' 或 'replay'
+    :param honor_timing: 重播時是否照錄製時的耗時等待
+    '''
+
+    def __init__(self, path: str, mode: str, honor_timing: bool = False):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"不支援的 cassette 模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.honor_timing = honor_timing
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)  # (kind, key) -> 依序錄下的紀錄
+        self._file = None
+        self.stats = {'recorded': 0, 'replayed': 0, 'missed': 0}
+
+        if mode == 'record':
+            self._file = gzip.open(path, 'at', encoding='utf-8')
+        else:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[(entry['kind'], entry['key'])].append(
+                            entry)
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()  # 程式中斷時已寫入的紀錄仍可讀取
+            self.stats['recorded'] += 1
+
+    def _take(self, kind: str, key: str) -> dict:
+        with self._lock:
+            queue = self._entries.get((kind, key))
+            if not queue:
+                self.stats['missed'] += 1
+                raise CassetteMiss(f"cassette 中沒有這個請求: {kind} {key}")
+            entry = queue.popleft()
+            if not queue:
+                # 最後一筆保留，重複的請求 (例如快取關閉時) 仍可重播
+                queue.append(entry)
+            self.stats['replayed'] += 1
+            return entry
+
+    @staticmethod
+    def _result(entry: dict):
+        if 'error' in entry:
+            raise ReplayedError(entry['error'], entry.get('status_code'))
+        return entry['response']
+
+    def _entry(self, kind, key, meta, start, response=None, error=None):
+        entry = {'kind': kind, 'key': key,
+                 'latency': round(time.perf_counter() - start, 4), **meta}
+        if error is not None:
+            entry['error'] = str(error)
+            status = getattr(error, 'status_code', None) or \
+                getattr(error, 'code', None)
+            if isinstance(status, int):
+                entry['status_code'] = status
+        else:
+            entry['response'] = response
+        return entry
+
+    def call(self, kind: str, key: str, func: Callable[[], object],
+             meta: Optional[dict] = None):
+        '''
+        錄製或重播一次請求
+
+        :param kind: 請求種類，例如 'llm'、'tts'
+        :param key: 請求識別 (相同請求必須得到相同 key)
+        :param func: 實際發送請求的函式，回傳值必須能轉成 JSON
+        :param meta: 額外寫入紀錄的資訊 (provider、模型等)
+        :return: 回應
+        '''
+        if self.mode == 'replay':
+            entry = self._take(kind, key)
+            if self.honor_timing:
+                time.sleep(entry.get('latency', 0))
+            return self._result(entry)
+
+        start = time.perf_counter()
+        try:
+            response = func()
+        except Exception as e:
+            self._write(self._entry(kind, key, meta or {}, start, error=e))
+            raise
+        self._write(self._entry(kind, key, meta or {}, start, response))
+        return response
+
+    async def call_async(self, kind: str, key: str,
+                         func: Callable[[], Awaitable],
+                         meta: Optional[dict] = None):
+        '''call 的 asyncio 版本'''
+        if self.mode == 'replay':
+            entry = self._take(kind, key)
+            if self.honor_timing:
+                await asyncio.sleep(entry.get('latency', 0))
+            return self._result(entry)
+
+        start = time.perf_counter()
+        try:
+            response = await func()
+        except Exception as e:
+            self._write(self._entry(kind, key, meta or {}, start, error=e))
+            raise
+        self._write(self._entry(kind, key, meta or {}, start, response))
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 目前使用中的 cassette，None 表示照常呼叫外部服務
+_active: Optional[Cassette] = None
+
+
+def active() -> Optional[Cassette]:
+    return _active
+
+
+def record(path: str) -> Cassette:
+    '''開始錄製，之後的 LLM 與 TTS 請求都會寫入 path'''
+    return _start(Cassette(path, 'record'))
+
+
+def replay(path: str, honor_timing: bool = False) -> Cassette:
+    '''開始重播 path 中錄下的回應，不再呼叫外部服務'''
+    return _start(Cassette(path, 'replay', honor_timing))
+
+
+def _start(cassette: Cassette) -> Cassette:
+    global _active
+    stop()
+    _active = cassette
+    return cassette
+
+
+def stop():
+    global _active
+    if _active is not None:
+        _active.close()
+    _active = None
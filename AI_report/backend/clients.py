@@ -0,0 +1,173 @@
+# 長期保存的 LLM / HTTP client
+# 每個 provider、模型與設定只建立一次，後續呼叫共用同一個 client 與連線池
+
+import asyncio
+import threading
+
+import google.generativeai as genai
+import requests
+from openai import OpenAI, AsyncOpenAI
+from requests.adapters import HTTPAdapter
+
+# requests.Session 連線池大小 (同一個 host 最多保留幾條 keep-alive 連線)
+HTTP_POOL_SIZE = 32
+
+_lock = threading.Lock()
+_gemini_configured_key = None
+_gemini_models = {}
+_async_gemini_models = {}  # generate_content_async 的 gRPC client 綁定在 event loop 上，依 loop 分開
+_openai_clients = {}
+_async_openai_clients = {}  # AsyncOpenAI 的連線綁定在 event loop 上，依 loop 分開
+_sessions = {}
+
+
+def _configure_gemini(api_key: str):
+    # genai.configure 是全域設定，金鑰沒變就不必重新設定
+    global _gemini_configured_key
+    if _gemini_configured_key != api_key:
+        genai.configure(api_key=api_key)
+        _gemini_configured_key = api_key
+
+
+def get_gemini_model(api_key: str, model_name: str, safety_settings,
+                     generation_config) -> genai.GenerativeModel:
+    '''
+    取得共用的 GenerativeModel
+
+    :param api_key: gemini API 金鑰
+    :param model_name: 模型名稱
+    :param safety_settings: 安全設定
+    :param generation_config: 生成設定
+    :return(GenerativeModel): 相同參數會拿到同一個物件
+    '''
+    key = (api_key, model_name, repr(safety_settings),
+           repr(generation_config))
+    model = _gemini_models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        _configure_gemini(api_key)
+        model = _gemini_models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                safety_settings=safety_settings,
+                generation_config=generation_config,
+            )
+            _gemini_models[key] = model
+        return model
+
+
+def get_async_gemini_model(api_key: str, model_name: str, safety_settings,
+                           generation_config) -> genai.GenerativeModel:
+    '''
+    取得目前 event loop 共用的 GenerativeModel (用於 generate_content_async)，須在 coroutine 內呼叫
+
+    GenerativeModel 第一次呼叫 generate_content_async 時建立的 async client 只能在該 loop 使用，
+    規劃會在多個 loop 上進行 (asyncio.run、換日、lazy planner)，因此每個 loop 各一個。
+    '''
+    loop = asyncio.get_running_loop()
+    key = (loop, api_key, model_name, repr(safety_settings),
+           repr(generation_config))
+    model = _async_gemini_models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        _configure_gemini(api_key)
+        # 已結束的 loop 上的 model 不能再用
+        for old_key in [k for k in _async_gemini_models if k[0].is_closed()]:
+            del _async_gemini_models[old_key]
+        model = _async_gemini_models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                safety_settings=safety_settings,
+                generation_config=generation_config,
+            )
+            _async_gemini_models[key] = model
+        return model
+
+
+def get_openai_client(api_key: str, base_url: str) -> OpenAI:
+    '''取得共用的 OpenAI 相容 client (DeepSeek)，底層 httpx 連線池會保持連線'''
+    key = (api_key, base_url)
+    client = _openai_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url)
+            _openai_clients[key] = client
+        return client
+
+
+def get_async_openai_client(api_key: str, base_url: str) -> AsyncOpenAI:
+    '''取得目前 event loop 共用的 AsyncOpenAI client，須在 coroutine 內呼叫'''
+    loop = asyncio.get_running_loop()
+    key = (loop, api_key, base_url)
+    client = _async_openai_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        # 已結束的 loop 上的 client 不能再用
+        for old_key in [k for k in _async_openai_clients if k[0].is_closed()]:
+            del _async_openai_clients[old_key]
+        client = _async_openai_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+            _async_openai_clients[key] = client
+        return client
+
+
+def get_http_session(name: str = 'default') -> requests.Session:
+    '''
+    取得共用的 requests.Session
+
+    Session 內的 urllib3 連線池是執行緒安全的，可在多個 thread 共用；
+    不要在共用的 Session 上修改 headers / cookies，請在每次請求時傳入。
+    '''
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                  pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[name] = session
+        return session
+
+
+def _close_async_client(loop, client):
+    # AsyncOpenAI.close() 是 coroutine，只能在建立它的 loop 上執行
+    if loop.is_closed():
+        return  # loop 結束時連線已經無法再使用，直接丟掉即可
+    try:
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            loop.run_until_complete(client.close())
+    except RuntimeError:
+        pass  # loop 在檢查後剛好被關閉
+
+
+def reset():
+    '''關閉並清除所有共用 client (測試或金鑰更換時使用)'''
+    global _gemini_configured_key
+    with _lock:
+        for client in _openai_clients.values():
+            client.close()
+        for (loop, *_), client in _async_openai_clients.items():
+            _close_async_client(loop, client)
+        for session in _sessions.values():
+            session.close()
+        _gemini_models.clear()
+        _async_gemini_models.clear()
+        _openai_clients.clear()
+        _async_openai_clients.clear()
+        _sessions.clear()
+        _gemini_configured_key = None
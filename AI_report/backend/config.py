@@ -20,6 +20,8 @@ RECENT_MEMORIES_TO_RETURN = 5
 
 # --- 強制會面設定 ---
 MEETING_TIME = "辰時三刻"
+# 在這個時間開始於背景產生明天的日程 (換日在卯時初刻)
+NEXT_DAY_PREFETCH_TIME = "子時初刻"
 MEETING_LOCATION = "酒館"
 AGENTS_TO_MEET_IDS = ["li_xiucai", "zhao_zhanggui"]
 
@@ -27,6 +29,9 @@ AGENTS_TO_MEET_IDS = ["li_xiucai", "zhao_zhanggui"]
 AVAILABLE_LOCATIONS = ["河川", "書院", "酒館", "衙門", "城門", "診所"]
 
 # --- 代理人 (Agent) 初始設定 ---
+# 設定為 JSON/CSV 名冊路徑時改從名冊載入代理人，取代下方的 AGENTS_INITIAL_SETUP
+# (與 schedule 相同的名冊格式，見 roster.py；例如 "agents.json")
+AGENTS_ROSTER_FILE = None
 AGENTS_INITIAL_SETUP = {
     "li_xiucai": {
         "agent_id": "li_xiucai",
@@ -131,6 +136,31 @@ config = {
         ],
         'generation_config': genai.types.GenerationConfig(
             temperature=0.75,
-        )
-    }
+        ),
+        # 每把 API 金鑰的流量限制 (rpm: 每分鐘請求數, tpm: 每分鐘 token 數,
+        # concurrency: 初始同時請求數, max_concurrency: AIMD 調整的上限)
+        'rate_limit': {
+            'rpm': 1000,
+            'tpm': 1_000_000,
+            'concurrency': 8,
+            'max_concurrency': 64,
+        },
+    },
+    'deepseek': {
+        'rate_limit': {
+            'rpm': 600,
+            'tpm': 1_000_000,
+            'concurrency': 4,
+            'max_concurrency': 32,
+        },
+    },
+    # 離線壓力測試用的假 provider，限制放寬到不影響量測
+    'mock': {
+        'rate_limit': {
+            'rpm': 10_000_000,
+            'tpm': 10_000_000_000,
+            'concurrency': 1024,
+            'max_concurrency': 1024,
+        },
+    },
 }
@@ -23,6 +23,7 @@ def get_normal_event():
     人物：{agent1},{agent2}
     事件：（你的回復，簡單的事件描述）"""
     random_normal_event = get_llm_response(prompt_text, provider='gemini',
-                                        model_name=GEMINI_MODEL_NAME)
+                                        model_name=GEMINI_MODEL_NAME,
+                                        use_cache=False)
     
     return random_normal_event
\ No newline at end of file
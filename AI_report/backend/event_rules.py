@@ -0,0 +1,190 @@
+# 特殊事件的本地判斷規則
+# 條件明確的時段直接在本地判定，只有模稜兩可的時段才送給 LLM
+
+import datetime
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Optional
+
+# 判斷結果
+POSITIVE = True
+NEGATIVE = False
+AMBIGUOUS = None
+
+Predicate = Callable[[dict], bool]
+
+
+# --- 謂詞 (predicate)，皆作用於單一時段 {"time", "location", "activity", "think"} ---
+
+def _minutes(time_str: str) -> Optional[int]:
+    try:
+        hh, mm = str(time_str).split(':', 1)
+        return int(hh) * 60 + int(mm)
+    except (ValueError, AttributeError):
+        return None
+
+
+def time_between(start: str, end: str) -> Predicate:
+    '''時段的 time 落在 [start, end) 之間，start > end 時表示跨午夜'''
+    start_min, end_min = _minutes(start), _minutes(end)
+
+    def pred(slot):
+        t = _minutes(slot.get('time', ''))
+        if t is None:
+            return False
+        if start_min <= end_min:
+            return start_min <= t < end_min
+        return t >= start_min or t < end_min
+    return pred
+
+
+def at_location(*locations: str) -> Predicate:
+    '''時段的 location 完全等於其中一個地點'''
+    def pred(slot):
+        return str(slot.get('location', '')).strip() in locations
+    return pred
+
+
+def text_contains(*words: str, fields=('activity', 'think')) -> Predicate:
+    '''指定欄位中出現任一關鍵字'''
+    def pred(slot):
+        text = "".join(str(slot.get(f, '')) for f in fields)
+        return any(w in text for w in words)
+    return pred
+
+
+def all_of(*preds: Predicate) -> Predicate:
+    def pred(slot):
+        return all(p(slot) for p in preds)
+    return pred
+
+
+def not_(p: Predicate) -> Predicate:
+    def pred(slot):
+        return not p(slot)
+    return pred
+
+
+def always(slot) -> bool:
+    return True
+
+
+# --- 各角色的規則表 ---
+# 依序比對 (predicate, 判斷結果)，第一個成立的規則決定結果；
+# 結果為 AMBIGUOUS 的時段交給 LLM 判斷。
+
+_NIGHT = time_between("20:00", "05:00")
+_SLEEP_WORDS = ("準備睡", "準備就寢", "就寢", "入睡", "睡覺", "安歇", "歇下")
+_REST_WORDS = ("睡", "休息", "躺", "眠", "歇")
+_POEM_WORDS = ("作詩", "寫詩", "吟詩", "賦詩", "題詩", "作詞", "寫詞", "創作")
+
+SPECIAL_EVENT_RULES: dict[str, list[tuple[Predicate, Optional[bool]]]] = {
+    # 1）李白：晚上李白準備睡覺時
+    '李白': [
+        (not_(_NIGHT), NEGATIVE),
+        (text_contains(*_SLEEP_WORDS), POSITIVE),
+        (text_contains(*_REST_WORDS), AMBIGUOUS),
+        (always, NEGATIVE),
+    ],
+    # 2）莊子：莊子到河邊時
+    '莊子': [
+        (at_location('河邊'), POSITIVE),
+        (text_contains('河', fields=('activity',)), AMBIGUOUS),
+        (always, NEGATIVE),
+    ],
+    # 3）李清照：李清照在自家庭院中思考時
+    '李清照': [
+        (all_of(at_location('李清照家的庭院'),
+                text_contains('思', '想', '沉吟', '憶', '念')), POSITIVE),
+        (at_location('李清照家的庭院'), AMBIGUOUS),
+        (all_of(at_location('李清照家'),
+                text_contains('庭院', fields=('activity',))), AMBIGUOUS),
+        (always, NEGATIVE),
+    ],
+    # 4）李昇暾：李昇暾作詩時
+    '李昇暾': [
+        (text_contains(*_POEM_WORDS, fields=('activity',)), POSITIVE),
+        (text_contains('詩', '詞'), AMBIGUOUS),
+        (always, NEGATIVE),
+    ],
+}
+
+# schedule.py 中的角色名稱與特殊事件條件中的名稱不同時在這裡對應
+AGENT_ALIASES = {
+    '李老師': '李昇暾',
+}
+
+
+def evaluate(slot: dict, name: str, rules_name: Optional[str] = None
+             ) -> Optional[bool]:
+    '''
+    以本地規則判斷單一時段
+
+    :param slot: 15 分鐘時段 {"time", "location", "activity", "think"}
+    :param name: 角色名稱
+    :param rules_name: 使用哪個角色的規則 (名冊的 rules 欄位)，None 時依 AGENT_ALIASES 對應
+    :return: True/False 為本地已確定的結果，None 表示需要交給 LLM
+    '''
+    rules = SPECIAL_EVENT_RULES.get(rules_name or AGENT_ALIASES.get(name, name))
+    if rules is None:
+        # 不在特殊事件條件內的角色不可能觸發
+        return NEGATIVE
+    if not isinstance(slot, dict):
+        return AMBIGUOUS
+    for pred, verdict in rules:
+        if pred(slot):
+            return verdict
+    return AMBIGUOUS
+
+
+# --- 統計：每天本地判定了多少時段，以及因此完全不必送出的 LLM 請求 ---
+
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+def prefilter(events: dict[str, dict], name: str, day: Optional[str] = None,
+              rules_name: Optional[str] = None
+              ) -> tuple[dict[str, bool], dict[str, dict]]:
+    '''
+    將時段分成本地已確定與需要 LLM 判斷兩組，並更新當日統計
+
+    :param events: {"hh:mm": slot}
+    :param name: 角色名稱
+    :param day: 統計用的日期，預設為今天
+    :param rules_name: 使用哪個角色的規則，見 evaluate
+    :return: (本地結果 {"hh:mm": bool}, 模稜兩可的時段 {"hh:mm": slot})
+    '''
+    settled, ambiguous = {}, {}
+    for key, slot in events.items():
+        verdict = evaluate(slot, name, rules_name)
+        if verdict is AMBIGUOUS:
+            ambiguous[key] = slot
+        else:
+            settled[key] = verdict
+
+    with _stats_lock:
+        counter = _stats[day or _today()]
+        counter['local_true'] += sum(settled.values())
+        counter['local_false'] += len(settled) - sum(settled.values())
+        counter['sent_to_llm'] += len(ambiguous)
+        counter['slots_settled_locally'] += len(settled)
+        # 批次判斷時一次請求涵蓋多個時段，只有全部時段都在本地確定時才真正省下一次請求
+        if settled and not ambiguous:
+            counter['llm_calls_avoided'] += 1
+    return settled, ambiguous
+
+
+def get_stats(day: Optional[str] = None) -> dict[str, int]:
+    '''取得某天的本地判定統計，day 為 None 時回傳今天'''
+    with _stats_lock:
+        return dict(_stats.get(day or _today(), Counter()))
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
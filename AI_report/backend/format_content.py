@@ -25,6 +25,74 @@ def schedule_text2json_array(raw: str) -> dict[str, dict]:
     return data
 
 
+class SlotStreamParser:
+    """
+    逐段解析串流中的 JSON 物件，每當根物件下的一個 "hh:mm": {...} 完整出現就立即取出，
+    不必等整個回應結束。根物件之前的文字 (例如 ```json) 會被略過。
+
+    用法：
+        parser = SlotStreamParser()
+        for chunk in stream:
+            for key, slot in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        self.text = ""  # 目前收到的完整文字
+        self.done = False  # 根物件是否已結束
+        self._pos = 0  # 下一個要掃描的位置
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None  # 根物件中最後一個完整的字串 (即下一個值的 key)
+        self._value_start = None
+        self._value_key = None
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        """
+        加入新的一段文字
+
+        :param chunk: 串流收到的文字
+        :return: 這段文字中完成的 (key, 物件) list
+        """
+        self.text += chunk
+        found = []
+        text = self.text
+        i = self._pos
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = json.loads(
+                            text[self._string_start:i + 1])
+            elif c == '"' and self._depth >= 1:
+                self._in_string = True
+                self._string_start = i
+            elif c == '{' or c == '[':
+                self._depth += 1
+                if self._depth == 2 and c == '{':
+                    self._value_start = i
+                    self._value_key = self._last_string
+            elif c == '}' or c == ']':
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    value = json.loads(text[self._value_start:i + 1])
+                    found.append((self._value_key, value))
+                    self._value_start = None
+                elif self._depth == 0:
+                    self.done = True
+            i += 1
+        self._pos = i
+        return found
+
+
 # json2漂亮的str格式(多行)
 # pretty = json.dumps(data, ensure_ascii=False, indent=2)
 
@@ -1,11 +1,17 @@
+import asyncio
 from typing import Optional
-from openai import OpenAI
-import google.generativeai as genai
 from google.api_core.exceptions import RetryError
-from google.api_core import retry
+from google.api_core import retry, retry_async
 import os
 from config import config
 from dotenv import load_dotenv
+from llm_cache import LLMCache, make_key
+from rate_limit import RateLimiter
+from singleflight import SingleFlight
+from mock_llm import MockLLM, MockLLMError
+import cassette
+import clients
+import threading
 
 load_dotenv()
 
@@ -62,43 +68,253 @@ def _check_api_key(key_name):
 # _check_api_keys()
 
 
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+DEFAULT_MODEL_NAMES = {
+    'gemini': 'gemini-1.5-flash-latest',
+    'deepseek': 'deepseek-chat',
+    'mock': 'mock',
+}
+
+# 設定 llm_provider 環境變數 (例如 mock) 時，所有呼叫都改送到該 provider
+PROVIDER_OVERRIDE = os.getenv('llm_provider') or None
+
+# 離線壓力測試用的假 provider，參數可用 configure_mock() 調整
+_mock = MockLLM(
+    latency=float(os.getenv('llm_mock_latency', 0)),
+    jitter=float(os.getenv('llm_mock_jitter', 0)),
+    error_rate=float(os.getenv('llm_mock_error_rate', 0)),
+    seed=int(os.getenv('llm_mock_seed', 0)),
+)
+
+
+def configure_mock(latency: float = 0.0, jitter: float = 0.0,
+                   error_rate: float = 0.0, seed: int = 0,
+                   override: bool = False) -> MockLLM:
+    '''
+    設定 mock provider
+
+    :param latency: 平均延遲秒數
+    :param jitter: 延遲抖動範圍 (秒)
+    :param error_rate: 失敗機率 (0~1)
+    :param seed: 隨機種子
+    :param override: 是否把所有 provider 的呼叫都改送到 mock
+    :return(MockLLM): mock provider
+    '''
+    global _mock, PROVIDER_OVERRIDE
+    _mock = MockLLM(latency=latency, jitter=jitter,
+                    error_rate=error_rate, seed=seed)
+    if override:
+        PROVIDER_OVERRIDE = 'mock'
+    return _mock
+
+
+def _resolve(provider: str, model_name: Optional[str]) -> tuple[str, str]:
+    if PROVIDER_OVERRIDE and provider != PROVIDER_OVERRIDE:
+        # 改送到其他 provider 時，原本指定的模型名稱不適用
+        provider, model_name = PROVIDER_OVERRIDE, None
+    if provider not in DEFAULT_MODEL_NAMES:
+        raise ValueError(f"不支援的LLM provider: {provider}")
+    if model_name is None:
+        model_name = DEFAULT_MODEL_NAMES[provider]
+    return provider, model_name
+
+# 回應快取，預設關閉，呼叫 enable_cache() 後啟用
+_cache: Optional[LLMCache] = None
+
+# 進行中的請求，相同 key 的呼叫會等同一個結果
+_inflight = SingleFlight()
+
+
+def enable_cache(path: Optional[str] = None, memory_size: int = 1024,
+                 disk_size: int = 100_000, ttl: Optional[float] = None
+                 ) -> LLMCache:
+    '''
+    啟用 get_llm_response 的回應快取
+
+    :param path: SQLite 檔案路徑，None 表示只用記憶體
+    :param memory_size: 記憶體 LRU 最多幾筆
+    :param disk_size: 磁碟最多幾筆
+    :param ttl: 幾秒後過期，None 表示永不過期
+    :return(LLMCache): 快取物件
+    '''
+    global _cache
+    disable_cache()
+    _cache = LLMCache(path, memory_size=memory_size,
+                      disk_size=disk_size, ttl=ttl)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def get_cache_stats() -> dict:
+    '''快取命中統計，未啟用時回傳空 dict'''
+    return _cache.stats() if _cache is not None else {}
+
+
+# 各 provider、各 API 金鑰各一個流量限制器
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    '''
+    取得目前金鑰的流量限制器，限制值來自 config[provider]['rate_limit']
+
+    :param provider: 哪家的LLM
+    :return(RateLimiter): 同一把金鑰共用同一個限制器
+    '''
+    key = (provider, API_KEYS.get(provider))
+    limiter = _rate_limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limits = config[provider]['rate_limit']
+            limiter = RateLimiter(
+                rpm=limits['rpm'], tpm=limits['tpm'],
+                initial_concurrency=limits['concurrency'],
+                max_concurrency=limits['max_concurrency'],
+            )
+            _rate_limiters[key] = limiter
+        return limiter
+
+
+def get_rate_limit_stats() -> dict:
+    '''各限制器的排隊數、同時請求數與上限等，key 為 "provider:金鑰末四碼"'''
+    return {
+        f"{provider}:{str(api_key)[-4:]}": limiter.stats()
+        for (provider, api_key), limiter in list(_rate_limiters.items())
+    }
+
+
+def get_coalesce_stats() -> dict:
+    '''相同請求合併的統計：executed 實際送出，coalesced 被合併省下的次數'''
+    return _inflight.stats()
+
+
+def _generation_config(provider: str):
+    return config.get(provider, {}).get('generation_config')
+
+
 def get_llm_response(prompt_text: str, provider: str,
-                     model_name: Optional[str | None] = None) -> str:
+                     model_name: Optional[str | None] = None,
+                     use_cache: bool = True) -> str:
     '''
     發送prompt到LLM並取得回應
     
     :param prompt_text: 提示詞
     :param provider: 哪家的LLM
     :param model_name: 模型名稱
+    :param use_cache: 是否使用快取並與進行中的相同請求合併，
+                      需要每次都不同的回應(如作詩)時設為 False
     :return(str): LLM實際回應文字
     '''
+    # cassette 以呼叫端要求的 provider 為 key (llm_provider 覆寫之前)，
+    # 錄製與重播時 llm_provider 的設定可以不同
+    tape_key = _cassette_key(prompt_text, provider, model_name) \
+        if cassette.active() is not None else None
+    provider, model_name = _resolve(provider, model_name)
+
+    if not use_cache:
+        # 需要每次都不同的回應，不走快取也不與其他請求合併
+        return _call_provider(prompt_text, provider, model_name, tape_key)
+
+    key = make_key(provider, model_name, _generation_config(provider),
+                   prompt_text)
+    if _cache is not None:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    # 相同請求正在進行中時等它的結果，不再重送
+    return _inflight.do(
+        key, lambda: _store(key, _call_provider(
+            prompt_text, provider, model_name, tape_key)))
+
+
+def _call_provider(prompt_text: str, provider: str, model_name: str,
+                   tape_key: Optional[str] = None) -> str:
+    tape = cassette.active()
+    if tape is not None:
+        # 錄製或重播 (重播時不會呼叫外部服務)
+        return tape.call(
+            'llm', tape_key or _cassette_key(prompt_text, provider, model_name),
+            lambda: _dispatch(prompt_text, provider, model_name),
+            {'provider': provider, 'model': model_name})
+    return _dispatch(prompt_text, provider, model_name)
+
+
+def _dispatch(prompt_text: str, provider: str, model_name: str) -> str:
     if provider == "gemini":
         return _gemini(prompt_text, model_name)
-    elif provider == "deepseek":
-        return _deepseek(prompt_text, model_name)
-    else:
-        raise ValueError(f"不支援的LLM provider: {provider}")
+    if provider == "mock":
+        return _mock_call(prompt_text)
+    return _deepseek(prompt_text, model_name)
+
+
+def _cassette_key(prompt_text: str, provider: str,
+                  model_name: Optional[str]) -> str:
+    # 以邏輯上的請求 (呼叫端要求的 provider 與模型) 為 key，不含 mock 等覆寫後實際送出的 provider
+    model_name = model_name or DEFAULT_MODEL_NAMES.get(provider)
+    return make_key(provider, model_name, _generation_config(provider),
+                    prompt_text)
+
+
+def _mock_call(prompt_text: str) -> str:
+    # 與 _gemini 相同：經過流量限制，失敗時回傳空字串
+    with get_rate_limiter('mock').slot(prompt_text) as slot:
+        try:
+            return _mock.generate(prompt_text)
+        except MockLLMError as e:
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            return ""
+
+
+async def _mock_call_async(prompt_text: str) -> str:
+    async with get_rate_limiter('mock').slot(prompt_text) as slot:
+        try:
+            return await _mock.generate_async(prompt_text)
+        except MockLLMError as e:
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            return ""
+
+
+def _store(key: str, res: str) -> str:
+    # 空字串代表呼叫失敗，不寫入快取
+    if _cache is not None and res:
+        _cache.set(key, res)
+    return res
     
 
 def _deepseek(prompt_text: str, model_name: Optional[str | None] = None
               ) -> str:
     # 如果沒有指定模型名稱(None)，則使用預設的模型名稱
     if model_name is None:
-        model_name = 'deepseek-chat'
+        model_name = DEFAULT_MODEL_NAMES['deepseek']
     
     _check_api_key('deepseek')  # 檢查API金鑰是否正確設定
     
-    client = OpenAI(api_key=API_KEYS['deepseek'],
-                    base_url="https://api.deepseek.com")
-
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            # {"role": "system", "content": "You are a helpful assistant"},
-            {"role": "user", "content": prompt_text},
-        ],
-        stream=False
-    )
+    client = clients.get_openai_client(API_KEYS['deepseek'],
+                                       DEEPSEEK_BASE_URL)
+
+    with get_rate_limiter('deepseek').slot(prompt_text):
+        response = client.chat.completions.create(
+            model=model_name,
+            messages=[
+                # {"role": "system", "content": "You are a helpful assistant"},
+                {"role": "user", "content": prompt_text},
+            ],
+            stream=False
+        )
     # print(response)
 
     # print(response.choices[0].message.content)
@@ -118,38 +334,61 @@ def _gemini(prompt_text: str, model_name: Optional[str | None] = None) -> str:
     '''
     # 如果沒有指定模型名稱(None)，則使用預設的模型名稱
     if model_name is None:
-        model_name = 'gemini-1.5-flash-latest'
+        model_name = DEFAULT_MODEL_NAMES['gemini']
         
     _check_api_key('gemini')  # 檢查API金鑰是否正確設定
 
-    # try:
-    genai.configure(api_key=API_KEYS['gemini'])  # 設定API金鑰
     # 這個api已經被官方棄用，但沒事就先照用吧
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        safety_settings=config['gemini']['safety_settings'],
-        generation_config=config['gemini']['generation_config'],
-    )
-    try:
-        response = model.generate_content(
-            # 請求超過10秒未回應開始重試並輸出訊息，加上重試最多約30秒
-            prompt_text, request_options={
-                "timeout": 90,
-                "retry": retry.Retry(
-                    initial=1,
-                    maximum=10,
-                    multiplier=2,
-                    timeout=180,
-                    on_error=lambda e: print(f"Retrying due to error: {e}"),
-                )
-            })
-    except RetryError:  # response 回應超過timeout且retry後仍無效的錯誤類別
-        print("請求超時，請稍後再試。")
-        return ""
-    except Exception as e:
-        print(f"發生錯誤: {e}")
-        return ""
+    model = _gemini_model(model_name)
+    with get_rate_limiter('gemini').slot(prompt_text) as slot:
+        try:
+            response = model.generate_content(
+                # 請求超過10秒未回應開始重試並輸出訊息，加上重試最多約30秒
+                prompt_text, request_options={
+                    "timeout": 90,
+                    "retry": retry.Retry(**_gemini_retry_args(slot))
+                })
+        except RetryError as e:  # response 回應超過timeout且retry後仍無效的錯誤類別
+            slot.fail(e)
+            print("請求超時，請稍後再試。")
+            return ""
+        except Exception as e:
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            return ""
     
+    return _gemini_text(response)
+
+
+def _gemini_retry_args(slot) -> dict:
+    def on_error(e):
+        print(f"Retrying due to error: {e}")
+        # 每次重試前都回報，遇到 429/5xx 時立即降低同時請求數
+        slot.limiter.report_error(e)
+
+    return dict(initial=1, maximum=10, multiplier=2, timeout=180,
+                on_error=on_error)
+
+
+def _gemini_model(model_name: str):
+    # 同一個模型與設定共用一個 GenerativeModel，不必每次重新 configure/建立
+    return clients.get_gemini_model(
+        API_KEYS['gemini'], model_name,
+        config['gemini']['safety_settings'],
+        config['gemini']['generation_config'],
+    )
+
+
+def _gemini_async_model(model_name: str):
+    # async client 綁定在 event loop 上，每個 loop 各自共用一個 GenerativeModel
+    return clients.get_async_gemini_model(
+        API_KEYS['gemini'], model_name,
+        config['gemini']['safety_settings'],
+        config['gemini']['generation_config'],
+    )
+
+
+def _gemini_text(response) -> str:
     # 從回應中取得實際生成的文本
     generated_text = ""
     if response.candidates and hasattr(response.candidates[0], 'content') \
@@ -163,6 +402,271 @@ def _gemini(prompt_text: str, model_name: Optional[str | None] = None) -> str:
     return generated_text
 
 
+# --- asyncio 版本 ---
+# 在同一個 event loop 上同時發出大量請求，不需要每個 agent 開一個 thread。
+# 全域與各 provider 各有一個 semaphore 限制同時進行中的請求數。
+
+ASYNC_MAX_CONCURRENCY = 64
+ASYNC_PROVIDER_LIMITS = {
+    'gemini': 32,
+    'deepseek': 16,
+    'mock': 1024,
+}
+
+# semaphore 綁定在建立時所在的 event loop，因此依 loop 分開保存
+_async_semaphores = {}
+# 多個執行緒各有自己的 event loop (主程式、換日、planner、benchmark)，建立與清除時需要鎖
+_async_semaphores_lock = threading.Lock()
+
+
+def _get_semaphores(provider: str):
+    loop = asyncio.get_running_loop()
+    sems = _async_semaphores.get(loop)
+    if sems is None:
+        with _async_semaphores_lock:
+            # 取得鎖後再確認一次，同一個 loop 只建立一組
+            sems = _async_semaphores.get(loop)
+            if sems is None:
+                sems = {
+                    '*': asyncio.Semaphore(ASYNC_MAX_CONCURRENCY),
+                    **{p: asyncio.Semaphore(n)
+                       for p, n in ASYNC_PROVIDER_LIMITS.items()}
+                }
+                # 舊的 loop 已結束就不需要保留
+                for old_loop in [lp for lp in _async_semaphores
+                                 if lp.is_closed()]:
+                    del _async_semaphores[old_loop]
+                _async_semaphores[loop] = sems
+    return sems['*'], sems[provider]
+
+
+async def get_llm_response_async(prompt_text: str, provider: str,
+                                 model_name: Optional[str | None] = None,
+                                 use_cache: bool = True) -> str:
+    '''
+    get_llm_response 的 asyncio 版本
+    
+    :param prompt_text: 提示詞
+    :param provider: 哪家的LLM
+    :param model_name: 模型名稱
+    :param use_cache: 是否使用快取
+    :return(str): LLM實際回應文字
+    '''
+    # cassette 以呼叫端要求的 provider 為 key (llm_provider 覆寫之前)，
+    # 錄製與重播時 llm_provider 的設定可以不同
+    tape_key = _cassette_key(prompt_text, provider, model_name) \
+        if cassette.active() is not None else None
+    provider, model_name = _resolve(provider, model_name)
+
+    if not use_cache:
+        return await _call_provider_async(prompt_text, provider, model_name,
+                                         tape_key)
+
+    key = make_key(provider, model_name, _generation_config(provider),
+                   prompt_text)
+    if _cache is not None:
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    async def fetch():
+        return _store(key, await _call_provider_async(
+            prompt_text, provider, model_name, tape_key))
+
+    # 與 thread 版本共用同一個 _inflight，兩邊的相同請求也會合併
+    return await _inflight.do_async(key, fetch)
+
+
+async def _call_provider_async(prompt_text: str, provider: str,
+                               model_name: str,
+                               tape_key: Optional[str] = None) -> str:
+    tape = cassette.active()
+    if tape is not None:
+        return await tape.call_async(
+            'llm', tape_key or _cassette_key(prompt_text, provider, model_name),
+            lambda: _dispatch_async(prompt_text, provider, model_name),
+            {'provider': provider, 'model': model_name})
+    return await _dispatch_async(prompt_text, provider, model_name)
+
+
+async def _dispatch_async(prompt_text: str, provider: str,
+                          model_name: str) -> str:
+    global_sem, provider_sem = _get_semaphores(provider)
+    async with global_sem, provider_sem:
+        if provider == "gemini":
+            return await _gemini_async(prompt_text, model_name)
+        if provider == "mock":
+            return await _mock_call_async(prompt_text)
+        return await _deepseek_async(prompt_text, model_name)
+
+
+async def _deepseek_async(prompt_text: str, model_name: str) -> str:
+    _check_api_key('deepseek')  # 檢查API金鑰是否正確設定
+
+    client = clients.get_async_openai_client(API_KEYS['deepseek'],
+                                             DEEPSEEK_BASE_URL)
+    async with get_rate_limiter('deepseek').slot(prompt_text):
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "user", "content": prompt_text},
+            ],
+            stream=False
+        )
+    return str(response.choices[0].message.content)
+
+
+async def _gemini_async(prompt_text: str, model_name: str) -> str:
+    _check_api_key('gemini')  # 檢查API金鑰是否正確設定
+
+    model = _gemini_async_model(model_name)
+    async with get_rate_limiter('gemini').slot(prompt_text) as slot:
+        try:
+            response = await model.generate_content_async(
+                prompt_text, request_options={
+                    "timeout": 90,
+                    "retry": retry_async.AsyncRetry(
+                        **_gemini_retry_args(slot))
+                })
+        except RetryError as e:  # response 回應超過timeout且retry後仍無效的錯誤類別
+            slot.fail(e)
+            print("請求超時，請稍後再試。")
+            return ""
+        except Exception as e:
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            return ""
+
+    return _gemini_text(response)
+
+
+# --- 串流版本 ---
+# 一邊生成一邊取得文字，呼叫端可以在整個回應完成前就先處理已經完整的部分。
+
+
+class _StreamFailed(Exception):
+    '''串流中途失敗 (已記錄錯誤)，已送出的部分不寫入快取'''
+
+
+async def get_llm_response_stream_async(prompt_text: str, provider: str,
+                                        model_name: Optional[str | None] = None,
+                                        use_cache: bool = True):
+    '''
+    get_llm_response_async 的串流版本，逐段 yield 生成的文字
+
+    快取命中或使用 cassette 時一次 yield 整個回應；完整回應同樣會寫入快取。
+    串流請求不與其他相同請求合併。
+
+    :param prompt_text: 提示詞
+    :param provider: 哪家的LLM
+    :param model_name: 模型名稱
+    :param use_cache: 是否使用快取
+    :return: 文字片段的 async iterator
+    '''
+    # cassette 以呼叫端要求的 provider 為 key (llm_provider 覆寫之前)，
+    # 錄製與重播時 llm_provider 的設定可以不同
+    tape_key = _cassette_key(prompt_text, provider, model_name) \
+        if cassette.active() is not None else None
+    provider, model_name = _resolve(provider, model_name)
+    key = make_key(provider, model_name, _generation_config(provider),
+                   prompt_text)
+    if use_cache and _cache is not None:
+        cached = _cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    if cassette.active() is not None:
+        # cassette 以完整回應為單位錄製與重播
+        res = await _call_provider_async(prompt_text, provider, model_name,
+                                        tape_key)
+        if use_cache:
+            _store(key, res)
+        yield res
+        return
+
+    parts = []
+    try:
+        async for chunk in _call_provider_stream_async(prompt_text, provider,
+                                                       model_name):
+            parts.append(chunk)
+            yield chunk
+    except _StreamFailed:
+        return
+    if use_cache:
+        _store(key, "".join(parts))
+
+
+async def _call_provider_stream_async(prompt_text: str, provider: str,
+                                      model_name: str):
+    global_sem, provider_sem = _get_semaphores(provider)
+    async with global_sem, provider_sem:
+        if provider == "gemini":
+            stream = _gemini_stream_async(prompt_text, model_name)
+        elif provider == "mock":
+            stream = _mock_stream_async(prompt_text)
+        else:
+            stream = _deepseek_stream_async(prompt_text, model_name)
+        async for chunk in stream:
+            yield chunk
+
+
+async def _mock_stream_async(prompt_text: str):
+    async with get_rate_limiter('mock').slot(prompt_text) as slot:
+        try:
+            async for chunk in _mock.generate_stream_async(prompt_text):
+                yield chunk
+        except MockLLMError as e:
+            # 與非串流版本相同：失敗時只記錄，已收到的部分由呼叫端判斷是否可用
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            raise _StreamFailed() from e
+
+
+async def _deepseek_stream_async(prompt_text: str, model_name: str):
+    _check_api_key('deepseek')  # 檢查API金鑰是否正確設定
+
+    client = clients.get_async_openai_client(API_KEYS['deepseek'],
+                                             DEEPSEEK_BASE_URL)
+    async with get_rate_limiter('deepseek').slot(prompt_text):
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "user", "content": prompt_text},
+            ],
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def _gemini_stream_async(prompt_text: str, model_name: str):
+    _check_api_key('gemini')  # 檢查API金鑰是否正確設定
+
+    model = _gemini_async_model(model_name)
+    async with get_rate_limiter('gemini').slot(prompt_text) as slot:
+        try:
+            response = await model.generate_content_async(
+                prompt_text, stream=True, request_options={
+                    "timeout": 90,
+                    "retry": retry_async.AsyncRetry(
+                        **_gemini_retry_args(slot))
+                })
+            async for chunk in response:
+                text = _gemini_text(chunk)
+                if text:
+                    yield text
+        except RetryError as e:  # response 回應超過timeout且retry後仍無效的錯誤類別
+            slot.fail(e)
+            print("請求超時，請稍後再試。")
+            raise _StreamFailed() from e
+        except Exception as e:
+            slot.fail(e)
+            print(f"發生錯誤: {e}")
+            raise _StreamFailed() from e
+
+
 # print(_gemini('請幫我寫一篇關於AI的報告'))
 # import time
 
@@ -0,0 +1,187 @@
+# LLM 回應快取：記憶體 LRU + SQLite 磁碟兩層
+# key 由 provider、模型、生成設定與 prompt 的雜湊組成 (content-addressed)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def make_key(provider: str, model_name: str, generation_config,
+             prompt_text: str) -> str:
+    '''
+    產生快取 key
+
+    :param provider: 哪家的LLM
+    :param model_name: 模型名稱
+    :param generation_config: 生成設定 (任何可 repr 的物件)
+    :param prompt_text: 提示詞
+    :return(str): sha256 hex
+    '''
+    prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+    raw = json.dumps(
+        [provider, model_name, repr(generation_config), prompt_hash],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# 每寫入幾筆才清除一次磁碟上過期的資料 (讀取時本來就會略過過期資料)
+TTL_SWEEP_INTERVAL = 256
+
+
+class LLMCache:
+    '''
+    兩層快取
+
+    - 記憶體層：OrderedDict 實作的 LRU，最多 memory_size 筆
+    - 磁碟層：SQLite，最多 disk_size 筆，超過時刪除最久未使用的資料
+    兩層都以 ttl 秒數判斷過期，ttl 為 None 表示永不過期。
+    '''
+
+    def __init__(self, path: Optional[str] = None, memory_size: int = 1024,
+                 disk_size: int = 100_000, ttl: Optional[float] = None):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+
+        self._memory = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'writes': 0, 'evictions': 0}
+
+        self._db = None
+        self._disk_count = 0  # 磁碟層的筆數，避免每次寫入都 COUNT(*)
+        self._writes_since_sweep = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed"
+                " ON llm_cache(accessed_at)"
+            )
+            self._db.commit()
+            self._disk_count = self._db.execute(
+                "SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        '''取得快取內容，找不到或已過期時回傳 None'''
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if not self._expired(item[0], now):
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return item[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute(
+                            "UPDATE llm_cache SET accessed_at = ?"
+                            " WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._put_memory(key, created_at, value)
+                        self._stats['disk_hits'] += 1
+                        return value
+                    cur = self._db.execute(
+                        "DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._disk_count -= max(cur.rowcount, 0)
+                    self._db.commit()
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        '''寫入快取'''
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, value)
+            if self._db is not None:
+                # 以主鍵查詢是否已存在，維持磁碟層的筆數
+                if self._db.execute("SELECT 1 FROM llm_cache WHERE key = ?",
+                                    (key,)).fetchone() is None:
+                    self._disk_count += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache"
+                    " (key, value, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?)", (key, value, now, now))
+                self._evict_disk()
+                self._db.commit()
+            self._stats['writes'] += 1
+
+    def _put_memory(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _evict_disk(self):
+        self._writes_since_sweep += 1
+        if self.ttl is not None and \
+                self._writes_since_sweep >= TTL_SWEEP_INTERVAL:
+            # 過期清除需要走訪整個資料表，每 TTL_SWEEP_INTERVAL 次寫入才做一次
+            self._writes_since_sweep = 0
+            cur = self._db.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (time.time() - self.ttl,))
+            self._disk_count -= max(cur.rowcount, 0)
+            self._stats['evictions'] += max(cur.rowcount, 0)
+        if self._disk_count > self.disk_size:
+            cur = self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at ASC"
+                " LIMIT ?)", (self._disk_count - self.disk_size,))
+            self._disk_count -= max(cur.rowcount, 0)
+            self._stats['evictions'] += max(cur.rowcount, 0)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+                self._disk_count = 0
+
+    def stats(self) -> dict:
+        '''命中 / 未命中統計'''
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            if self._db is not None:
+                stats['disk_entries'] = self._disk_count
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (
+            (stats['memory_hits'] + stats['disk_hits']) / lookups
+            if lookups else 0.0
+        )
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,35 @@
+# 地點 -> 角色 的索引 (backend_app 使用)
+# 角色的 current_location 改變時就地更新，查詢「誰在某地點」不必走訪所有角色。
+
+
+class LocationIndex:
+    def __init__(self):
+        self._agents_at = {}  # 地點 -> {agent_id: agent}
+
+    def move(self, agent, old_location, new_location):
+        '''
+        :param agent: 有 agent_id 屬性的角色
+        :param old_location: 原本的地點，None 表示剛加入
+        :param new_location: 新的地點，None 表示離開
+        '''
+        if old_location is not None:
+            agents = self._agents_at.get(old_location)
+            if agents is not None:
+                agents.pop(agent.agent_id, None)
+                if not agents:
+                    del self._agents_at[old_location]
+        if new_location is not None:
+            self._agents_at.setdefault(new_location, {})[agent.agent_id] = agent
+
+    def at(self, location) -> dict:
+        '''
+        :return(dict): 在 location 的角色 {agent_id: agent}，請勿修改
+        '''
+        return self._agents_at.get(location, {})
+
+    def locations(self) -> dict:
+        '''
+        :return(dict): 每個有角色的地點的人數
+        '''
+        return {location: len(agents)
+                for location, agents in self._agents_at.items()}
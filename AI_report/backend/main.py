@@ -1,9 +1,20 @@
+import asyncio
+import atexit
 from code import interact
+import os
 import re
 from storage import retrieve_data, add_data
+import storage
+from storage_backend import SQLiteBackend
 from flask import Flask, jsonify
 import threading
-from schedule import agents
+from concurrent.futures import ThreadPoolExecutor
+import schedule
+from schedule import agents, plan_agents_async
+from llm import enable_cache
+import cassette
+import planner
+import rollover
 import time
 import uvicorn
 
@@ -46,30 +57,47 @@ def background_job():
     #     treads.append(t)
     # for t in treads:
     #     t.start()
-    peoples_name = {'li': '李白',
-                    'teacher_li': '李老師',
-                    'li_qing_zhao': '李清照',
-                    'zhuang_zi': '莊子'}
-    
     def gen_plan(name):
-        print(f"{peoples_name[name]}計畫啟動")
+        print(f"{agents[name].name}計畫啟動")
         agents[name].plan_hour()
         agents[name].plan_15_minute(
-            retrieve_data(f'sch_{peoples_name[name]}_hour')
+            retrieve_data(f'sch_{agents[name].name}_hour')
         )
         agents[name].split_plan_to_each_15_minute()
-        print(f"{peoples_name[name]}計畫結束")
-        
-    threads = []
-    for name in peoples_name:
-        t = threading.Thread(target=gen_plan, args=(name,))
-        threads.append(t)
-    for t in threads:
-        t.start()
+        print(f"{agents[name].name}計畫結束")
+
+    def report(name, future):
+        # pool 不會印出工作中的例外，在完成時自行印出
+        if future.exception() is not None:
+            print(f"{agents[name].name}計畫失敗: {future.exception()!r}")
+
+    # 角色再多也只開 PLAN_WORKERS 個執行緒
+    pool = ThreadPoolExecutor(max_workers=schedule.PLAN_WORKERS)
+    futures = {}
+    for name in agents:
+        futures[name] = pool.submit(gen_plan, name)
+        futures[name].add_done_callback(
+            lambda future, name=name: report(name, future))
+    pool.shutdown(wait=False)
+    return futures
+
+
+
+def background_job_async():
+    """
+    background_job 的 asyncio 版本：所有角色的規劃都在同一個 event loop 上進行，
+    同時規劃的角色數由 schedule.PLAN_WORKERS 限制，
+    同時進行的 LLM 請求數由 llm.ASYNC_MAX_CONCURRENCY 等設定限制。
+    """
+    print(f"{len(agents)} 個角色計畫啟動")
+    failures = asyncio.run(plan_agents_async(agents))
+    for name, res in failures.items():
+        print(f"{name}計畫失敗: {res}")
+    print(f"{len(agents) - len(failures)} 個角色計畫結束")
 
     
-def start_background_thread():
-    t = threading.Thread(target=background_job, daemon=True)
+def start_background_thread(target=background_job_async):
+    t = threading.Thread(target=target, daemon=True)
     t.start()
     print("[主程式] 背景工作已啟動")
 
@@ -85,8 +113,47 @@ def interactive():
 
 
 if __name__ == "__main__":
+    # 0. 有設定 llm_cache 環境變數時，啟用 LLM 回應快取 (值為 SQLite 檔案路徑)
+    if os.getenv('llm_cache'):
+        enable_cache(os.getenv('llm_cache'))
+
+    # 有設定 llm_cassette 時錄製 (record) 或重播 (replay) LLM 與語音合成的流量
+    if os.getenv('llm_cassette'):
+        if os.getenv('llm_cassette_mode', 'replay') == 'record':
+            cassette.record(os.getenv('llm_cassette'))
+        else:
+            cassette.replay(os.getenv('llm_cassette'),
+                            honor_timing=bool(os.getenv('llm_cassette_timing')))
+
+    # storage 的快取上限 (筆數、位元組數、存活秒數)
+    limits = {'max_entries': os.getenv('storage_max_entries'),
+              'max_bytes': os.getenv('storage_max_bytes'),
+              'ttl': os.getenv('storage_ttl')}
+    storage.configure(**{k: float(v) if k == 'ttl' else int(v)
+                         for k, v in limits.items() if v})
+
+    # 有設定 storage_db 時把行程寫入 SQLite，重新啟動後直接從檔案重建，不必重新產生
+    if os.getenv('storage_db'):
+        loaded = storage.attach_backend(SQLiteBackend(os.getenv('storage_db')))
+        atexit.register(storage.detach_backend)
+        print(f"[主程式] 已從 {os.getenv('storage_db')} 載入 {loaded} 筆資料")
+
+    # 同時規劃一整天的角色數 (角色名冊由 agent_roster 環境變數指定，於 import schedule 時載入)
+    if os.getenv('plan_workers'):
+        schedule.PLAN_WORKERS = int(os.getenv('plan_workers'))
+
+    # 有設定 day_length 時每隔 day_length 秒換日，明天的行程在背景預先產生
+    lazy = os.getenv('plan_mode') == 'lazy'
+    if os.getenv('day_length'):
+        rollover.start(day_length=float(os.getenv('day_length')),
+                       prefetch=not lazy)
+
     # 1. 先啟動背景工作（只呼叫一次）
-    start_background_thread()
+    #    plan_mode=lazy 時不預先產生，改為有人查詢時才產生該時段與接下來的時段
+    if lazy:
+        planner.start(lookahead=int(os.getenv('plan_lookahead', 1)))
+    else:
+        start_background_thread()
 
     # 2. 再啟動 Flask（多執行緒模式）
     #    threaded=True 可讓每個 HTTP 請求都跑在自己的 thread 裡
@@ -0,0 +1,115 @@
+# 角色的記憶流 (backend_app.Agent 使用)
+# 固定大小的環狀緩衝區，另外依記憶類型與相關角色建立索引：
+# 查詢「最近 k 筆 (某類型 / 與某角色有關) 的記憶」只需走訪 k 筆，不必複製整個記憶流再過濾。
+
+import heapq
+from collections import deque
+from itertools import islice
+
+
+class MemoryRecord:
+    '''一筆記憶，to_dict() 的格式與舊版存在 deque 中的 dict 相同'''
+    __slots__ = ('seq', 'timestamp', 'type', 'description', 'importance',
+                 'related_agents')
+
+    def __init__(self, seq, timestamp, memory_type, description, importance,
+                 related_agents):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.type = memory_type
+        self.description = description
+        self.importance = importance
+        self.related_agents = related_agents
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp, "type": self.type,
+            "description": self.description,
+            "importance": self.importance,
+            "related_agents": self.related_agents
+        }
+
+
+class MemoryStream:
+    '''
+    :param maxlen: 最多保留幾筆，超過時最舊的一筆 (連同它在索引中的位置) 被移除
+    '''
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._records = [None] * maxlen  # 第 seq 筆存放在 seq % maxlen
+        self._seq = 0  # 下一筆的序號
+        # 類型 / 相關角色 -> 仍在緩衝區內的記憶序號 (由舊到新)
+        self._by_type = {}
+        self._by_agent = {}
+
+    def __len__(self) -> int:
+        return min(self._seq, self.maxlen)
+
+    def __iter__(self):
+        '''由舊到新走訪所有記憶'''
+        for seq in range(self._seq - len(self), self._seq):
+            yield self._records[seq % self.maxlen]
+
+    def append(self, timestamp, memory_type, description, importance,
+               related_agents=()) -> MemoryRecord:
+        seq = self._seq
+        slot = seq % self.maxlen
+        evicted = self._records[slot]
+        if evicted is not None:
+            # 最舊的一筆一定在它所屬索引的最左邊
+            self._unindex(self._by_type, evicted.type)
+            for agent_id in evicted.related_agents:
+                self._unindex(self._by_agent, agent_id)
+
+        # 同一個角色重複出現時只記一次，related_to 才不會回傳重複的記憶
+        record = MemoryRecord(seq, timestamp, memory_type, description,
+                              importance, list(dict.fromkeys(related_agents)))
+        self._records[slot] = record
+        self._by_type.setdefault(memory_type, deque()).append(seq)
+        for agent_id in record.related_agents:
+            self._by_agent.setdefault(agent_id, deque()).append(seq)
+        self._seq += 1
+        return record
+
+    @staticmethod
+    def _unindex(index: dict, key):
+        seqs = index[key]
+        seqs.popleft()
+        if not seqs:
+            del index[key]
+
+    def latest(self, k: int, types=None) -> list:
+        '''
+        :param k: 最多取幾筆
+        :param types: 只取這些類型的記憶，None 表示不限
+        :return(list[MemoryRecord]): 最近的 k 筆記憶，由舊到新
+        '''
+        if k <= 0:
+            return []
+        if types is None:
+            start = max(self._seq - min(k, len(self)), 0)
+            return [self._records[seq % self.maxlen]
+                    for seq in range(start, self._seq)]
+        if isinstance(types, str):
+            types = (types,)
+        types = dict.fromkeys(types)  # 重複的類型只合併一次
+        # 每個類型各取最新的 k 筆，再依序號合併取最新的 k 筆
+        newest = heapq.merge(
+            *(islice(reversed(self._by_type.get(t, ())), k) for t in types),
+            reverse=True)
+        return self._records_of(islice(newest, k))
+
+    def related_to(self, agent_id, k: int) -> list:
+        '''
+        :param agent_id: 相關角色的 agent_id
+        :param k: 最多取幾筆
+        :return(list[MemoryRecord]): 與該角色有關的最近 k 筆記憶，由舊到新
+        '''
+        newest = islice(reversed(self._by_agent.get(agent_id, ())), k)
+        return self._records_of(newest)
+
+    def _records_of(self, newest_seqs) -> list:
+        records = [self._records[seq % self.maxlen] for seq in newest_seqs]
+        records.reverse()
+        return records
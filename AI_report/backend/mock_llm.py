@@ -0,0 +1,199 @@
+# 離線用的假 LLM provider
+# 依 prompt 的種類回傳格式正確的內容，可設定延遲、抖動與錯誤率，
+# 用來在沒有網路與額度的環境下量測整個流程本身的效能與擴展性。
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+LOCATIONS = ["河邊", "酒館", "李清照家", "李清照家的庭院", "莊子家",
+             "城門", "衙門", "診所", "書院"]
+# backend_app.py 使用的地點
+APP_LOCATIONS = ["河川", "書院", "酒館", "衙門", "城門", "診所"]
+
+ACTIVITIES = {
+    "河邊": ["在河邊散步", "在河邊釣魚", "坐在河邊發呆", "在河邊吟詩", "在河邊準備睡覺"],
+    "酒館": ["在酒館喝酒", "與掌櫃閒聊", "獨酌一壺", "在酒館聽說書"],
+    "李清照家": ["在家中寫詞", "整理書房", "用膳", "準備就寢"],
+    "李清照家的庭院": ["在庭院賞花", "在庭院中沉思", "在庭院撫琴"],
+    "莊子家": ["在家中讀書", "在家中打坐", "與自己下棋", "準備睡覺"],
+    "城門": ["在城門觀察行人", "在城門附近寫生", "前往城門"],
+    "衙門": ["在衙門辦事", "在衙門外等候"],
+    "診所": ["在診所看病", "在診所抓藥"],
+    "書院": ["在書院讀書", "在書院作詩", "在書院講課", "在書院抄書"],
+}
+THOUGHTS = ["（今日天氣不錯。）", "（不知道明天會如何。）", "（這件事得好好想想。）",
+            "（心情甚好。）", "（有些累了。）"]
+POEMS = [
+    ("城郭春光好，人家炊烟长。市声随日起，灯火伴书香。",
+     "城郭春光好，人家炊煙長。市聲隨日起，燈火伴書香。"),
+    ("晨钟催客起，暮鼓送人归。巷陌千家月，清风入我衣。",
+     "晨鐘催客起，暮鼓送人歸。巷陌千家月，清風入我衣。"),
+]
+
+
+class MockLLMError(Exception):
+    '''模擬的 API 錯誤，status_code 讓流量限制器視為 5xx'''
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockLLM:
+    '''
+    :param latency: 平均延遲秒數
+    :param jitter: 延遲的隨機變動範圍 (秒，均勻分布 ±jitter)
+    :param error_rate: 每次呼叫失敗的機率
+    :param seed: 隨機種子；相同 seed 與 prompt 一定得到相同內容
+    '''
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next_rng(self) -> random.Random:
+        # 延遲與錯誤依呼叫順序決定，內容只依 prompt 決定
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        return random.Random(f"{self.seed}:call:{n}")
+
+    def _plan(self) -> tuple[float, bool]:
+        rng = self._next_rng()
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        return delay, rng.random() < self.error_rate
+
+    def generate(self, prompt_text: str) -> str:
+        delay, fail = self._plan()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise MockLLMError("mock provider 模擬錯誤")
+        return render(prompt_text, self.seed)
+
+    async def generate_async(self, prompt_text: str) -> str:
+        delay, fail = self._plan()
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            raise MockLLMError("mock provider 模擬錯誤")
+        return render(prompt_text, self.seed)
+
+    async def generate_stream_async(self, prompt_text: str,
+                                    chunk_size: int = 64):
+        '''generate_async 的串流版本：把延遲平均分散在每一段文字之間'''
+        delay, fail = self._plan()
+        text = render(prompt_text, self.seed)
+        chunks = [text[i:i + chunk_size]
+                  for i in range(0, len(text), chunk_size)] or [""]
+        for i, chunk in enumerate(chunks):
+            if delay:
+                await asyncio.sleep(delay / len(chunks))
+            if fail and i == len(chunks) // 2:
+                raise MockLLMError("mock provider 模擬錯誤")
+            yield chunk
+
+
+def _rng_for(prompt_text: str, seed: int) -> random.Random:
+    digest = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+    return random.Random(f"{seed}:{digest}")
+
+
+def _fenced(data) -> str:
+    return "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _activity(rng: random.Random, location: str) -> str:
+    return rng.choice(ACTIVITIES.get(location, ["四處走走"]))
+
+
+def render(prompt_text: str, seed: int = 0) -> str:
+    '''依 prompt 種類產生格式正確的回應'''
+    rng = _rng_for(prompt_text, seed)
+
+    if '逐一判斷' in prompt_text:  # trigger.check_special_events_batch
+        keys = re.findall(r'"(\d\d:\d\d)": \{', prompt_text)
+        return _fenced({k: rng.random() < 0.1 for k in keys})
+    if '特殊事件的條件' in prompt_text:  # trigger.check_special_events
+        return "True" if rng.random() < 0.1 else "False"
+    if '"think"' in prompt_text:  # PROMPT['scheduler']['15_minute']
+        return _fenced(_fifteen_minute_schedule(prompt_text, rng))
+    if '每小時一格' in prompt_text:  # PROMPT['scheduler']['one_hour']
+        return _fenced(_hour_schedule(rng))
+    if '"簡"' in prompt_text:  # poem.get_deepseek_poem
+        simplified, traditional = rng.choice(POEMS)
+        return json.dumps({"簡": simplified, "繁": traditional},
+                          ensure_ascii=False)
+    if '構想一個簡單的事件描述' in prompt_text:  # event.get_normal_event
+        return _normal_event(prompt_text)
+    if '"time_str"' in prompt_text:  # config.DAILY_PLAN_PROMPT_TEMPLATE
+        return _fenced(_daily_plan(prompt_text, rng))
+    if '_dialogue' in prompt_text:  # config.MEETING_DIALOGUE_PROMPT_TEMPLATE
+        ids = re.findall(r'\(ID: ([^)]+)\)', prompt_text)
+        return json.dumps({f"{i}_dialogue": rng.choice(
+            ["真巧，在這裡遇見你。", "近來可好？", "一起喝一杯吧。"]) for i in ids},
+            ensure_ascii=False)
+    if '創作一首' in prompt_text:  # config.POEM_GENERATION_PROMPT_TEMPLATE
+        return rng.choice(POEMS)[1]
+    return "（mock 回應）"
+
+
+def _hour_schedule(rng: random.Random) -> dict:
+    schedule = {}
+    for hour in range(24):
+        time_ = f"{hour:02d}:00"
+        location = rng.choice(LOCATIONS)
+        schedule[time_] = {"time": time_,
+                           "activity": _activity(rng, location),
+                           "location": location}
+    return schedule
+
+
+def _fifteen_minute_schedule(prompt_text: str, rng: random.Random) -> dict:
+    # 沿用 prompt 中每小時行程的地點，讓兩層規劃一致
+    hour_locations = dict(re.findall(
+        r"'(\d\d):00': \{[^}]*?'location': '([^']*)'", prompt_text))
+    # 分段規劃只輸出指定的時段
+    window = re.search(r'只需輸出 (\d\d):00~(\d\d):45', prompt_text)
+    hours = range(int(window.group(1)), int(window.group(2)) + 1) \
+        if window else range(24)
+    schedule = {}
+    for hour in hours:
+        location = hour_locations.get(f"{hour:02d}", rng.choice(LOCATIONS))
+        for minute in (0, 15, 30, 45):
+            time_ = f"{hour:02d}:{minute:02d}"
+            schedule[time_] = {"time": time_,
+                               "activity": _activity(rng, location),
+                               "think": rng.choice(THOUGHTS),
+                               "location": location}
+    return schedule
+
+
+def _normal_event(prompt_text: str) -> str:
+    def field(name):
+        m = re.search(rf'{name}：(.*)', prompt_text)
+        return m.group(1).strip() if m else ""
+    return (f"時間：{field('時間')}\n地點：{field('地點')}\n"
+            f"人物：{field('人物')}\n事件：兩人偶遇，寒暄了幾句。")
+
+
+def _daily_plan(prompt_text: str, rng: random.Random) -> list:
+    m = re.search(r'日程表應包含以下時辰點：(.*?)。', prompt_text)
+    times = [t.strip() for t in m.group(1).split(',')] if m else ["卯時初刻"]
+    plan = []
+    for time_str in times:
+        location = rng.choice(APP_LOCATIONS)
+        plan.append({"time_str": time_str, "location": location,
+                     "action": f"在{location}做事", "thought": rng.choice(THOUGHTS),
+                     "dialogue": ""})
+    return plan
@@ -0,0 +1,215 @@
+# 依需求產生行程 (lazy planning)
+# 啟動時不產生任何行程；api 查詢到還沒產生的時段時，才以最高優先權產生該角色該時段所在的
+# 一段 (schedule.WINDOW_HOURS 小時)，並依查詢的方向預先產生接下來的幾段。
+# LLM 的花費與實際被看到的時段成正比。
+#
+# 所有產生工作都在 planner 自己的 event loop (背景執行緒) 上進行，
+# api 的 event loop 只把需求丟過來，不會被 LLM 請求卡住。
+
+import asyncio
+import itertools
+import threading
+from typing import Optional
+
+import schedule
+import storage
+from storage import add_data, retrieve_data
+
+# 需求查詢的優先權，數字越小越先處理
+PRIORITY_DEMAND = 0
+PRIORITY_PREFETCH = 10
+
+
+class LazyPlanner:
+    '''
+    :param agents: 角色 dict (預設為 schedule.agents)
+    :param lookahead: 每次查詢後往查詢方向預先產生幾段
+    :param workers: 同時產生的段數
+    '''
+
+    def __init__(self, agents: Optional[dict] = None, lookahead: int = 1,
+                 workers: int = 8):
+        agents = agents or schedule.agents
+        self.agents = {agent.name: agent for agent in agents.values()}
+        self.lookahead = lookahead
+        self.workers = workers
+        self._loop = None
+        self._queue = None
+        self._order = itertools.count()  # 相同優先權時先到先處理
+        # 工作以 (命名空間, name, 段) 識別，換日後同一段會在新的命名空間重新產生
+        self._queued = {}  # 工作 -> 目前排隊中的優先權
+        self._running = set()  # 產生中的工作
+        self._done = set()  # 已完成的工作
+        self._hour_plans = {}  # (命名空間, name) -> 每小時行程的 Future
+        self._last_hour = {}  # name -> 上一次查詢的小時，用來判斷方向
+        self._ready = threading.Event()
+        self.stats = {'demanded': 0, 'prefetched': 0, 'windows_planned': 0}
+
+    @property
+    def windows_per_day(self) -> int:
+        return -(-24 // self._window_hours())
+
+    @staticmethod
+    def _window_hours() -> int:
+        return schedule.WINDOW_HOURS or 24
+
+    def start(self):
+        '''在背景執行緒啟動 planner 的 event loop'''
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        print("[planner] 依需求產生行程模式已啟動")
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self._loop.create_task(self._worker())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def demand(self, name: str, time: str):
+        '''
+        有人查詢 name 在 time 的行程 (可從任何執行緒呼叫，立即返回)
+
+        :param name: 角色名稱
+        :param time: 'hh:mm'
+        '''
+        if self._loop is None or name not in self.agents:
+            return
+        try:
+            hour = int(time[:2])
+        except ValueError:
+            return
+        self._loop.call_soon_threadsafe(
+            self._on_demand, storage.current_namespace(), name, hour)
+
+    def _on_demand(self, namespace: str, name: str, hour: int):
+        window = hour // self._window_hours()
+        last = self._last_hour.get(name)
+        direction = -1 if last is not None and hour < last else 1
+        self._last_hour[name] = hour
+
+        if self._enqueue(namespace, name, window, PRIORITY_DEMAND):
+            self.stats['demanded'] += 1
+        for step in range(1, self.lookahead + 1):
+            ahead = window + direction * step
+            if 0 <= ahead < self.windows_per_day and \
+                    self._enqueue(namespace, name, ahead,
+                                  PRIORITY_PREFETCH + step):
+                self.stats['prefetched'] += 1
+
+    def forget(self, namespace: str):
+        '''
+        命名空間被刪除 (換日後丟掉舊的一天) 時，清掉該命名空間的完成紀錄與每小時行程
+        (可從任何執行緒呼叫，立即返回)
+        '''
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._forget, namespace)
+
+    def _forget(self, namespace: str):
+        self._done = {job for job in self._done if job[0] != namespace}
+        for plan_key in [k for k in self._hour_plans if k[0] == namespace]:
+            del self._hour_plans[plan_key]
+
+    def _enqueue(self, namespace: str, name: str, window: int,
+                 priority: int) -> bool:
+        # 已完成或已用更高的優先權排隊時不重複排入
+        job = (namespace, name, window)
+        if job in self._done or job in self._running or \
+                self._queued.get(job, priority + 1) <= priority:
+            return False
+        self._queued[job] = priority
+        self._queue.put_nowait((priority, next(self._order), job))
+        return True
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            namespace, name, window = job
+            # 同一段被提高優先權時會排入兩次，只處理一次
+            if self._queued.get(job) != priority:
+                continue
+            del self._queued[job]
+            self._running.add(job)
+            try:
+                with storage.use_namespace(namespace):
+                    await self._plan_window(self.agents[name], window)
+            except Exception as e:
+                # 失敗時讓下一次查詢可以重新排入
+                print(f"[planner] {name} 第 {window} 段產生失敗: {e}")
+                continue
+            finally:
+                self._running.discard(job)
+            self._done.add(job)
+            self.stats['windows_planned'] += 1
+            with storage.use_namespace(namespace):
+                self._finish_day(namespace, self.agents[name])
+
+    async def _hour_plan(self, agent) -> dict:
+        # 每個角色的每小時行程只產生一次，同時需要的段共用同一個結果
+        plan_key = (storage.current_namespace(), agent.name)
+        future = self._hour_plans.get(plan_key)
+        if future is None:
+            hour_schedule = retrieve_data(f"sch_{agent.name}_hour", 0)
+            future = self._hour_plans[plan_key] = self._loop.create_future()
+            try:
+                if hour_schedule is None:
+                    hour_schedule = await agent.plan_hour_async()
+                future.set_result(hour_schedule)
+            except Exception as e:
+                del self._hour_plans[plan_key]
+                future.set_exception(e)
+                raise
+        return await future
+
+    async def _plan_window(self, agent, window: int):
+        size = self._window_hours()
+        hour_schedule = await self._hour_plan(agent)
+        hours = [h for h in sorted(hour_schedule)
+                 if int(h[:2]) // size == window]
+        if not hours:
+            return
+        if all(retrieve_data(f"sch_{agent.name}_15_minute_{h[:2]}:{m}", 0)
+               is not None for h in hours for m in ('00', '15', '30', '45')):
+            return  # 已由持久化後端載入或先前產生過
+        slots = await agent.expand_window_async(hour_schedule, hours)
+        await agent.trigger_slots_async(slots)
+
+    def _finish_day(self, namespace: str, agent):
+        # 整天的每一段都完成時，與一次產生整天的流程一樣寫入整天的資料與完成標記
+        if any((namespace, agent.name, w) not in self._done
+               for w in range(self.windows_per_day)):
+            return
+        day = {}
+        for h in sorted(self._hour_plans[(namespace, agent.name)].result()):
+            for m in ('00', '15', '30', '45'):
+                key = f"{h[:2]}:{m}"
+                slot = retrieve_data(f"sch_{agent.name}_15_minute_{key}", 0)
+                if slot is not None:
+                    day[key] = slot
+        add_data(f"sch_{agent.name}_15_minute", day)
+        add_data(f"sch_{agent.name}_done", True)
+
+
+# 目前使用中的 planner，None 表示啟動時就產生整天的行程 (main.background_job_async)
+_active: Optional[LazyPlanner] = None
+
+
+def start(lookahead: int = 1, workers: int = 8) -> LazyPlanner:
+    global _active
+    _active = LazyPlanner(lookahead=lookahead, workers=workers)
+    _active.start()
+    return _active
+
+
+def forget(namespace: str):
+    '''storage 刪除命名空間時呼叫；沒有啟用 lazy planning 時不做任何事'''
+    if _active is not None:
+        _active.forget(namespace)
+
+
+def demand(name: str, time: str):
+    '''api 查詢時呼叫；沒有啟用 lazy planning 時不做任何事'''
+    if _active is not None:
+        _active.demand(name, time)
@@ -1,13 +1,52 @@
+import base64
+import hashlib
 import json
 import os
 import time
 from dotenv import load_dotenv
-import requests
+import cassette
+import llm
 from llm import get_llm_response
+from clients import get_http_session
+
+
+def _post_tts(url, headers, json_data):
+    '''
+    送出語音合成請求；有使用中的 cassette 時會錄製或重播
+
+    :return: (status_code, 音訊 bytes, 錯誤訊息)
+    '''
+    def send():
+        # 共用的 Session 會保留與 ElevenLabs 的 keep-alive 連線
+        response = get_http_session('elevenlabs').post(
+            url, headers=headers, json=json_data)
+        ok = response.status_code == 200
+        return {
+            'status_code': response.status_code,
+            'audio': base64.b64encode(response.content).decode('ascii')
+            if ok else '',
+            'text': '' if ok else response.text,
+        }
+
+    tape = cassette.active()
+    if tape is None:
+        result = send()
+    else:
+        key = hashlib.sha256(json.dumps(
+            [url, json_data], ensure_ascii=False, sort_keys=True
+        ).encode('utf-8')).hexdigest()
+        result = tape.call('tts', key, send, {'url': url})
+    return (result['status_code'], base64.b64decode(result['audio']),
+            result['text'])
 
 
 def poem_sound(TEXT_TO_SPEAK, file_name):
 
+    if llm.PROVIDER_OVERRIDE == 'mock':
+        # 離線壓力測試時不呼叫 ElevenLabs
+        print(f"(mock) 略過語音合成: {file_name}")
+        return
+
     load_dotenv()
     API_KEY = os.getenv('voice')
 
@@ -30,14 +69,14 @@ def poem_sound(TEXT_TO_SPEAK, file_name):
             }
         }
 
-        response = requests.post(url, headers=headers, json=json_data)
+        status_code, audio, error_text = _post_tts(url, headers, json_data)
 
-        if response.status_code == 200:
+        if status_code == 200:
             with open(f"C:\\Users\\user\\OneDrive\\documents\\code\\Python\\Projects\\AI_report\\AI_report\\frontend\\assets\\audio\\{str(file_name).replace(":", "")}.mp3", "wb") as f:
-                f.write(response.content)
+                f.write(audio)
             print("✅ 合成完成，已儲存為 output.mp3")
         else:
-            print(f"❌ 合成語音失敗：{response.text}")
+            print(f"❌ 合成語音失敗：{error_text}")
 
     voice_id = "crEjeSzlrwZRyvlQkB8c"
     synthesize_speech(voice_id, TEXT_TO_SPEAK)
@@ -55,7 +94,9 @@ def get_deepseek_poem(file_name):
 
     # try:
     # 如果 HTTP 請求返回了不成功的狀態碼，則拋出 HTTPError 異常
-    response = get_llm_response(prompt_content, provider='deepseek')
+    # 每次都要新的詩，不走快取
+    response = get_llm_response(prompt_content, provider='deepseek',
+                                use_cache=False)
     print(response)
     response = json.loads(response)
     poem_sound(response['簡'], file_name)
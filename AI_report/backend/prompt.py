@@ -44,6 +44,9 @@ _one_hour_schedule = Template('''
 }
 ```
 
+【昨天的回憶】
+$memory
+
 【注意】輸出遵守以下規定：
 1. 地點只能從【可用地點】中選擇，並且地點名稱必須完全相同。
 2. 必須規劃整日的行程，從00:00~23:00，每個小時都要規劃。
@@ -109,10 +112,64 @@ each_15_minute_schedule = Template('''
 $hour_schedule
 ''')
 
+# 只細分其中幾個小時 (分段平行規劃用)
+each_15_minute_window_schedule = Template('''
+你是一個擅長將日程規劃精細化的助手。
+
+【角色設定】
+姓名：$role_name
+年齡：$old
+性格：$personality
+生活風格：$style
+住所：$home
+與其他人的關係：$relation
+
+【可用地點】
+- 河邊
+- 酒館
+- 李清照家
+- 李清照家的庭院
+- 莊子家
+- 城門
+- 衙門
+- 診所
+- 書院
+
+【任務】
+我將提供一段以每小時為單位的行程安排，請根據每個活動的描述與情境，幫我將每個小時的活動細分成4個每15分鐘的小時段，並適當增加細節與過渡情節，使之合理連貫、富有情境感。
+1. 時間(HH:MM)
+2. 活動描述：請用盡量精簡的字數描述活動狀態。
+3. 想法：角色當時的內心獨白或想法。
+4. 地點：每個15分鐘角色所在的地點。
+
+
+請以JSON輸出如下格式：
+```json
+{
+  "hh:mm": {"time": "時間", "activity": "活動描述", "think": "想法", "location": "地點"},
+  ...
+}
+```
+
+【注意】輸出遵守以下規定：
+1. 地點只能從【可用地點】中選擇，並且地點名稱必須完全相同，如果想表示在路途中，請直接用目的地代替。
+2. 只需輸出 $start_time~$end_time 的行程，這段時間內每個15分鐘都要規劃。
+3. 所有回應都是繁體中文。
+4. 保留原活動主題，但增加細節與情境，讓活動之間自然過渡，並與【前後的行程】銜接。
+5. 你只喜歡獨處，所有活動都不會與其他人交流，避免對方不再現場。
+
+【前後的行程】(僅供銜接參考，不要輸出)
+$context
+
+【我將提供這段時間每小時為單位的行程安排如下】
+$hour_schedule
+''')
+
 PROMPT = {
     'scheduler': {
         'one_hour': _one_hour_schedule,
-        '15_minute': each_15_minute_schedule
+        '15_minute': each_15_minute_schedule,
+        '15_minute_window': each_15_minute_window_schedule
     }
 }
 
@@ -0,0 +1,280 @@
+# LLM 請求的流量控制
+# - 每分鐘請求數 (RPM) 與每分鐘 token 數 (TPM) 各用一個 token bucket
+# - 同時進行中的請求數以 AIMD 調整：成功時慢慢加、遇到 429/5xx 時砍半
+# thread 與 asyncio 兩種呼叫方式共用同一份狀態
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from google.api_core.exceptions import RetryError
+
+
+def estimate_tokens(prompt_text: str) -> int:
+    '''粗估 prompt 的 token 數：中文大約一字一 token，英文較少，以字數估計偏保守'''
+    return max(1, len(prompt_text))
+
+
+def is_throttle_error(e: BaseException) -> bool:
+    '''是否為 429 或 5xx (代表應該降低請求速度)'''
+    if isinstance(e, RetryError):
+        # google 的 retry 逾時，原因多半是持續被限流
+        return True
+    status = getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or 500 <= status < 600
+
+
+class TokenBucket:
+    '''每分鐘補充 per_minute 個 token，最多存 per_minute 個'''
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self, amount: float = 1) -> float:
+        '''
+        嘗試取出 amount 個 token
+
+        :return(float): 0 表示成功；否則為還需要等待的秒數 (未取出)
+        '''
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def give_back(self, amount: float = 1):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def available(self) -> float:
+        with self._lock:
+            elapsed = time.monotonic() - self._updated
+            return min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+class AdaptiveConcurrency:
+    '''
+    AIMD 調整的同時請求上限
+
+    成功一次上限增加 1/limit (約每一輪加 1)；遇到限流時乘上 decrease，
+    同一個 cooldown 期間內只砍一次，避免一批同時失敗的請求把上限砍到底。
+    '''
+
+    def __init__(self, initial: int = 4, minimum: int = 1,
+                 maximum: int = 64, decrease: float = 0.5,
+                 cooldown: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # 等待名額的協程 (loop, future)，由 release / 上限增加時叫醒
+        self._async_waiters = deque()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                fut = loop.create_future()
+                self._async_waiters.append((loop, fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                with self._cond:
+                    if fut.done() and not fut.cancelled():
+                        # 已被叫醒卻取消了，把機會讓給下一個
+                        self._notify()
+                    else:
+                        try:
+                            self._async_waiters.remove((loop, fut))
+                        except ValueError:
+                            pass
+                raise
+
+    def _notify(self):
+        '''有名額空出來：叫醒一個等待中的 thread 與一個協程 (沒搶到的會繼續等)'''
+        with self._cond:
+            self._cond.notify()
+            while self._async_waiters:
+                loop, fut = self._async_waiters.popleft()
+                if loop.is_closed():
+                    continue
+                loop.call_soon_threadsafe(self._wake, fut)
+                break
+
+    def _wake(self, fut):
+        if fut.done():
+            # 協程在叫醒前已取消，改叫醒下一個
+            self._notify()
+        else:
+            fut.set_result(None)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    def on_success(self):
+        with self._cond:
+            grew = int(self.limit + 1 / self.limit) > int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if grew:
+                self._notify()
+
+    def on_throttle(self):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+class RateLimiter:
+    '''單一 provider + API 金鑰的流量控制'''
+
+    def __init__(self, rpm: float, tpm: float, initial_concurrency: int = 4,
+                 max_concurrency: int = 64):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency,
+                                               maximum=max_concurrency)
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+        self._throttled = 0
+        self._completed = 0
+
+    def _change_waiting(self, delta: int):
+        with self._waiting_lock:
+            self._waiting += delta
+
+    def _try_buckets(self, tokens: int) -> float:
+        wait = self.requests.try_take(1)
+        if wait:
+            return wait
+        wait = self.tokens.try_take(tokens)
+        if wait:
+            # 請求數已扣掉，token 不夠時還回去
+            self.requests.give_back(1)
+        return wait
+
+    def acquire(self, tokens: int = 1):
+        '''阻塞直到可以送出一個估計 tokens 個 token 的請求'''
+        self._change_waiting(1)
+        try:
+            while True:
+                wait = self._try_buckets(tokens)
+                if not wait:
+                    break
+                time.sleep(wait)
+            self.concurrency.acquire()
+        finally:
+            self._change_waiting(-1)
+
+    async def acquire_async(self, tokens: int = 1):
+        self._change_waiting(1)
+        try:
+            while True:
+                wait = self._try_buckets(tokens)
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+            await self.concurrency.acquire_async()
+        finally:
+            self._change_waiting(-1)
+
+    def release(self, failed: bool = False):
+        self.concurrency.release()
+        with self._waiting_lock:
+            self._completed += 1
+        if not failed:
+            self.concurrency.on_success()
+
+    def report_error(self, e: BaseException):
+        '''回報一次錯誤；429/5xx 會降低同時請求上限 (也可當作 retry 的 on_error)'''
+        if is_throttle_error(e):
+            with self._waiting_lock:
+                self._throttled += 1
+            self.concurrency.on_throttle()
+
+    def slot(self, prompt_text: str) -> '_Slot':
+        '''
+        with limiter.slot(prompt) as slot: 取得名額，離開時歸還
+
+        區塊內呼叫 slot.fail(e) 表示這次請求失敗
+        '''
+        return _Slot(self, estimate_tokens(prompt_text))
+
+    def stats(self) -> dict:
+        '''目前狀態，可用來在實際負載下調整限制'''
+        return {
+            'queue_depth': self._waiting,
+            'in_flight': self.concurrency.in_flight,
+            'concurrency_limit': round(self.concurrency.limit, 2),
+            'rpm_available': round(self.requests.available(), 2),
+            'tpm_available': round(self.tokens.available(), 2),
+            'completed': self._completed,
+            'throttled': self._throttled,
+        }
+
+
+class _Slot:
+    def __init__(self, limiter: RateLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.failed = False
+
+    def fail(self, e: Optional[BaseException] = None):
+        self.failed = True
+        if e is not None:
+            self.limiter.report_error(e)
+
+    def __enter__(self):
+        self.limiter.acquire(self.tokens)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(exc)
+        self.limiter.release(self.failed)
+        return False
+
+    async def __aenter__(self):
+        await self.limiter.acquire_async(self.tokens)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
@@ -0,0 +1,157 @@
+# 換日 (day rollover)
+# 今天 (day_N) 的行程在提供服務時，背景就以前一天的經歷作為回憶產生明天 (day_N+1) 的行程，
+# 寫在另一個 storage 命名空間。換日時只切換預設命名空間 (一次賦值)，
+# 前端不會看到「新的一天正在產生」的空檔。
+
+import asyncio
+import re
+import threading
+import time
+from typing import Optional
+
+import planner
+import schedule
+import storage
+from storage import add_data, retrieve_data
+
+NAMESPACE_PREFIX = 'day_'
+# 換日後保留幾天前的資料 (/api/day?day=... 仍可查詢)
+KEEP_DAYS = 1
+# 預先產生明天時，最多等今天的每小時行程幾秒 (用來整理成回憶)；所有角色共用這段時間
+MEMORY_WAIT = 600
+
+
+def namespace_of(day: int) -> str:
+    return f"{NAMESPACE_PREFIX}{day}"
+
+
+def summarize_day(name: str, namespace: str) -> str:
+    '''
+    把某一天的每小時行程與觸發的特殊事件整理成下一天規劃用的回憶
+
+    :param name: 角色名稱
+    :param namespace: 那一天的命名空間
+    :return(str): 多行文字，沒有資料時為空字串
+    '''
+    hour_schedule = retrieve_data(f"sch_{name}_hour", 0, namespace) or {}
+    lines = [f"{t} {slot.get('activity', '')}（{slot.get('location', '')}）"
+             for t, slot in sorted(hour_schedule.items())
+             if isinstance(slot, dict)]
+    prefix = f"trigger_{name}_"
+    for key in sorted(storage.keys(namespace)):
+        if key.startswith(prefix):
+            trigger = retrieve_data(key, 0, namespace)
+            if isinstance(trigger, dict) and trigger.get("poem"):
+                lines.append(f"{key[len(prefix):]} 觸發特殊事件並吟詩")
+    return "\n".join(lines)
+
+
+class DayRollover:
+    '''
+    :param agents: 角色 dict (預設為 schedule.agents)
+    :param day_length: 每隔幾秒自動換日，None 表示只在呼叫 advance() 時換日
+    :param prefetch: 是否在背景預先產生明天的整天行程 (lazy planning 時設為 False，
+                     明天只寫入回憶，行程等有人查詢時才產生)
+    '''
+
+    def __init__(self, agents: Optional[dict] = None,
+                 day_length: Optional[float] = None, prefetch: bool = True):
+        self.agents = agents or schedule.agents
+        self.day_length = day_length
+        self.prefetch = prefetch
+        self.day = 1
+        self._next_ready = None  # 明天的行程產生完成時 set 的 threading.Event
+        self._lock = threading.Lock()
+        self.stats = {'rollovers': 0, 'waited_s': 0.0}
+
+    def start(self):
+        '''
+        以目前 storage 中最新的一天 (例如從持久化後端載入的) 作為今天，
+        開始在背景產生明天，並依 day_length 啟動自動換日
+        '''
+        days = [int(m.group(1)) for ns in storage.stats()['namespaces']
+                if (m := re.fullmatch(rf"{NAMESPACE_PREFIX}(\d+)", ns))]
+        self.day = max(days, default=1)
+        storage.set_namespace(namespace_of(self.day))
+        self._prepare(self.day + 1)
+        if self.day_length:
+            threading.Thread(target=self._timer, daemon=True).start()
+        print(f"[rollover] 今天是 {namespace_of(self.day)}")
+
+    def _timer(self):
+        while True:
+            time.sleep(self.day_length)
+            self.advance()
+
+    def _prepare(self, day: int):
+        ready = threading.Event()
+        self._next_ready = ready
+        threading.Thread(target=self._generate, args=(day, ready),
+                         daemon=True).start()
+
+    def _generate(self, day: int, ready: threading.Event):
+        try:
+            if self.prefetch:
+                # 等今天的每小時行程產生後再整理成回憶；所有角色共用同一個期限，
+                # 逾時後以已經產生的部分整理，計畫失敗的角色不會各自再拖 MEMORY_WAIT 秒
+                deadline = time.monotonic() + MEMORY_WAIT
+                for agent in self.agents.values():
+                    retrieve_data(f"sch_{agent.name}_hour",
+                                  max(0, deadline - time.monotonic()),
+                                  namespace_of(day - 1))
+                self._write_memories(day)
+                with storage.use_namespace(namespace_of(day)):
+                    asyncio.run(self._plan_all())
+        finally:
+            ready.set()
+
+    def _write_memories(self, day: int):
+        previous = namespace_of(day - 1)
+        for agent in self.agents.values():
+            memory = summarize_day(agent.name, previous)
+            if memory:
+                add_data(f"memory_{agent.name}", memory, namespace_of(day))
+
+    async def _plan_all(self):
+        failures = await schedule.plan_agents_async(self.agents)
+        for name, res in failures.items():
+            print(f"[rollover] {name} 明天的計畫失敗: {res}")
+
+    def advance(self):
+        '''
+        換到下一天：明天的行程通常早已產生完成，只需切換命名空間；
+        若還沒完成則等它完成後再切換
+        '''
+        with self._lock:
+            start = time.perf_counter()
+            self._next_ready.wait()
+            self.stats['waited_s'] += time.perf_counter() - start
+
+            if not self.prefetch:
+                # 明天的行程之後才依需求產生，回憶在換日時才整理，包含今天完整的經歷
+                self._write_memories(self.day + 1)
+            self.day += 1
+            storage.set_namespace(namespace_of(self.day))
+            self.stats['rollovers'] += 1
+            if self.day - KEEP_DAYS - 1 >= 1:
+                dropped = namespace_of(self.day - KEEP_DAYS - 1)
+                storage.drop_namespace(dropped)
+                planner.forget(dropped)
+            self._prepare(self.day + 1)
+        print(f"[rollover] 換日至 {namespace_of(self.day)}")
+
+
+# 目前使用中的換日排程，None 表示不換日 (只有一天)
+_active: Optional[DayRollover] = None
+
+
+def start(day_length: Optional[float] = None,
+          prefetch: bool = True) -> DayRollover:
+    global _active
+    _active = DayRollover(day_length=day_length, prefetch=prefetch)
+    _active.start()
+    return _active
+
+
+def active() -> Optional[DayRollover]:
+    return _active
@@ -0,0 +1,68 @@
+# 角色名冊 (agent roster)
+# 角色不寫死在程式中，改從 JSON 或 CSV 名冊載入，增減角色只需修改名冊檔案。
+#
+# JSON：物件的陣列，或以角色 id 為 key 的物件
+#   [{"id": "li", "name": "李白", "age": "45歲", ...}, ...]
+# CSV：第一列為欄位名稱
+#   id,name,age,personality,style,home,relation,rules
+#
+# Flask 版 (backend_app) 也使用同一份名冊：persona_summary 可直接寫在名冊中，
+# 沒有時由上述欄位組成；initial_location 為選填欄位。
+
+import csv
+import json
+import os
+import sys
+
+# 預設的名冊 (schedule.agents)
+ROSTER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'agents.json')
+
+
+def load_roster(path: str) -> list[dict]:
+    '''
+    :param path: .json 或 .csv 名冊
+    :return(list[dict]): 每個角色一列，依名冊中的順序；欄位值為字串，空白欄位為 None
+    '''
+    if path.lower().endswith('.csv'):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            rows = [{'id': agent_id, **row} for agent_id, row in data.items()]
+        else:
+            rows = data
+
+    result = []
+    for i, row in enumerate(rows):
+        if not row.get('name'):
+            raise ValueError(f"{path} 第 {i + 1} 個角色缺少 name")
+        # 大量角色常共用相同的住所、風格等文字，intern 後只保留一份
+        row = {key: sys.intern(str(value)) if value not in (None, '') else None
+               for key, value in row.items()}
+        row['id'] = row.get('id') or row['name']
+        result.append(row)
+    return result
+
+
+# 組成 persona_summary 時使用的欄位與標題
+_PERSONA_FIELDS = (('age', '年齡'), ('personality', '性格'), ('style', '生活風格'),
+                   ('home', '住所'), ('relation', '與其他人的關係'))
+
+
+def persona_summary(row: dict) -> str:
+    '''
+    :param row: load_roster 的一列
+    :return(str): 名冊中的 persona_summary，沒有時由 age、personality 等欄位組成
+    :raise ValueError: 名冊中沒有任何可描述角色的欄位
+    '''
+    if row.get('persona_summary'):
+        return row['persona_summary']
+    parts = [f"{title}：{row[field]}" for field, title in _PERSONA_FIELDS
+             if row.get(field)]
+    if not parts:
+        raise ValueError(f"角色 {row['name']} 缺少 persona_summary 或 "
+                         f"{'、'.join(field for field, _ in _PERSONA_FIELDS)} 欄位")
+    return "；".join(parts)
@@ -1,97 +1,225 @@
+import asyncio
 import json
+import os
 from operator import add
 from re import split
 
 from poem import get_deepseek_poem
-from trigger import check_special_events
-from format_content import schedule_text2json_array
+from trigger import check_special_events, check_special_events_batch, \
+    check_special_events_batch_async
+from format_content import schedule_text2json_array, SlotStreamParser
 from prompt import PROMPT
-from llm import get_llm_response
+from llm import get_llm_response, get_llm_response_async, \
+    get_llm_response_stream_async
 from storage import add_data, retrieve_data
+import roster
+
+# 15 分鐘規劃是否以串流方式取得：每個時段一生成完就寫入 storage，不必等整天的回應
+STREAM_15_MINUTE = True
+# 15 分鐘規劃分段平行產生時每段的小時數，0 表示整天一次產生
+WINDOW_HOURS = 6
+# 每段產生的結果不完整時最多重試幾次 (只重試該段)
+WINDOW_RETRIES = 2
+# 同時規劃一整天的角色數上限 (固定數量的 worker)，LLM 請求數另由 llm 的並行上限限制
+PLAN_WORKERS = 32
 
 
 class Agent:
+    # 角色數可能上千個，不為每個角色配置 __dict__
+    __slots__ = ('name', 'age', 'personality', 'style', 'home', 'relation',
+                 'rules_name')
+
     def __init__(self, name: str, age: str, personality: str, style: str,
-                 home: str, relation: str):
+                 home: str, relation: str, rules_name: str | None = None):
         self.name = name
         self.age = age
         self.personality = personality
         self.style = style
         self.home = home
         self.relation = relation
+        # 沿用哪個角色的特殊事件條件 (event_rules.SPECIAL_EVENT_RULES 的 key)，None 為自己的
+        self.rules_name = rules_name
         
-    def plan_hour(self):
-        text = PROMPT['scheduler']['one_hour'].substitute(
+    def _hour_prompt(self):
+        return PROMPT['scheduler']['one_hour'].substitute(
             role_name=self.name,
             old=self.age,
             personality=self.personality,
             style=self.style,
             home=self.home,
-            relation=self.relation
-        )
-        # print(text)
-        # print('-' * 20)
-        res = get_llm_response(
-            prompt_text=text,
-            provider='gemini'
+            relation=self.relation,
+            # 換日時由 rollover 寫入前一天的摘要
+            memory=retrieve_data(f"memory_{self.name}", 0) or "（無）"
         )
 
-        processed_res = schedule_text2json_array(res)
-        # print(res)
+    def _15_minute_prompt(self, hour_schedule: dict[str, dict]):
+        return PROMPT['scheduler']['15_minute'].substitute(
+            role_name=self.name,
+            old=self.age,
+            personality=self.personality,
+            style=self.style,
+            home=self.home,
+            relation=self.relation,
+            hour_schedule=hour_schedule
+        )
 
-        pretty = json.dumps(
-            processed_res,
-            ensure_ascii=False,
-            indent=2
+    def _15_minute_window_prompt(self, hour_schedule: dict[str, dict],
+                                 window: list[str]):
+        hours = sorted(hour_schedule)
+        first, last = hours.index(window[0]), hours.index(window[-1])
+        # 前後各一個小時的行程讓各段之間的活動可以銜接
+        context = {h: hour_schedule[h]
+                   for h in hours[max(0, first - 1):first] + hours[last + 1:last + 2]}
+        return PROMPT['scheduler']['15_minute_window'].substitute(
+            role_name=self.name,
+            old=self.age,
+            personality=self.personality,
+            style=self.style,
+            home=self.home,
+            relation=self.relation,
+            start_time=window[0],
+            end_time=f"{window[-1][:2]}:45",
+            context=context,
+            hour_schedule={h: hour_schedule[h] for h in window}
         )
-        # print(pretty)
-        
+
+    def _save_hour(self, res: str):
+        processed_res = schedule_text2json_array(res)
         add_data(
             f"sch_{self.name}_hour",
             processed_res
         )
-        
         return processed_res
 
-    def plan_15_minute(self, hour_schedule: dict[str, dict]):
-        
-        text = PROMPT['scheduler']['15_minute'].substitute(
-            role_name='李白',
-            old='25歲',
-            personality='崇尚自由、自信驕傲、喜歡喝酒',
-            style='隨意、喜歡即興創作與喝酒',
-            home='目前被流放，晚上睡在河邊',
-            relation='與莊子是好友，與李清照有些許曖昧關係',
-            hour_schedule=hour_schedule
+    def _save_15_minute(self, res: str):
+        processed_res = schedule_text2json_array(res)
+        add_data(
+            f"sch_{self.name}_15_minute",
+            processed_res
         )
+        return processed_res
+
+    def plan_hour(self):
+        text = self._hour_prompt()
         # print(text)
         # print('-' * 20)
         res = get_llm_response(
             prompt_text=text,
             provider='gemini'
         )
+        return self._save_hour(res)
 
-        processed_res = schedule_text2json_array(res)
-        # print(res)
+    def plan_15_minute(self, hour_schedule: dict[str, dict]):
+        text = self._15_minute_prompt(hour_schedule)
+        # print(text)
+        # print('-' * 20)
+        res = get_llm_response(
+            prompt_text=text,
+            provider='gemini'
+        )
+        return self._save_15_minute(res)
 
-        pretty = json.dumps(
-            processed_res,
-            ensure_ascii=False,
-            indent=2
+    async def plan_hour_async(self):
+        res = await get_llm_response_async(
+            prompt_text=self._hour_prompt(),
+            provider='gemini'
         )
-        # print(pretty)
-        
+        return self._save_hour(res)
+
+    async def plan_15_minute_async(self, hour_schedule: dict[str, dict]):
+        if WINDOW_HOURS:
+            return await self.plan_15_minute_windowed_async(hour_schedule)
+        if STREAM_15_MINUTE:
+            return await self.plan_15_minute_stream_async(hour_schedule)
+        res = await get_llm_response_async(
+            prompt_text=self._15_minute_prompt(hour_schedule),
+            provider='gemini'
+        )
+        return self._save_15_minute(res)
+
+    async def plan_15_minute_stream_async(self, hour_schedule: dict[str, dict]):
+        """
+        串流取得 15 分鐘規劃，每個 "hh:mm": {...} 一完整出現就寫入
+        sch_<name>_15_minute_<hh:mm>，最後再照常寫入整天的 sch_<name>_15_minute
+        """
+        parser = SlotStreamParser()
+        async for chunk in get_llm_response_stream_async(
+                prompt_text=self._15_minute_prompt(hour_schedule),
+                provider='gemini'):
+            for key, slot in parser.feed(chunk):
+                add_data(f"sch_{self.name}_15_minute_{key}", slot)
+        return self._save_15_minute(parser.text)
+
+    async def plan_15_minute_windowed_async(self, hour_schedule: dict[str, dict],
+                                            window_hours: int = None):
+        """
+        把每小時行程切成數段 (每段 window_hours 小時) 同時細分成 15 分鐘，
+        合併後寫入與整天一次產生相同的 sch_<name>_15_minute；
+        某一段的回應不完整時只重試那一段
+        """
+        window_hours = window_hours or WINDOW_HOURS
+        hours = sorted(hour_schedule)
+        windows = [hours[i:i + window_hours]
+                   for i in range(0, len(hours), window_hours)]
+        results = await asyncio.gather(
+            *(self.expand_window_async(hour_schedule, window)
+              for window in windows))
+        processed_res = {}
+        for res in results:
+            processed_res.update(res)
+        processed_res = dict(sorted(processed_res.items()))
         add_data(
             f"sch_{self.name}_15_minute",
             processed_res
         )
+        return processed_res
+
+    async def expand_window_async(self, hour_schedule: dict[str, dict],
+                                   window: list[str]):
+        prompt_text = self._15_minute_window_prompt(hour_schedule, window)
+        expected = {f"{h[:2]}:{m}" for h in window for m in ('00', '15', '30', '45')}
+        for attempt in range(WINDOW_RETRIES + 1):
+            parser = SlotStreamParser()
+            slots = {}
+            # 重試時不使用快取，避免拿到同一份不完整的回應
+            async for chunk in get_llm_response_stream_async(
+                    prompt_text=prompt_text, provider='gemini',
+                    use_cache=attempt == 0):
+                for key, slot in parser.feed(chunk):
+                    if key in expected:
+                        slots[key] = slot
+                        add_data(f"sch_{self.name}_15_minute_{key}", slot)
+            if expected <= slots.keys():
+                return slots
+            if attempt < WINDOW_RETRIES:
+                print(f"{self.name} {window[0]}~{window[-1]} 的 15 分鐘規劃不完整，"
+                      f"重試 ({attempt + 1}/{WINDOW_RETRIES})")
+        raise ValueError(
+            f"{self.name} {window[0]}~{window[-1]} 的 15 分鐘規劃重試後仍不完整")
 
-        return processed_res  # 美化版本，適合輸出
+    async def plan_day_async(self):
+        """
+        在 event loop 上跑完一整天的規劃流程：
+        plan_hour → plan_15_minute → 拆成每 15 分鐘 → 特殊事件判斷
 
-    def check_and_add_trigger(self, event):
+        storage 接上持久化後端時，重新啟動後已完成的步驟不會再呼叫 LLM
+        """
+        if retrieve_data(f"sch_{self.name}_done", 0):
+            return
+        if retrieve_data(f"sch_{self.name}_15_minute", 0) is None:
+            hour_schedule = retrieve_data(f"sch_{self.name}_hour", 0)
+            if hour_schedule is None:
+                hour_schedule = await self.plan_hour_async()
+            await self.plan_15_minute_async(hour_schedule)
+        await self.split_plan_to_each_15_minute_async()
+        add_data(f"sch_{self.name}_done", True)
+
+    def check_and_add_trigger(self, event, result=None):
         # 這裡可以添加觸發器的邏輯
         # 例如，檢查是否有特殊事件需要觸發
-        result = check_special_events(event, self.name)
+        # result 已由批次判斷算好時就不再逐筆呼叫 LLM
+        if result is None:
+            result = check_special_events(event, self.name, self.rules_name)
         if type(result) != bool:
             result = False
             print(f"Error: {result}, set to False")
@@ -154,44 +282,100 @@ class Agent:
                 f"sch_{self.name}_15_minute_{key}",
                 json_text[key]
             )
-            self.check_and_add_trigger(json_text[key])
-
-
-agents = {
-    'li': Agent(
-        name='李白',
-        age='45歲',
-        personality='崇尚自由、自信驕傲、喜歡喝酒',
-        style='隨意、喜歡即興創作與喝酒',
-        home='目前被流放，晚上睡在河邊',
-        relation='與莊子是好友，與李清照有些許曖昧關係'
-    ),
-    "teacher_li":Agent(
-        name='李老師',
-        age='51歲',
-        personality='出口成章、對新科技非常了解',
-        style='吟詩，作息規律、早睡早起、起床後會運動',
-        home='書院',
-        relation='莊子的同事，李清照的老師'
-    ),
-    "li_qing_zhao":Agent(
-        name='李清照',
-        age='19歲',
-        personality='多愁善感、戀愛腦',
-        style='寫詞，作息規律，家境富有，是一個名副其實的大家閨秀,在書院念書',
-        home='李清照家',
-        relation='李昇暾和莊子的學生',
-    ),
-    "zhuang_zi":Agent(
-        name='莊子',
-        age='55歲',
-        personality='語言犀利、豁達灑脫、爽朗，人生閲歷豐富，對於人生乃至整個世界有獨屬自己的觀點',
-        style='開玩笑，容易失眠',
-        home='莊子家',
-        relation='李昇暾的同事，李清照的老師'
-    )
-
-}
+        # 整天的時段一次送去判斷，避免每個時段各打一次 LLM
+        special = check_special_events_batch(json_text, self.name,
+                                             rules_name=self.rules_name)
+        for key in json_text:
+            self.check_and_add_trigger(json_text[key], special.get(key))
+
+    async def split_plan_to_each_15_minute_async(self):
+        json_text = retrieve_data(f"sch_{self.name}_15_minute")
+        for key in json_text:
+            # 串流時已經寫入過的時段不再重複寫入
+            if retrieve_data(f"sch_{self.name}_15_minute_{key}", 0) \
+                    != json_text[key]:
+                add_data(
+                    f"sch_{self.name}_15_minute_{key}",
+                    json_text[key]
+                )
+        await self.trigger_slots_async(json_text)
+
+    async def trigger_slots_async(self, slots: dict[str, dict]):
+        """
+        批次判斷多個時段是否觸發特殊事件並寫入 trigger_<name>_<hh:mm>
+        """
+        special = await check_special_events_batch_async(
+            slots, self.name, rules_name=self.rules_name)
+        for key in slots:
+            if special.get(key):
+                # 可能要呼叫 DeepSeek 作詩並合成語音，丟到 thread 避免卡住 loop
+                await asyncio.to_thread(
+                    self.check_and_add_trigger, slots[key], True)
+            else:
+                self.check_and_add_trigger(slots[key], special.get(key))
+
+
+def build_agents(rows: list[dict]) -> dict:
+    '''
+    :param rows: roster.load_roster 的結果
+    :return(dict): 角色 id -> Agent，依名冊中的順序
+    '''
+    result = {}
+    for row in rows:
+        # rules 欄位：沿用另一個角色的特殊事件條件，只存在這個角色上，不影響其他名冊
+        result[row['id']] = Agent(
+            name=row['name'],
+            age=row.get('age') or '',
+            personality=row.get('personality') or '',
+            style=row.get('style') or '',
+            home=row.get('home') or '',
+            relation=row.get('relation') or '',
+            rules_name=row.get('rules')
+        )
+    return result
+
+
+def load_agents(path: str | None = None) -> dict:
+    '''
+    :param path: JSON/CSV 名冊，None 為 roster.ROSTER_FILE
+    :return(dict): 角色 id -> Agent
+    '''
+    return build_agents(roster.load_roster(path or roster.ROSTER_FILE))
+
+
+async def plan_agents_async(targets: dict | None = None,
+                            workers: int | None = None) -> dict:
+    '''
+    以固定數量的 worker 規劃多個角色一整天的行程，
+    角色再多也只有 workers 個角色同時在規劃中
+
+    :param targets: 角色 dict (預設為 schedule.agents)
+    :param workers: worker 數，None 為 PLAN_WORKERS
+    :return(dict): 規劃失敗的角色名稱 -> 例外
+    '''
+    if targets is None:
+        targets = agents
+    queue = asyncio.Queue()
+    for agent in targets.values():
+        queue.put_nowait(agent)
+    failures = {}
+
+    async def worker():
+        while not queue.empty():
+            agent = queue.get_nowait()
+            try:
+                await agent.plan_day_async()
+            except Exception as e:
+                failures[agent.name] = e
+
+    await asyncio.gather(
+        *(worker() for _ in range(max(1, min(workers or PLAN_WORKERS,
+                                             len(targets))))))
+    return failures
+
+
+# 有設定 agent_roster 環境變數時改用該名冊
+agents = load_agents(os.getenv('agent_roster'))
 
 # agents['li'].plan_hour()
 # minutes_plan = agents['li'].plan_15_minute(
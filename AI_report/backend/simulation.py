@@ -1,4 +1,6 @@
 from backend_app import Agent
+from event import get_normal_event
+import re
 import time
 import random
 import json
@@ -6,7 +8,10 @@ from datetime import datetime, timedelta
 from llm import get_llm_response
 
 class GameSimulation:
-    def __init__(self):
+    def __init__(self, tick_delay=0.5, plan_delay=1):
+        # tick_delay / plan_delay 為展示用的暫停秒數，壓力測試時設為 0
+        self.tick_delay = tick_delay
+        self.plan_delay = plan_delay
         self.agents = []
         self.current_time = datetime.strptime("06:00", "%H:%M")
         self.end_time = datetime.strptime("23:00", "%H:%M")
@@ -56,17 +61,18 @@ class GameSimulation:
         for agent in self.agents:
             print(f"為 {agent.name} 生成日程...")
             agent.generate_daily_plan(self.current_date_str)
-            time.sleep(1)  # 避免API請求過快
+            time.sleep(self.plan_delay)  # 避免API請求過快
     
     def generate_random_events(self, num_events=3):
         """生成一些隨機事件，這些事件會在一天中的隨機時間發生"""
         for _ in range(num_events):
-            # 使用Agent類中的靜態方法獲取隨機事件
-            event_description = Agent.get_normal_event()
+            # 使用 event.py 的函式獲取隨機事件
+            event_description = get_normal_event()
             # 解析事件描述以獲取時間、地點等信息
             event_lines = event_description.strip().split('\n')
             event_info = {}
             for line in event_lines:
+                line = line.replace('：', ':')  # LLM 回應使用全形冒號
                 if ':' in line:
                     key, value = line.split(':', 1)
                     event_info[key.strip()] = value.strip()
@@ -80,6 +86,8 @@ class GameSimulation:
                 elif len(time_str) == 4:  # 對於形如 "1030" 的時間，轉換為 "10:30"
                     hour, minute = time_str[:2], time_str[2:]
                     time_str = f"{hour}:{minute}"
+                if not re.fullmatch(r'\d\d:\d\d', time_str):
+                    continue  # 無法解析的時間
                 
                 self.events.append({
                     'time': time_str,
@@ -108,7 +116,8 @@ class GameSimulation:
                 # 更新相關代理的記憶
                 for agent in self.agents:
                     if agent.name in event['participants'] or agent.current_location == event['location']:
-                        agent.add_memory(current_time_str, f"見證/參與事件: {event['description']}")
+                        agent.add_memory(current_time_str, "event_witnessed",
+                                         f"見證/參與事件: {event['description']}", 6)
                 
                 print("=============================\n")
     
@@ -139,7 +148,7 @@ class GameSimulation:
             self.current_time += self.time_increment
             
             # 為了模擬效果，可以在這裡添加短暫暫停
-            time.sleep(0.5)  # 暫停0.5秒
+            time.sleep(self.tick_delay)  # 暫停0.5秒
         
         print(f"\n===== 結束模擬 {self.current_date_str} =====")
         
@@ -183,7 +192,7 @@ class GameSimulation:
             print(f"\n{agent.name} 的一天回顧:")
             
             # 構建提示以生成一天的總結
-            memory_text = "\n".join([f"{mem['time']}: {mem['description']}" for mem in agent.memory_stream[-10:]])
+            memory_text = "\n".join([f"{mem.timestamp}: {mem.description}" for mem in agent.memory_stream.latest(10)])
             prompt = f"""
             角色: {agent.name}
             角色人設: {agent.persona_summary}
@@ -204,7 +213,8 @@ class GameSimulation:
             print("明日將繼續前行，希望能有新的體驗與收穫。")
             
             # 添加到代理的記憶中
-            agent.add_memory(self.current_date_str, f"一天總結與反思: 今日經歷了{len(agent.memory_stream)}件事，有所收穫與感悟。")
+            agent.add_memory(self.current_date_str, "daily_reflection",
+                             f"一天總結與反思: 今日經歷了{len(agent.memory_stream)}件事，有所收穫與感悟。", 8)
 
 
 # 主函數
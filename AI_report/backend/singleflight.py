@@ -0,0 +1,95 @@
+# 相同請求合併 (single-flight)
+# 同一個 key 已經有請求在進行中時，後來的呼叫者不再重送，而是等第一個請求的結果。
+# 使用 concurrent.futures.Future，thread 與 asyncio 的呼叫者可以互相等待。
+# 執行中的 coroutine 被取消 (例如 client 斷線) 時不把取消傳給等待者，而是由等待者之一重新執行。
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+
+
+class _LeaderCancelled(Exception):
+    '''執行請求的呼叫者被取消，等待者應重新競爭執行'''
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'coalesced': 0}
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        '''回傳 (future, 是否由自己執行)'''
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self._stats['coalesced'] += 1
+                return fut, False
+            fut = Future()
+            # 標記為執行中：等待者被取消時 (asyncio.wrap_future) 不會連帶取消這個 future
+            fut.set_running_or_notify_cancel()
+            self._calls[key] = fut
+            self._stats['executed'] += 1
+            return fut, True
+
+    def _finish(self, key: str, fut: Future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    def do(self, key: str, func: Callable[[], object]):
+        '''
+        執行 func，若相同 key 已在進行中則等待該結果
+
+        :param key: 請求識別
+        :param func: 實際發送請求的函式
+        :return: func 的回傳值 (例外也會傳給所有等待者)
+        '''
+        while True:
+            fut, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return fut.result()
+            except _LeaderCancelled:
+                continue  # 原本執行的呼叫者被取消，重新競爭
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(key, fut, error=e)
+            raise
+        self._finish(key, fut, result=result)
+        return result
+
+    async def do_async(self, key: str, func: Callable[[], Awaitable]):
+        '''do 的 asyncio 版本，func 為回傳 coroutine 的函式'''
+        while True:
+            fut, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return await asyncio.wrap_future(fut)
+            except _LeaderCancelled:
+                continue  # 原本執行的呼叫者被取消，重新競爭
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # 取消只影響自己，等待者之一會重新執行
+            self._finish(key, fut, error=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._finish(key, fut, error=e)
+            raise
+        self._finish(key, fut, result=result)
+        return result
+
+    def stats(self) -> dict:
+        '''executed: 實際送出的請求數，coalesced: 被合併而省下的請求數'''
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
@@ -1,31 +1,438 @@
+import asyncio
+import sys
 import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
 
-# 全域快取與條件變數
-_cache = {}
-_cond = threading.Condition()
+# 全域快取
+# - 以命名空間 (例如 世界/日期) 分開存放，整個命名空間可以一次丟掉
+# - 總筆數與總位元組數超過上限時，淘汰最久沒被讀寫的資料 (LRU)；可另設存活時間 (TTL)
+# - 可接上持久化後端 (storage_backend.py)，寫入同時排入後端，重新啟動時從後端重建
+# - 每個還沒寫入的 key 各有一個等待者紀錄，寫入時只叫醒等這個 key 的執行緒，
+#   不會像全域 Condition.notify_all 一樣每次寫入都叫醒所有人。
+# - 每次寫入都有遞增的序號並留在一段有限長度的紀錄中，推播 (api.py 的 /api/events)
+#   可以從任一序號接續讀取
+DEFAULT_NAMESPACE = 'default'
+MAX_ENTRIES = 200_000
+MAX_BYTES = 256 * 1024 * 1024
+TTL = None  # 秒，None 表示不過期
+EVENT_LOG_SIZE = 10_000
+# 最多暫存幾筆還沒套用到 LRU 順序的讀取 (超過時最舊的讀取不再影響淘汰順序)
+HIT_LOG_SIZE = 65_536
 
+_cache = OrderedDict()  # (namespace, key) -> (data, 寫入時間, 估計位元組數)
+# 設定 TTL 時依寫入先後記下 (寫入時間, (namespace, key))，過期的資料從最左邊開始清除；
+# 被覆寫或已刪除的項目留在原處，輪到時略過
+_written = deque()
+_namespaces = {}  # namespace -> {key: None}，用來一次刪掉整個命名空間
+_usage = {}  # namespace -> [筆數, 位元組數]
+_bytes = 0
+_waiters = {}  # (namespace, key) -> [threading.Event, 等待人數, [(event loop, future)]]
+_lock = threading.Lock()
+# 讀取不取得鎖，只把讀到的 key 記下來；下一次寫入時在鎖內更新 _cache 的 LRU 順序
+_hits = deque(maxlen=HIT_LOG_SIZE)
+_current = DEFAULT_NAMESPACE
+# 只在目前的執行緒 / asyncio task 中改用的命名空間 (例如在背景產生明天的行程)
+_context_namespace = ContextVar('storage_namespace', default=None)
+_backend = None  # 持久化後端，None 表示只存在記憶體
+_seq = 0  # 最後一筆寫入的序號
+_events = deque(maxlen=EVENT_LOG_SIZE)  # (序號, namespace, key, data)
+_event_waiters = []  # 等待下一筆寫入的 (event loop, future)
 
-def add_data(key, data):
+_MISSING = object()
+
+
+def configure(max_entries=_MISSING, max_bytes=_MISSING, ttl=_MISSING):
+    """
+    設定快取上限，None 表示不限制；沒有傳入的參數維持原設定。
+    """
+    global MAX_ENTRIES, MAX_BYTES, TTL
+    with _lock:
+        if max_entries is not _MISSING:
+            MAX_ENTRIES = max_entries
+        if max_bytes is not _MISSING:
+            MAX_BYTES = max_bytes
+        if ttl is not _MISSING:
+            TTL = ttl
+            _rebuild_written()
+        _evict()
+
+
+def set_namespace(namespace):
     """
-    寫入資料並通知所有在等 key 的執行緒。
+    切換預設命名空間，之後沒有指定 namespace 的 add_data / retrieve_data 都使用它。
+    等待新寫入的推播 (wait_events_async) 會被叫醒，以便改推播新的命名空間。
+    """
+    global _current, _event_waiters
+    with _lock:
+        _current = namespace
+        subscribers, _event_waiters = _event_waiters, []
+    _notify(subscribers)
+
+
+def current_namespace():
+    return _context_namespace.get() or _current
+
+
+@contextmanager
+def use_namespace(namespace):
     """
-    with _cond:
-        _cache[key] = data
-        _cond.notify_all()
+    在 with 區塊內 (包含其中建立的 asyncio task 與 asyncio.to_thread)
+    沒有指定 namespace 的讀寫都使用 namespace，不影響其他執行緒看到的預設命名空間。
+    """
+    token = _context_namespace.set(namespace)
+    try:
+        yield
+    finally:
+        _context_namespace.reset(token)
+
+
+def _sizeof(data, _depth=0):
+    # 粗估物件佔用的位元組數 (含 dict / list 內容)
+    size = sys.getsizeof(data)
+    if _depth > 4:
+        return size
+    if isinstance(data, dict):
+        size += sum(_sizeof(k, _depth + 1) + _sizeof(v, _depth + 1)
+                    for k, v in data.items())
+    elif isinstance(data, (list, tuple, set)):
+        size += sum(_sizeof(v, _depth + 1) for v in data)
+    return size
+
+
+def _remove(full_key):
+    # 呼叫前必須持有 _lock
+    global _bytes
+    entry = _cache.pop(full_key, None)
+    if entry is None:
+        return
+    namespace, key = full_key
+    keys = _namespaces.get(namespace)
+    if keys is not None:
+        keys.pop(key, None)
+    usage = _usage[namespace]
+    usage[0] -= 1
+    usage[1] -= entry[2]
+    _bytes -= entry[2]
+    if not usage[0]:
+        _namespaces.pop(namespace, None)
+        _usage.pop(namespace, None)
+
+
+def _apply_hits():
+    # 呼叫前必須持有 _lock；把讀取紀錄套用到 LRU 順序
+    while _hits:
+        full_key = _hits.popleft()
+        if full_key in _cache:
+            _cache.move_to_end(full_key)
+
+
+def _rebuild_written():
+    # 呼叫前必須持有 _lock；依目前 _cache 中的寫入時間重建 _written
+    _written.clear()
+    if TTL is not None:
+        _written.extend(sorted((entry[1], full_key)
+                               for full_key, entry in _cache.items()))
+
 
+def _purge_expired():
+    # 呼叫前必須持有 _lock；刪除所有過期的資料，不佔用筆數與位元組數的上限
+    if TTL is None:
+        return
+    deadline = time.monotonic() - TTL
+    while _written and _written[0][0] < deadline:
+        written_at, full_key = _written.popleft()
+        entry = _cache.get(full_key)
+        if entry is not None and entry[1] == written_at:
+            _remove(full_key)
+    # 同一個 key 反覆覆寫會留下許多略過的項目，數量遠多於資料時重建
+    if len(_written) > 2 * len(_cache) + 1024:
+        _rebuild_written()
 
-def retrieve_data(key, timeout=None):
+
+def _evict():
+    # 呼叫前必須持有 _lock；先清除過期的資料，再從最久沒用到的資料開始淘汰
+    _purge_expired()
+    _apply_hits()
+    while _cache and (
+            (MAX_ENTRIES is not None and len(_cache) > MAX_ENTRIES) or
+            (MAX_BYTES is not None and _bytes > MAX_BYTES)):
+        _remove(next(iter(_cache)))
+
+
+def _expired(entry):
+    return TTL is not None and time.monotonic() - entry[1] > TTL
+
+
+def _store(full_key, data):
+    # 呼叫前必須持有 _lock；回傳等這個 key 的等待者 (可能為 None)
+    global _bytes
+    size = _sizeof(data)
+    _remove(full_key)
+    now = time.monotonic()
+    _cache[full_key] = (data, now, size)
+    if TTL is not None:
+        _written.append((now, full_key))
+    _namespaces.setdefault(full_key[0], {})[full_key[1]] = None
+    usage = _usage.setdefault(full_key[0], [0, 0])
+    usage[0] += 1
+    usage[1] += size
+    _bytes += size
+    _evict()
+    return _waiters.pop(full_key, None)
+
+
+def add_data(key, data, namespace=None):
+    """
+    寫入資料並通知在等 key 的執行緒。
+    """
+    global _seq, _event_waiters
+    full_key = (namespace or _context_namespace.get() or _current, key)
+    with _lock:
+        waiter = _store(full_key, data)
+        if _backend is not None:
+            # 只把原始資料排入佇列 (維持與 drop 的先後順序)，序列化與寫入由後端的背景執行緒批次完成
+            _backend.put(full_key[0], key, data)
+        _seq += 1
+        _events.append((_seq, full_key[0], key, data))
+        subscribers, _event_waiters = _event_waiters, []
+    if waiter is not None:
+        _wake(waiter)
+    _notify(subscribers)
+
+
+def _lookup(full_key):
+    # 不取得鎖：dict 的查詢與 deque 的 append 都不會改動 _cache 的順序，
+    # 不會與持有鎖的 _evict 走訪 _cache 衝突；LRU 順序留到下一次寫入時更新
+    entry = _cache.get(full_key)
+    if entry is None or _expired(entry):
+        return _MISSING
+    _hits.append(full_key)
+    return entry[0]
+
+
+def _join(full_key):
+    # 回傳 (已存在的資料, None) 或 (_MISSING, 這個 key 的等待者紀錄)
+    with _lock:
+        # 取得鎖後再確認一次，避免在兩次檢查之間剛好被寫入
+        entry = _cache.get(full_key)
+        if entry is not None:
+            if not _expired(entry):
+                return entry[0], None
+            _remove(full_key)
+        waiter = _waiters.get(full_key)
+        if waiter is None:
+            waiter = _waiters[full_key] = [threading.Event(), 0, []]
+        waiter[1] += 1
+        return _MISSING, waiter
+
+
+def _leave(full_key, waiter, future=None):
+    with _lock:
+        waiter[1] -= 1
+        if future is not None and future in waiter[2]:
+            waiter[2].remove(future)
+        # 逾時且沒有其他人在等時移除，避免查不存在的 key 讓 _waiters 一直變大
+        if waiter[1] == 0 and _waiters.get(full_key) is waiter:
+            del _waiters[full_key]
+        entry = _cache.get(full_key)
+        return None if entry is None or _expired(entry) else entry[0]
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _notify(subscribers):
+    # 叫醒各 event loop 上等待的 coroutine
+    for loop, future in subscribers:
+        try:
+            loop.call_soon_threadsafe(_set_done, future)
+        except RuntimeError:
+            pass  # event loop 已關閉
+
+
+def _wake(waiter):
+    # 由寫入的執行緒呼叫：叫醒阻塞中的執行緒，並通知各 event loop 上等待的 coroutine
+    waiter[0].set()
+    with _lock:
+        # 先 set 再複製清單；retrieve_data_async 在鎖內檢查 set 後才登記，不會漏掉
+        futures = list(waiter[2])
+    _notify(futures)
+
+
+def retrieve_data(key, timeout=None, namespace=None):
     """
     取出指定 key 的資料：
-      - 如果已經在 _cache 裡，立即回傳。
-      - 否則就阻塞等到 add_data 通知、或 timeout。
-    """
-    with _cond:
-        # 等到 key 出現或 timeout
-        if key not in _cache:
-            _cond.wait_for(lambda: key in _cache, timeout=timeout)
-        return _cache.get(key)
+      - 如果已經在 _cache 裡，立即回傳 (不需要取得鎖)。
+      - 否則就阻塞等到 add_data 寫入這個 key、或 timeout。
+    """
+    full_key = (namespace or _context_namespace.get() or _current, key)
+    data = _lookup(full_key)
+    if data is not _MISSING:
+        return data
+
+    data, waiter = _join(full_key)
+    if waiter is None:
+        return data
+    waiter[0].wait(timeout)
+    return _leave(full_key, waiter)
+
+
+async def retrieve_data_async(key, timeout=None, namespace=None):
+    """
+    retrieve_data 的 asyncio 版本：等待期間不佔用執行緒，
+    add_data (可能在其他執行緒) 寫入時透過 call_soon_threadsafe 喚醒。
+    """
+    full_key = (namespace or _context_namespace.get() or _current, key)
+    data = _lookup(full_key)
+    if data is not _MISSING:
+        return data
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    item = (loop, future)
+    data, waiter = _join(full_key)
+    if waiter is None:
+        return data
+    with _lock:
+        if waiter[0].is_set():
+            # 在 _join 與登記 future 之間剛好被寫入
+            future.set_result(None)
+        else:
+            waiter[2].append(item)
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    except asyncio.CancelledError:
+        _leave(full_key, waiter, item)
+        raise
+    return _leave(full_key, waiter, item)
+
+
+def last_seq():
+    return _seq
+
+
+def events_since(seq):
+    """
+    取得序號大於 seq 的寫入紀錄
+
+    :return(tuple): (紀錄 list，每筆為 (序號, namespace, key, data)；
+                     是否無法接續：紀錄已經被擠掉，或 seq 比目前的序號還大
+                     (伺服器重新啟動後序號從 0 開始))
+    """
+    with _lock:
+        if seq > _seq:
+            return [], True
+        if not _events or seq == _seq:
+            return [], seq < _seq - len(_events)
+        first = _events[0][0]
+        return list(islice(_events, max(0, seq + 1 - first), None)), seq + 1 < first
+
+
+async def wait_events_async(seq, timeout=None):
+    """
+    events_since 的等待版本：還沒有新的寫入時，等到有寫入、切換預設命名空間或 timeout
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    item = (loop, future)
+    with _lock:
+        # seq 比目前的序號大時 (序號已重置) 不等待，直接回傳需要 reset
+        registered = _seq == seq
+        if registered:
+            _event_waiters.append(item)
+    if registered:
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with _lock:
+                if item in _event_waiters:
+                    _event_waiters.remove(item)
+    return events_since(seq)
+
+
+def keys(namespace=None):
+    """
+    列出命名空間中目前的 key (不含已過期的)
+    """
+    with _lock:
+        _purge_expired()
+        return list(_namespaces.get(namespace or _context_namespace.get() or _current, ()))
+
+
+def drop_namespace(namespace):
+    """
+    一次刪除整個命名空間 (例如過完的一天)，回傳刪除的筆數。
+    """
+    with _lock:
+        removed = list(_namespaces.get(namespace, ()))
+        for key in removed:
+            _remove((namespace, key))
+        if _backend is not None:
+            _backend.drop(namespace)
+        return len(removed)
+
+
+def attach_backend(backend, namespaces=None):
+    """
+    接上持久化後端，並以後端中的資料重建記憶體快取 (依寫入先後，超過上限時保留最新的)。
+
+    :param backend: 提供 put / drop / load / flush / close 的物件，例如 storage_backend.SQLiteBackend
+    :param namespaces: 只載入這些命名空間，None 表示全部
+    :return(int): 載入的筆數
+    """
+    global _backend
+    count = 0
+    woken = []
+    with _lock:
+        _backend = backend
+        for namespace, key, data in backend.load(namespaces):
+            waiter = _store((namespace, key), data)
+            if waiter is not None:
+                woken.append(waiter)
+            count += 1
+    for waiter in woken:
+        _wake(waiter)
+    return count
+
+
+def detach_backend():
+    """
+    寫完尚未寫入的資料後關閉持久化後端。
+    """
+    global _backend
+    with _lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        backend.close()
+
+
+def stats():
+    """
+    每個命名空間的筆數與估計位元組數，以及整體用量與上限 (不含已過期的資料)。
+    """
+    with _lock:
+        _purge_expired()
+        return {
+            'namespaces': {ns: {'entries': n, 'bytes': b}
+                           for ns, (n, b) in _usage.items()},
+            'entries': len(_cache),
+            'bytes': _bytes,
+            'max_entries': MAX_ENTRIES,
+            'max_bytes': MAX_BYTES,
+            'ttl': TTL,
+            'waiting_keys': len(_waiters),
+            'backend': None if _backend is None else _backend.stats(),
+        }
 
 
 # def gen_data(id, content):
@@ -0,0 +1,224 @@
+# storage 的持久化後端
+# storage.add_data 只把寫入放進佇列，背景執行緒每隔一小段時間把累積的寫入
+# 在同一個 transaction 中一次寫進 SQLite (group commit)，不會拖慢產生行程的流程。
+# 重新啟動時以 load() 依寫入先後讀回所有資料，重建 storage 的記憶體快取。
+# 序列化在背景執行緒進行：add_data 之後不可再修改寫入的物件 (storage 的讀取也回傳同一個物件)，
+# 資料必須能直接轉成 JSON，無法轉換的那筆會被略過並記錄在 stats 中。
+#
+# 其他後端只要提供相同的 put / drop / load / flush / close 方法即可替換。
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+_DROP = object()
+_FLUSH = object()
+_STOP = object()
+
+
+class SQLiteBackend:
+    '''
+    :param path: SQLite 檔案路徑 (使用 WAL 模式)
+    :param batch_size: 一次 commit 最多包含的寫入數
+    :param flush_interval: 收到第一筆寫入後最多等多久就 commit (秒)
+    :param max_pending: 佇列中最多幾筆還沒寫入的操作，滿了時 put 會等待背景執行緒消化
+    '''
+
+    def __init__(self, path: str, batch_size: int = 512,
+                 flush_interval: float = 0.05, max_pending: int = 100_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._db_lock = threading.Lock()
+        self._stats = {'written': 0, 'commits': 0, 'dropped_namespaces': 0,
+                       'unserializable': 0, 'lost': 0}
+        self._error = None  # 背景寫入執行緒因錯誤停止時的例外
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 只在斷電時可能遺失最後幾筆 commit，不會損毀資料庫
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS storage ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_storage_updated"
+            " ON storage(updated_at)"
+        )
+        self._db.commit()
+
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def put(self, namespace: str, key: str, data):
+        '''
+        排入一筆寫入 (storage 持有鎖時呼叫，序列化留給背景執行緒)；佇列已滿時等待背景執行緒消化
+
+        背景執行緒已因錯誤停止時 (錯誤已印出一次) 直接丟棄，只計入 stats 的 lost；
+        記憶體中的 storage 仍可繼續使用，flush / close 會拋出該錯誤。
+        '''
+        self._enqueue((namespace, key, data, time.time()))
+
+    def drop(self, namespace: str):
+        '''排入刪除整個命名空間 (與之前排入的寫入保持先後順序)'''
+        self._enqueue((_DROP, namespace))
+
+    def _enqueue(self, op):
+        if self._error is not None:
+            self._stats['lost'] += 1
+            return
+        self._queue.put(op)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        '''
+        等到目前排入的寫入都已 commit
+
+        :return(bool): 是否在 timeout 內完成
+        :raise RuntimeError: 背景寫入執行緒已因錯誤停止
+        '''
+        self._raise_if_failed()
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # 寫入執行緒可能在等待期間停止，定期確認而不是無限期等待
+        while not done.wait(0.1 if deadline is None
+                            else max(0, min(0.1, deadline - time.monotonic()))):
+            self._raise_if_failed()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(
+                f"SQLite 寫入執行緒已停止: {self._error!r}") from self._error
+
+    def load(self, namespaces: Optional[Iterable[str]] = None
+             ) -> Iterator[tuple[str, str, object]]:
+        '''
+        依寫入先後讀回資料
+
+        :param namespaces: 只讀回這些命名空間，None 表示全部
+        :return: (namespace, key, data) 的 iterator
+        '''
+        sql = "SELECT namespace, key, value FROM storage"
+        params = []
+        if namespaces is not None:
+            namespaces = list(namespaces)
+            sql += f" WHERE namespace IN ({','.join('?' * len(namespaces))})"
+            params = namespaces
+        sql += " ORDER BY updated_at"
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+        for namespace, key, value in rows:
+            yield namespace, key, json.loads(value)
+
+    def namespaces(self) -> list[str]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT namespace FROM storage").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        '''寫完佇列中剩下的資料後關閉'''
+        if self._writer.is_alive():
+            self._queue.put((_STOP,))
+            self._writer.join()
+        with self._db_lock:
+            self._db.close()
+        self._raise_if_failed()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['error'] = None if self._error is None else repr(self._error)
+        return stats
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except Exception as e:
+            # 記錄錯誤讓 flush / close 拋出，並叫醒已在等待的 flush
+            self._error = e
+            print(f"[storage_backend] SQLite 寫入失敗，停止寫入: {e!r}")
+            while True:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op[0] is _FLUSH:
+                    op[1].set()
+
+    def _write_loop(self):
+        while True:
+            ops = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # 收集一小段時間內的寫入，合併成一次 commit
+            while len(ops) < self.batch_size and ops[-1][0] not in (
+                    _FLUSH, _STOP):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    ops.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if not self._commit(ops):
+                return
+
+    def _commit(self, ops: list) -> bool:
+        '''寫入一批操作，回傳 False 表示收到停止指令'''
+        rows = []
+        waiting = []
+        running = True
+        with self._db_lock:
+            for op in ops:
+                if op[0] is _DROP:
+                    self._write_rows(rows)
+                    rows = []
+                    self._db.execute(
+                        "DELETE FROM storage WHERE namespace = ?", (op[1],))
+                    self._stats['dropped_namespaces'] += 1
+                elif op[0] is _FLUSH:
+                    waiting.append(op[1])
+                elif op[0] is _STOP:
+                    running = False
+                else:
+                    namespace, key, data, updated_at = op
+                    try:
+                        value = json.dumps(data, ensure_ascii=False)
+                    except (TypeError, ValueError) as e:
+                        # 不能轉成 JSON 的資料無法在重新啟動時還原，略過這筆
+                        self._stats['unserializable'] += 1
+                        print(f"[storage_backend] 無法寫入 {namespace}/{key}: {e!r}")
+                        continue
+                    rows.append((namespace, key, value, updated_at))
+            self._write_rows(rows)
+            self._db.commit()
+            self._stats['commits'] += 1
+        for done in waiting:
+            done.set()
+        return running
+
+    def _write_rows(self, rows: list):
+        if not rows:
+            return
+        self._db.executemany(
+            "INSERT INTO storage (namespace, key, value, updated_at)"
+            " VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, key) DO UPDATE SET"
+            " value = excluded.value, updated_at = excluded.updated_at",
+            rows
+        )
+        self._stats['written'] += len(rows)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 後端模組以平面方式互相 import (例如 `import storage`)，測試時從 backend 目錄載入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+import json
+
+from format_content import SlotStreamParser
+
+SLOTS = {
+    "00:00": {"time": "00:00", "activity": "吟詩 \"將進酒\"", "location": "河邊"},
+    "00:15": {"time": "00:15", "activity": "寫下 {大括號} 與 [方括號]",
+              "think": "反斜線 \\ 與 } 不會結束時段", "location": "酒館"},
+    "00:30": {"time": "00:30", "activity": "散步",
+              "detail": {"with": ["莊子", {"mood": "好"}]}, "location": "書院"},
+}
+RESPONSE = ("以下是行程：\n```json\n"
+            + json.dumps(SLOTS, ensure_ascii=False, indent=2)
+            + "\n```\n之後的文字 {\"09:00\": {}} 不會被解析")
+
+
+def _feed_in_chunks(text, size):
+    parser = SlotStreamParser()
+    found = []
+    for start in range(0, len(text), size):
+        found.extend(parser.feed(text[start:start + size]))
+    return parser, found
+
+
+def test_whole_response():
+    parser, found = _feed_in_chunks(RESPONSE, len(RESPONSE))
+    assert dict(found) == SLOTS
+    assert parser.done
+
+
+def test_every_chunk_boundary():
+    # 一次一個字元：切點會落在字串、跳脫字元與巢狀括號之中
+    for size in (1, 2, 3, 7):
+        parser, found = _feed_in_chunks(RESPONSE, size)
+        assert [key for key, _ in found] == list(SLOTS)
+        assert dict(found) == SLOTS
+        assert parser.done
+
+
+def test_slot_is_returned_as_soon_as_it_closes():
+    parser = SlotStreamParser()
+    first = json.dumps(SLOTS["00:00"], ensure_ascii=False)
+    assert parser.feed('```json\n{"00:00": ' + first[:-1]) == []
+    assert parser.feed(first[-1] + ', "00:15": {"time"') == [
+        ("00:00", SLOTS["00:00"])]
+    assert not parser.done
+
+
+def test_escaped_key():
+    parser = SlotStreamParser()
+    found = parser.feed('{"0\\u0030:00": {"a": "\\"}\\""}}')
+    assert found == [("00:00", {"a": "\"}\""})]
+    assert parser.done
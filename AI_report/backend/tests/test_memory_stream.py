@@ -0,0 +1,54 @@
+from memory_stream import MemoryStream
+
+
+def _fill(stream, items):
+    for i, (memory_type, related) in enumerate(items):
+        stream.append(f"t{i}", memory_type, f"d{i}", 1, related)
+
+
+def _descriptions(records):
+    return [r.description for r in records]
+
+
+def test_wraparound_evicts_oldest():
+    stream = MemoryStream(3)
+    _fill(stream, [("a", ()), ("b", ()), ("a", ()), ("c", ()), ("b", ())])
+
+    assert len(stream) == 3
+    assert _descriptions(stream) == ["d2", "d3", "d4"]
+    assert _descriptions(stream.latest(2)) == ["d3", "d4"]
+    assert _descriptions(stream.latest(10)) == ["d2", "d3", "d4"]
+    # 被擠掉的記憶也從類型索引中移除
+    assert _descriptions(stream.latest(10, "a")) == ["d2"]
+    assert _descriptions(stream.latest(10, "b")) == ["d4"]
+
+
+def test_latest_merges_types_in_order():
+    stream = MemoryStream(4)
+    _fill(stream, [("a", ()), ("b", ()), ("c", ()), ("a", ()), ("b", ()),
+                   ("c", ())])
+
+    # 緩衝區內為 d2..d5
+    assert _descriptions(stream.latest(3, ("a", "b"))) == ["d3", "d4"]
+    assert _descriptions(stream.latest(2, ("a", "c"))) == ["d3", "d5"]
+    assert _descriptions(stream.latest(1, ("a", "b", "c"))) == ["d5"]
+    assert _descriptions(stream.latest(10, ("a", "a"))) == ["d3"]
+    assert stream.latest(0, ("a",)) == []
+    assert stream.latest(5, ("missing",)) == []
+
+
+def test_related_to_after_wrap_and_duplicate_ids():
+    stream = MemoryStream(3)
+    _fill(stream, [("a", ["x"]), ("a", ["x", "x", "y"]), ("a", ["y"]),
+                   ("a", ["x"]), ("a", ["z", "x"])])
+
+    # 緩衝區內為 d2..d4；重複的 id 只索引一次
+    assert _descriptions(stream.related_to("x", 10)) == ["d3", "d4"]
+    assert _descriptions(stream.related_to("y", 10)) == ["d2"]
+    assert _descriptions(stream.related_to("x", 1)) == ["d4"]
+    assert stream.related_to("missing", 3) == []
+
+    # 再寫一輪後，舊的索引都已清除
+    _fill(stream, [("a", ()), ("a", ()), ("a", ())])
+    assert stream.related_to("x", 10) == []
+    assert stream.related_to("y", 10) == []
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("google.api_core")
+
+from rate_limit import AdaptiveConcurrency, RateLimiter  # noqa: E402
+
+
+def test_aimd_grows_and_halves_once_per_cooldown():
+    limit = AdaptiveConcurrency(initial=4, maximum=8, cooldown=60)
+    # 成功一次加 1/limit，約一輪 (limit 次) 加 1
+    for _ in range(5):
+        limit.on_success()
+    assert int(limit.limit) == 5
+
+    before = limit.limit
+    limit.on_throttle()
+    limit.on_throttle()  # 同一個 cooldown 內只砍一次
+    assert limit.limit == pytest.approx(before / 2)
+
+    for _ in range(1000):
+        limit.on_success()
+    assert limit.limit == 8
+
+
+def test_async_acquire_respects_limit():
+    limiter = RateLimiter(rpm=1e6, tpm=1e9, initial_concurrency=3,
+                          max_concurrency=3)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        async with limiter.slot("x"):
+            peak = max(peak, limiter.concurrency.in_flight)
+            await asyncio.sleep(0.005)
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(*(job() for _ in range(30))), 5)
+
+    asyncio.run(main())
+    assert peak == 3
+    assert limiter.stats()['completed'] == 30
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_release_from_thread_wakes_coroutine_and_cancel_hands_over():
+    limit = AdaptiveConcurrency(initial=1, maximum=1)
+
+    async def main():
+        await limit.acquire_async()
+        cancelled = asyncio.ensure_future(limit.acquire_async())
+        waiter = asyncio.ensure_future(limit.acquire_async())
+        await asyncio.sleep(0.01)
+
+        # 被叫醒的等待者在取得名額前取消，名額交給下一個
+        threading.Timer(0.01, limit.release).start()
+        cancelled.cancel()
+        await asyncio.wait_for(waiter, 2)
+        assert limit.in_flight == 1
+        assert not limit._async_waiters
+
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_followers_share_leader_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "result"
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(flight.do("k", work)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(
+        target=lambda: results.append(flight.do("k", work)))
+        for _ in range(3)]
+    for t in followers:
+        t.start()
+    while flight.stats()['coalesced'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(2)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'coalesced': 3, 'in_flight': 0}
+
+
+def test_leader_error_propagates_to_followers():
+    flight = SingleFlight()
+
+    async def main():
+        async def fail():
+            await asyncio.sleep(0.02)
+            raise ValueError("boom")
+
+        return await asyncio.gather(
+            *(flight.do_async("k", fail) for _ in range(3)),
+            return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert flight.stats()['executed'] == 1
+
+
+def test_leader_cancel_hands_over_to_follower():
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(flight.do_async("k", work))
+                     for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    # 取消只影響原本的呼叫者，等待者之一重新執行一次，其餘共用結果
+    assert asyncio.run(main()) == [2, 2, 2]
+    assert len(runs) == 2
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_follower_cancel_does_not_affect_others():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.ensure_future(flight.do_async("k", work))
+        other = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        return await leader, await other, cancelled.cancelled()
+
+    assert asyncio.run(main()) == ("done", "done", True)
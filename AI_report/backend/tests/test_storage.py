@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def ns():
+    # storage 是模組層級的全域狀態，每個測試使用自己的命名空間
+    namespace = f"test_{uuid.uuid4().hex}"
+    yield namespace
+    storage.drop_namespace(namespace)
+
+
+def _waiting(namespace):
+    return [key for key in storage._waiters if key[0] == namespace]
+
+
+def test_blocking_waiter_is_woken_by_write(ns):
+    results = []
+    readers = [threading.Thread(
+        target=lambda: results.append(storage.retrieve_data("k", 2, ns)))
+        for _ in range(3)]
+    for t in readers:
+        t.start()
+    while not _waiting(ns) or storage._waiters[(ns, "k")][1] < 3:
+        time.sleep(0.001)
+
+    start = time.perf_counter()
+    storage.add_data("k", {"v": 1}, ns)
+    for t in readers:
+        t.join(2)
+
+    assert results == [{"v": 1}] * 3
+    assert time.perf_counter() - start < 1
+    # 寫入時等待者紀錄已移除，_leave 不會留下殘餘
+    assert _waiting(ns) == []
+
+
+def test_write_to_other_key_does_not_wake(ns):
+    results = []
+    reader = threading.Thread(
+        target=lambda: results.append(storage.retrieve_data("a", 0.2, ns)))
+    reader.start()
+    while not _waiting(ns):
+        time.sleep(0.001)
+    storage.add_data("b", 1, ns)
+    reader.join(2)
+
+    assert results == [None]
+    assert _waiting(ns) == []
+
+
+def test_timeout_removes_waiter(ns):
+    assert storage.retrieve_data("missing", 0.01, ns) is None
+    assert _waiting(ns) == []
+
+
+def test_existing_key_returns_without_waiting(ns):
+    storage.add_data("k", [1, 2], ns)
+    start = time.perf_counter()
+    assert storage.retrieve_data("k", 5, ns) == [1, 2]
+    assert time.perf_counter() - start < 0.1
+
+
+
+def test_async_waiter_is_woken_from_another_thread(ns):
+    async def main():
+        timer = threading.Timer(0.05, storage.add_data, ("k", "v", ns))
+        timer.start()
+        start = time.perf_counter()
+        data = await storage.retrieve_data_async("k", 2, ns)
+        return data, time.perf_counter() - start
+
+    data, elapsed = asyncio.run(main())
+    assert data == "v"
+    assert elapsed < 1
+    assert _waiting(ns) == []
+
+
+def test_async_write_between_join_and_register(ns, monkeypatch):
+    # 在 _join 回傳等待者之後、登記 future 之前剛好寫入：不能等到逾時
+    join = storage._join
+
+    def join_then_write(full_key):
+        data, waiter = join(full_key)
+        storage.add_data(full_key[1], "raced", full_key[0])
+        return data, waiter
+
+    monkeypatch.setattr(storage, "_join", join_then_write)
+
+    async def main():
+        start = time.perf_counter()
+        data = await storage.retrieve_data_async("k", 2, ns)
+        return data, time.perf_counter() - start
+
+    data, elapsed = asyncio.run(main())
+    assert data == "raced"
+    assert elapsed < 1
+    assert _waiting(ns) == []
+
+
+def test_async_timeout_and_cancel_remove_waiter(ns):
+    async def main():
+        assert await storage.retrieve_data_async("missing", 0.01, ns) is None
+        task = asyncio.ensure_future(
+            storage.retrieve_data_async("missing", 5, ns))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert _waiting(ns) == []
+
+
+def test_ttl_purges_expired_entries(ns):
+    storage.configure(ttl=0.05)
+    try:
+        storage.add_data("old", 1, ns)
+        time.sleep(0.1)
+        storage.add_data("new", 2, ns)
+
+        assert storage.keys(ns) == ["new"]
+        assert storage.stats()['namespaces'][ns]['entries'] == 1
+        assert storage.retrieve_data("old", 0, ns) is None
+    finally:
+        storage.configure(ttl=None)
@@ -1,24 +1,184 @@
-from llm import get_llm_response
+import asyncio
+import json
 
+from llm import get_llm_response, get_llm_response_async
+from format_content import schedule_text2json_array
+import event_rules
 
-def check_special_events(event, name):
+GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
 
-    # 使用與 backend_app.py 中相同的邏輯，但正確設置 event 變量
-    prompt = f"""請爲我判斷以下事件是否符合特殊事件的條件
-        判斷事件：{name}:{event}
-        特殊事件條件：1）李白：晚上李白準備睡覺時
+# 批次判斷時，一次送給 LLM 的時段數 (96 = 一整天的 15 分鐘時段)
+SPECIAL_EVENT_BATCH_SIZE = 96
+
+_SPECIAL_EVENT_RULES = """特殊事件條件：1）李白：晚上李白準備睡覺時
                     2）莊子：莊子到河邊時
                     3）李清照：李清照在自家庭院中思考時
                     4）李昇暾：李昇暾作詩時
-        以上條件任只要滿足其中一條即判斷其為特殊事件
+        以上條件任只要滿足其中一條即判斷其為特殊事件"""
+
+
+def check_special_events(event, name, rules_name=None):
+    # 規則明確的時段直接在本地判定，不呼叫 LLM
+    settled, _ = event_rules.prefilter({'_': event}, name,
+                                       rules_name=rules_name)
+    if settled:
+        return settled['_']
+    return _ask_llm(event, name)
+
+
+def _single_prompt(event, name):
+    # 使用與 backend_app.py 中相同的邏輯，但正確設置 event 變量
+    return f"""請爲我判斷以下事件是否符合特殊事件的條件
+        判斷事件：{name}:{event}
+        {_SPECIAL_EVENT_RULES}
         若是特殊事件，回應"True"，否則則回應"False"，你的回復必須嚴格遵照規則
         """
 
+
+def _ask_llm(event, name):
     # 調用 LLM API 獲取結果
-    GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
     result = get_llm_response(
-        prompt, provider='gemini', model_name=GEMINI_MODEL_NAME)
+        _single_prompt(event, name), provider='gemini',
+        model_name=GEMINI_MODEL_NAME)
 
     # 處理結果字符串，確保返回真正的布爾值
     is_special = result.strip().lower() == "true"
     return is_special
+
+
+async def _ask_llm_async(event, name):
+    result = await get_llm_response_async(
+        _single_prompt(event, name), provider='gemini',
+        model_name=GEMINI_MODEL_NAME)
+    return result.strip().lower() == "true"
+
+
+def check_special_events_batch(events: dict[str, dict], name: str,
+                               batch_size: int = SPECIAL_EVENT_BATCH_SIZE,
+                               rules_name: str | None = None
+                               ) -> dict[str, bool]:
+    '''
+    一次判斷多個時段是否為特殊事件
+
+    先以 event_rules 的本地規則判定，只有模稜兩可的時段才送給 LLM；
+    每 batch_size 個時段只呼叫一次 LLM，要求回傳 {"hh:mm": true/false}。
+    若回應格式錯誤或缺少時段，將該批對半切開重試，
+    切到只剩一個時段時改為逐筆詢問 LLM。
+
+    :param events: 15 分鐘行程 {"hh:mm": {"time": ..., "activity": ...}}
+    :param name: 角色名稱
+    :param batch_size: 每次送給 LLM 的時段數
+    :param rules_name: 本地規則使用哪個角色的條件 (名冊的 rules 欄位)
+    :return(dict[str, bool]): 每個時段是否為特殊事件
+    '''
+    result, windows = _prepare_batches(events, name, batch_size, rules_name)
+    for window in windows:
+        result.update(_classify_window(window, name))
+    # 保持與輸入相同的時段順序
+    return {k: result[k] for k in events}
+
+
+async def check_special_events_batch_async(
+        events: dict[str, dict], name: str,
+        batch_size: int = SPECIAL_EVENT_BATCH_SIZE,
+        rules_name: str | None = None) -> dict[str, bool]:
+    '''check_special_events_batch 的 asyncio 版本，各批次同時送出'''
+    result, windows = _prepare_batches(events, name, batch_size, rules_name)
+    for part in await asyncio.gather(
+            *(_classify_window_async(w, name) for w in windows)):
+        result.update(part)
+    return {k: result[k] for k in events}
+
+
+def _prepare_batches(events, name, batch_size, rules_name=None):
+    if batch_size < 1:
+        raise ValueError(f"batch_size 必須大於 0: {batch_size}")
+
+    result, ambiguous = event_rules.prefilter(events, name,
+                                              rules_name=rules_name)
+    keys = list(ambiguous.keys())
+    windows = [
+        {k: ambiguous[k] for k in keys[start:start + batch_size]}
+        for start in range(0, len(keys), batch_size)
+    ]
+    return result, windows
+
+
+def _batch_prompt(window, name):
+    events_text = json.dumps(window, ensure_ascii=False, indent=2)
+    return f"""請爲我逐一判斷以下 {name} 的每個時段事件是否符合特殊事件的條件
+        判斷事件（key 為時段）：
+```json
+{events_text}
+```
+        {_SPECIAL_EVENT_RULES}
+        請以JSON輸出如下格式，每個時段都必須出現，值只能是 true 或 false：
+```json
+{{
+  "hh:mm": true,
+  ...
+}}
+```
+        你的回復必須嚴格遵照規則
+        """
+
+
+def _parse_batch(res, window, name):
+    '''解析批次判斷結果，格式錯誤時回傳 None'''
+    try:
+        data = schedule_text2json_array(res)
+        if not isinstance(data, dict) or \
+                any(not isinstance(data.get(k), bool) for k in window):
+            raise ValueError("批次判斷結果缺少時段或不是布林值")
+        return {k: data[k] for k in window}
+    except ValueError as e:  # json.JSONDecodeError 也是 ValueError
+        print(f"{name} 批次判斷失敗({len(window)} 個時段)，切半重試: {e}")
+        return None
+
+
+def _halves(window):
+    keys = list(window.keys())
+    half = len(keys) // 2
+    return ({k: window[k] for k in keys[:half]},
+            {k: window[k] for k in keys[half:]})
+
+
+def _classify_window(window: dict[str, dict], name: str) -> dict[str, bool]:
+    if not window:
+        return {}
+    if len(window) == 1:
+        (key, event), = window.items()
+        return {key: _ask_llm(event, name)}
+
+    res = get_llm_response(
+        _batch_prompt(window, name), provider='gemini',
+        model_name=GEMINI_MODEL_NAME)
+    parsed = _parse_batch(res, window, name)
+    if parsed is not None:
+        return parsed
+
+    first, second = _halves(window)
+    result = _classify_window(first, name)
+    result.update(_classify_window(second, name))
+    return result
+
+
+async def _classify_window_async(window: dict[str, dict], name: str
+                                 ) -> dict[str, bool]:
+    if not window:
+        return {}
+    if len(window) == 1:
+        (key, event), = window.items()
+        return {key: await _ask_llm_async(event, name)}
+
+    res = await get_llm_response_async(
+        _batch_prompt(window, name), provider='gemini',
+        model_name=GEMINI_MODEL_NAME)
+    parsed = _parse_batch(res, window, name)
+    if parsed is not None:
+        return parsed
+
+    first, second = _halves(window)
+    a, b = await asyncio.gather(_classify_window_async(first, name),
+                                _classify_window_async(second, name))
+    return {**a, **b}
@@ -518,6 +518,10 @@ const poem_png = {
 const GAME_SPEED = 3000;
 const BACKEND_API_URL = 'http://localhost:8000/api/status';
 const POEM_API_URL = 'http://localhost:8000/api/check_poem';
+const TICK_API_URL = 'http://localhost:8000/api/tick';
+const AGENTS_API_URL = 'http://localhost:8000/api/agents';
+// 載入時以後端名冊 (/api/agents) 取代，後端連不上時使用預設的四個角色
+let AGENT_NAMES = ['李白', '李清照', '李老師', '莊子'];
 
 const TARGET_AGENT_ID = 'li_xiucai';
 const TARGET_LOCATION_NAME = '書院';
@@ -826,7 +830,20 @@ const currentPositions = {};
 async function updateCharacterStatus(name, time) {
   try {
     // 1. 拿到後端回傳的狀態
-    const { time: t, activity, think, location: newLocation } = await fetchStatus(time, name);
+    applyCharacterStatus(name, await fetchStatus(time, name));
+  } catch (err) {
+    console.error(`更新角色狀態失敗：${err.message}`, err);
+  }
+}
+
+/**
+ * 依後端回傳的狀態移動角色並更新顯示
+ * @param {string} name - 角色名稱
+ * @param {Object} status - { time, activity, think, location }
+ */
+function applyCharacterStatus(name, status) {
+  try {
+    const { time: t, activity, think, location: newLocation } = status;
 
     // 2. 讀取並儲存之前的位置，若沒紀錄則預設從 newLocation 自身開始
     const prevLocation = currentPositions[name] || newLocation;
@@ -869,16 +886,8 @@ function goToNextTime() {
     currentIndex++;
   }
   const nextTime = timeSlots[currentIndex];
-  // 真正的角色狀態更新呼叫
-  updateCharacterStatus('李白', nextTime);
-  updateCharacterStatus('李清照', nextTime);
-  updateCharacterStatus('李老師', nextTime);
-  updateCharacterStatus('莊子', nextTime);
-
-  fetchPoem('李白', nextTime);
-  fetchPoem('李清照', nextTime);
-  fetchPoem('李老師', nextTime);
-  fetchPoem('莊子', nextTime);
+  // 一次取得所有角色的狀態與詩詞
+  fetchTick(nextTime);
   // 同步更新畫面上的時間顯示（可選）
   document.getElementById('game-time-display').textContent = `時間: ${nextTime}`;
 }
@@ -889,10 +898,7 @@ function goToPrevTime() {
     currentIndex--;
     const prevTime = timeSlots[currentIndex];
     // 更新所有角色
-    updateCharacterStatus('李白', prevTime);
-    updateCharacterStatus('李清照', prevTime);
-    updateCharacterStatus('李老師', prevTime);
-    updateCharacterStatus('莊子', prevTime);
+    AGENT_NAMES.forEach(name => updateCharacterStatus(name, prevTime));
     // 更新畫面上的時間顯示
     gameTimeDisplay.textContent = `時間: ${prevTime}`;
   }
@@ -901,6 +907,9 @@ function goToPrevTime() {
 let autoInterval = null;
 
 document.addEventListener('DOMContentLoaded', () => {
+  // 名冊中的角色可能不只預設的四個
+  loadAgentNames();
+
   const playBtn = document.getElementById('play-pause-button');
   const nextBtn = document.getElementById('next-step-button');
   const prevBtn = document.getElementById('prev-step-button');
@@ -1246,6 +1255,23 @@ async function fetchPoem(name, time) {
     // 解析 JSON
     const data = await response.json();
     console.log('fetchPoem 回傳資料：', data);
+    return handlePoem(name, time, data);
+  } catch (err) {
+    console.error('fetchPoem 發生錯誤：', err);
+    return null;
+  }
+}
+
+/**
+ * 依 /api/check_poem 或 /api/tick 回傳的詩詞資料決定是否顯示吟詩視窗
+ * @param {string} name - 角色名稱
+ * @param {string} time - 時間字串，例如 '00:15'
+ * @param {Object|null} data - 後端回傳的詩詞資料
+ * @returns {Object|null}
+ */
+function handlePoem(name, time, data) {
+  try {
+    if (!data || shownPoemAgents.has(name)) return data;
 
     // 判斷是否需要顯示吟詩視窗
     const shouldShowPoem = data.time_ === true || data[time] === true;
@@ -1262,7 +1288,68 @@ async function fetchPoem(name, time) {
 
     return data;
   } catch (err) {
-    console.error('fetchPoem 發生錯誤：', err);
+    console.error('handlePoem 發生錯誤：', err);
+    return null;
+  }
+}
+
+/**
+ * 從後端 /api/agents 取得名冊中的角色，並為 HTML 中沒有狀態區塊的角色建立一個
+ */
+async function loadAgentNames() {
+  try {
+    const response = await fetch(AGENTS_API_URL, {
+      method: 'GET',
+      headers: { 'Accept': 'application/json' }
+    });
+    if (!response.ok) {
+      console.error(`agents API 回應錯誤：${response.status} ${response.statusText}`);
+      return;
+    }
+    const data = await response.json();
+    AGENT_NAMES = data.agents.map(agent => agent.name);
+    const panel = document.getElementById('status-panel');
+    for (const name of AGENT_NAMES) {
+      if (panel && !document.getElementById(`status-${name}`)) {
+        const box = document.createElement('div');
+        box.id = `status-${name}`;
+        box.className = 'status-box border rounded-lg p-2 bg-white shadow';
+        box.textContent = name;
+        panel.appendChild(box);
+      }
+    }
+  } catch (err) {
+    console.error('loadAgentNames 發生錯誤：', err);
+  }
+}
+
+/**
+ * 向後端 /api/tick 一次取得所有角色在 time 的狀態與詩詞，
+ * 取代每個角色各打一次 /api/status 與 /api/check_poem
+ * @param {string} time - 時間字串，例如 '00:15'
+ * @param {string[]} names - 角色名稱
+ */
+async function fetchTick(time, names = AGENT_NAMES) {
+  try {
+    const params = new URLSearchParams({ time });
+    names.forEach(name => params.append('names', name));
+    const response = await fetch(`${TICK_API_URL}?${params.toString()}`, {
+      method: 'GET',
+      headers: { 'Accept': 'application/json' }
+    });
+    if (!response.ok) {
+      console.error(`tick API 回應錯誤：${response.status} ${response.statusText}`);
+      return null;
+    }
+
+    const data = await response.json();
+    for (const [name, { status, poem }] of Object.entries(data.agents)) {
+      if (status) applyCharacterStatus(name, status);
+      handlePoem(name, time, poem);
+    }
+    return data;
+  } catch (err) {
+    console.error('fetchTick 發生錯誤：', err);
     return null;
   }
 }